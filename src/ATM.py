@@ -12,24 +12,84 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import time
+import weakref
+
+from AccountLocks import AccountLocks
+from AccountStore import AccountStore
+from AccountView import AccountView
+from BankAccount import BankAccount
 from DatabaseScript import DatabaseScript
+from LazyRecords import LazyRecords
 from RecordsLoader import RecordsLoader
 
 
 class ATM:
     """Primitive model of an ATM machine
 
-    * Performs pin validation
+    * Performs pin validation, or card authentication against salted pin hashes
     * Contains a menu and simulated keypad for user interaction
+    * Serializes concurrent transactions on the same account
+    * Dispenses withdrawals from cash cassettes, rejecting amounts the notes left can't make up
+    * Evaluates withdrawals and transfers against fraud and velocity rules
+    * Transfers between accounts atomically without deadlocks
+    * Provides mini statements of the latest transactions of an account
+    * Notifies registered listeners of the transactions performed on the accounts it loads
     """
 
-    def __init__(self):
+    def __init__(self, database_file="accounts.db", loading_mode=RecordsLoader.EAGER,
+                 cache_size=LazyRecords.DEFAULT_CACHE_SIZE, pool=None, journal=None,
+                 history=None, authenticator=None, dispenser=None, refresher=None, rules=None):
         """Initializes the object by loading its memory with the bank account records from the database.
 
+        With the 'RecordsLoader.LAZY' loading mode the records are not read up front, instead each record is fetched
+        by pin the first time it is needed and at most 'cache_size' records are kept in memory.
+
+        With a 'TransactionJournal' the memory is recovered from the latest snapshot of the journal and the records
+        journaled after it, instead of the database, and every transaction is journaled. A journal can't be combined
+        with the 'RecordsLoader.LAZY' loading mode as a snapshot needs every record in memory.
+
+        With an 'AccountRefresher' the changes made to the accounts table by other processes are applied to the records
+        in memory as they are polled, the refresher must be created before the ATM so no change made while the records
+        are loaded is missed.
+
+        :param database_file: Name of the database file with the bank account records
+        :param loading_mode: One of the 'RecordsLoader' loading mode class constants
+        :param cache_size: Maximum number of cached records when loading lazily
+        :param pool: 'ConnectionPool' shared with other components, used by lazily loaded records
+        :param journal: 'TransactionJournal' to recover the records from and to journal the transactions to
+        :param history: 'TransactionHistory' to record the transactions to and to read the statements from
+        :param authenticator: 'PinAuthenticator' verifying the pins of the cards for 'authenticate'
+        :param dispenser: 'CashDispenser' with the notes paid out by withdrawals
+        :param refresher: 'AccountRefresher' polling the changes made to the accounts table by other processes
+        :param rules: 'FraudRules' every withdrawal is evaluated against
         :return: ATM object with its memory initialized with the database records
         """
-        DatabaseScript.load_database("accounts.db")
-        self.__memory__ = RecordsLoader.load_records("accounts.db")
+        DatabaseScript.load_database(database_file)
+        DatabaseScript.migrate_database(database_file)
+        self.__listeners__ = []
+        self.__locks__ = AccountLocks()
+        self.__pins__ = None
+        self.__pins_lock__ = threading.Lock()
+        self.__deleted__ = weakref.WeakSet()
+        if journal is None:
+            self.__memory__ = RecordsLoader.load(database_file, loading_mode, cache_size, pool)
+        else:
+            if loading_mode == RecordsLoader.LAZY:
+                raise Exception("A transaction journal requires the records to be loaded in memory")
+            self.__memory__ = journal.recover(lambda: RecordsLoader.load(database_file, loading_mode))
+            journal.set_snapshot_source(self.accounts)
+            self.add_listener(journal)
+        self.__history__ = history
+        self.__authenticator__ = authenticator
+        self.__dispenser__ = dispenser
+        self.__refresher__ = refresher
+        self.__rules__ = rules
+        if history is not None:
+            self.add_listener(history)
+        if refresher is not None:
+            refresher.start(self)
 
     def validate_pin(self, pin):
         """Checks if the pin is valid
@@ -37,18 +97,62 @@ class ATM:
         Checks that the argument passed in is of type 'str' else an error message is displayed and no operation is
         performed.
 
+        The accounts whose pins are enrolled by 'PinAuthenticator' have no pin to validate and are only reached through
+        'authenticate', their record keys are never valid pins.
+
         :param pin: Pin to perform validation
         :return: True if the pin is valid else returns False
         """
         if self.param_is_good(pin):
-            return pin in self.__memory__
+            return not pin.startswith(DatabaseScript.CARD_KEY_PREFIX) and pin in self.__memory__
+
+    def authenticate(self, account_number, pin):
+        """Verifies the pin entered for a card with the authenticator of the ATM.
+
+        Failed attempts are counted across sessions and processes and the card is locked after too many of them. If
+        the ATM has no authenticator an 'Exception' is raised.
+
+        :param account_number: Account number of the card
+        :param pin: Pin entered for the card
+        :return: One of the 'PinAuthenticator' GRANTED, DENIED or LOCKED class constants
+        """
+        if self.__authenticator__ is None:
+            raise Exception("The ATM has no authenticator")
+        if self.param_is_good(account_number) and self.param_is_good(pin):
+            return self.__authenticator__.authenticate(account_number, pin)
+
+    def remaining_attempts(self, account_number):
+        """Get the number of failed attempts a card may still make before it is locked.
+
+        :param account_number: Account number of the card
+        :return: Number of attempts, zero(0) if the card is locked
+        """
+        if self.__authenticator__ is None:
+            raise Exception("The ATM has no authenticator")
+        return self.__authenticator__.remaining_attempts(account_number)
+
+    def uses_cards(self):
+        """Checks if sessions authenticate with a card number and pin rather than with a pin alone."""
+        return self.__authenticator__ is not None
 
     @staticmethod
     def menu():
         """Provides a menu for the interface."""
-        print("Press 1 for withdraw")
-        print("Press 2 for deposit")
-        print("Press 3 for account balance")
+        for line in ATM.menu_lines():
+            print(line)
+
+    @staticmethod
+    def menu_lines():
+        """Provides the lines of the menu for interfaces that don't print to the console.
+
+        :return: List with the lines of the menu
+        """
+        return ["Press 1 for withdraw",
+                "Press 2 for deposit",
+                "Press 3 for account balance",
+                "Press 4 for mini statement",
+                "Press 5 for transfer",
+                "Press 6 for statement by date range"]
 
     def get_input(self, message):
         """Get input from the user.
@@ -72,7 +176,336 @@ class ATM:
         :return: Bank account record associated with the pin
         """
         if self.param_is_good(pin):
-            return self.__memory__.get(pin)
+            account = self.__memory__.get(pin)
+            if account is not None:
+                account.set_observer(self)
+            return account
+
+    def find_account(self, account_number):
+        """Get the bank account record associated with an account number.
+
+        Checks that the argument passed in is of type 'str' else an error message is displayed and no operation is
+        performed.
+
+        Records held in memory are located through an index of their pins by account number built on first use, lazily
+        loaded records are located with a query of the database.
+
+        :param account_number: Account number to locate the associated bank account record
+        :return: Bank account record associated with the account number else None
+        """
+        if self.param_is_good(account_number):
+            if isinstance(self.__memory__, LazyRecords):
+                pin = self.__memory__.find_pin(account_number)
+            else:
+                with self.__pins_lock__:
+                    if self.__pins__ is None:
+                        self.__pins__ = {account.get_account_number(): pin for pin, account in self.accounts()}
+                pin = self.__pins__.get(account_number)
+            return None if pin is None else self.load_account(pin)
+
+    def accounts(self):
+        """Get the bank account records held in memory.
+
+        If the records are loaded lazily an 'Exception' is raised as only the cached records are in memory.
+
+        :return: Iterable of (pin, bank account) pairs
+        """
+        if isinstance(self.__memory__, LazyRecords):
+            raise Exception("The records are loaded lazily, only the cached records are in memory")
+        return self.__memory__.items()
+
+    def withdraw(self, account, amount):
+        """Withdraws the amount from the account while holding the lock of the account.
+
+        Concurrent sessions must withdraw through this method so that two withdrawals on the same account can't both
+        pass the balance check before either of them has decremented the balance.
+
+        If the ATM has fraud rules the withdrawal is evaluated against them and rejected if a rule denies it. If the ATM
+        has a cash dispenser the notes are taken from its cassettes before the balance is decremented, an amount no
+        combination of the notes left adds up to is rejected. The balance of a rejected withdrawal is never touched.
+
+        :param account: Bank account loaded by this ATM
+        :param amount: Amount to withdraw
+        :return: Amount withdrawn, zero(0) if the balance is insufficient, a rule denies the withdrawal, the amount
+                 can't be dispensed or the account was deleted from the database
+        """
+        account_number = account.get_account_number()
+        with self.__locks__.lock_for(account_number):
+            if self.__is_deleted__(account):
+                return 0
+            if self.__dispenser__ is None and self.__rules__ is None:
+                return account.withdraw(amount)
+            if type(amount) != int:
+                raise Exception("Invalid argument: amount of type {} should be: <class 'int'>".format(type(amount)))
+            if amount > account.get_balance():
+                return 0
+            if self.__rules__ is not None and self.__rules__.evaluate(account_number, amount) is not None:
+                return 0
+            if self.__dispenser__ is not None and self.__dispenser__.dispense(amount) is None:
+                return 0
+            account.withdraw(amount)
+            if self.__rules__ is not None:
+                self.__rules__.record(account_number, amount)
+            return amount
+
+    def deposit(self, account, amount):
+        """Deposits the amount into the account while holding the lock of the account.
+
+        :param account: Bank account loaded by this ATM
+        :param amount: Amount to deposit
+        :return: True if the amount was deposited, False if the account was deleted from the database
+        """
+        with self.__locks__.lock_for(account.get_account_number()):
+            if self.__is_deleted__(account):
+                return False
+            account.deposit(amount)
+            return True
+
+    def transfer(self, source_number, destination_number, amount):
+        """Moves an amount from one account to another as a single transaction.
+
+        The locks of both accounts are held while the balances change, and acquired in a fixed order so transfers in
+        opposite directions can't deadlock, while transfers between other accounts proceed concurrently. The listeners
+        are notified of both sides of the transfer at once, so the database records both balances in a single SQLite
+        transaction.
+
+        Checks that the argument 'amount' passed in is of type 'int' else an 'Exception' is raised.
+
+        If the ATM has fraud rules the amount moved out of the source account is evaluated and recorded as a
+        withdrawal of the source account, so a limit can't be bypassed by transferring the money out.
+
+        :param source_number: Account number of the account debited
+        :param destination_number: Account number of the account credited
+        :param amount: Amount to move
+        :return: True if the transfer was made, False if an account doesn't exist or was deleted, both are the same
+                 account, the amount isn't positive, the balance of the source account is insufficient or a rule denies
+                 it
+        """
+        return self.transfer_batch(((source_number, destination_number, amount),))[0]
+
+    def transfer_batch(self, transfers, chunk_size=256):
+        """Performs many transfers, such as a payroll run, as efficiently as possible.
+
+        Transfers are applied in chunks, the locks of all the accounts of a chunk are acquired once in a fixed order
+        and the listeners are notified of the whole chunk at once, so the database records a chunk in a single SQLite
+        transaction. Each transfer succeeds or fails on its own, as if it was made with 'transfer', and is evaluated
+        against the fraud rules of the ATM after the transfers before it.
+
+        :param transfers: Iterable of (source_number, destination_number, amount) tuples
+        :param chunk_size: Maximum number of transfers applied while holding the locks
+        :return: List with the result of every transfer, True if it was made else False
+        """
+        rules = self.__rules__
+        transfers = list(transfers)
+        for _, _, amount in transfers:
+            if type(amount) != int:
+                raise Exception("Invalid argument: amount of type {} should be: <class 'int'>".format(type(amount)))
+        results = []
+        for start in range(0, len(transfers), chunk_size):
+            chunk = []
+            for source_number, destination_number, amount in transfers[start:start + chunk_size]:
+                source = self.find_account(source_number)
+                destination = self.find_account(destination_number)
+                chunk.append((source, destination, amount))
+            applied = []
+            with self.__locks__.locks_for(account.get_account_number() for source, destination, _ in chunk
+                                          for account in (source, destination) if account is not None):
+                for source, destination, amount in chunk:
+                    if source is None or destination is None or amount <= 0 or source.get_balance() < amount \
+                            or source.get_account_number() == destination.get_account_number() \
+                            or self.__is_deleted__(source) or self.__is_deleted__(destination) \
+                            or rules is not None and rules.evaluate(source.get_account_number(), amount) is not None:
+                        results.append(False)
+                        continue
+                    source.set_balance(source.get_balance() - amount)
+                    destination.set_balance(destination.get_balance() + amount)
+                    if rules is not None:
+                        rules.record(source.get_account_number(), amount)
+                    applied.append((source, destination, amount))
+                    results.append(True)
+                if applied:
+                    self.transfers_applied(applied)
+        return results
+
+    def statement(self, account, count=10):
+        """Get a mini statement of the latest transactions of an account.
+
+        :param account: Bank account loaded by this ATM
+        :param count: Maximum number of transactions on the statement
+        :return: List with the lines of the statement
+        """
+        if self.__history__ is None:
+            return ["Statements are not available"]
+        return self.__statement_lines__(account, self.__history__.last(account.get_account_number(), count))
+
+    def statement_between(self, account, start, end):
+        """Get a statement of the transactions of an account within a period, the oldest first.
+
+        :param account: Bank account loaded by this ATM
+        :param start: Start of the period in seconds since the epoch, inclusive
+        :param end: End of the period in seconds since the epoch, exclusive
+        :return: List with the lines of the statement
+        """
+        if self.__history__ is None:
+            return ["Statements are not available"]
+        return self.__statement_lines__(account, self.__history__.between(account.get_account_number(), start, end))
+
+    @staticmethod
+    def __statement_lines__(account, transactions):
+        """Get the lines of a statement of the transactions of an account."""
+        lines = ["Account Number: {}".format(account.get_account_number())]
+        for timestamp, transaction_type, amount, balance in transactions:
+            lines.append("{} {:<12} {:>10} Balance: ${}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), transaction_type,
+                -amount if transaction_type in (BankAccount.WITHDRAW, BankAccount.TRANSFER_OUT) else amount, balance))
+        if len(lines) == 1:
+            lines.append("No transactions")
+        return lines
+
+    def add_listener(self, listener):
+        """Registers a listener to be notified of every transaction performed on the loaded accounts.
+
+        The listener must provide a method with the signature 'transaction_applied(account, transaction_type, amount)'
+        and may provide a 'transfers_applied(transfers)' method to be notified of transfers as a unit and a 'close'
+        method which is called when the ATM is closed.
+
+        :param listener: Object to notify of the transactions
+        :return: None
+        """
+        self.__listeners__.append(listener)
+
+    def transaction_applied(self, account, transaction_type, amount):
+        """Forwards a transaction performed on a loaded account to the registered listeners.
+
+        :param account: Bank account the transaction was applied to
+        :param transaction_type: Type of the transaction that was applied
+        :param amount: Amount of the transaction
+        :return: None
+        """
+        for listener in self.__listeners__:
+            listener.transaction_applied(account, transaction_type, amount)
+
+    def transfers_applied(self, transfers):
+        """Forwards transfers performed between loaded accounts to the registered listeners.
+
+        Listeners providing a 'transfers_applied(transfers)' method are notified of all the transfers at once, the
+        others are notified of both sides of every transfer through 'transaction_applied' with the TRANSFER_OUT and
+        TRANSFER_IN transaction types of 'BankAccount'.
+
+        :param transfers: List of (source, destination, amount) tuples of the transfers applied
+        :return: None
+        """
+        for listener in self.__listeners__:
+            if hasattr(listener, "transfers_applied"):
+                listener.transfers_applied(transfers)
+            else:
+                for source, destination, amount in transfers:
+                    listener.transaction_applied(source, BankAccount.TRANSFER_OUT, amount)
+                    listener.transaction_applied(destination, BankAccount.TRANSFER_IN, amount)
+
+    def refresh_accounts(self, records, read):
+        """Applies changes made to the accounts table outside of this ATM to the records in memory.
+
+        New accounts are added and deleted accounts are dropped, or replaced when the pin of an account changes. The
+        records dropped are marked deleted so that sessions still holding them can't withdraw from, deposit into or
+        transfer from them. Lazily loaded records only refresh the accounts in memory, the others are read from the
+        database when they are needed.
+
+        The rows passed in are read without holding any lock, a local transaction may commit between the read and the
+        refresh. The accounts whose names or balance differ are therefore locked and their rows read again with 'read'
+        before they are changed in place, and accounts a listener still has to write to the database, such as the dirty
+        accounts of a write-behind 'AccountPersistence', are left alone. The listeners aren't notified since the changes
+        are already in the database.
+
+        :param records: Iterable of (pin, record) pairs, the record is an (account_number, first_name, last_name,
+                        balance) tuple or None if the account was deleted
+        :param read: Callable receiving a list of pins and returning a dictionary of their current records keyed by pin
+        :return: List of the pins left alone because of pending local writes, to refresh again later
+        """
+        memory = self.__memory__
+        lazy = isinstance(memory, LazyRecords)
+        changed = []
+        for pin, record in records:
+            account = memory.cached(pin) if lazy else memory.get(pin)
+            if account is not None and (record is None or record[0] != account.get_account_number()):
+                with self.__locks__.lock_for(account.get_account_number()):
+                    current = read([pin]).get(pin)
+                    if current is None or current[0] != account.get_account_number():
+                        if not isinstance(memory, AccountStore):  # the rows of a store are marked removed
+                            self.__deleted__.add(account)
+                        memory.pop(pin, None)
+                        account = None
+                    record = current
+                if account is None:
+                    self.__forget_pins__()
+            if record is None:
+                continue
+            if account is None:
+                if not lazy:
+                    if isinstance(memory, AccountStore):
+                        memory.append(pin, *record)
+                    else:
+                        memory[pin] = BankAccount(*record)
+                    self.__forget_pins__()
+                continue
+            if (account.get_first_name(), account.get_last_name(), account.get_balance()) != record[1:]:
+                changed.append((pin, account))
+        pending = []
+        if not changed:
+            return pending
+        writers = [listener for listener in self.__listeners__ if hasattr(listener, "is_dirty")]
+        with self.__locks__.locks_for(account.get_account_number() for _, account in changed):
+            clean = []
+            for pin, account in changed:
+                if any(writer.is_dirty(account.get_account_number()) for writer in writers):
+                    pending.append(pin)
+                else:
+                    clean.append((pin, account))
+            current = read([pin for pin, _ in clean]) if clean else {}
+            for pin, account in clean:
+                record = current.get(pin)
+                if record is None or record[0] != account.get_account_number():
+                    continue  # deleted or replaced meanwhile, the change is logged and applied by a later refresh
+                if account.get_first_name() != record[1]:
+                    account.set_first_name(record[1])
+                if account.get_last_name() != record[2]:
+                    account.set_last_name(record[2])
+                if account.get_balance() != record[3]:
+                    account.set_balance(record[3])
+        return pending
+
+    def loaded_pins(self):
+        """Get the pins of the records in memory, only the cached records when the records are loaded lazily.
+
+        :return: List of pins
+        """
+        if isinstance(self.__memory__, LazyRecords):
+            return self.__memory__.cached_pins()
+        return [pin for pin, _ in self.__memory__.items()]
+
+    def close(self):
+        """Stops the refresher, closes the registered listeners, the authenticator and releases the resources held by
+        the memory of the ATM."""
+        if self.__refresher__ is not None:
+            self.__refresher__.close()
+        for listener in self.__listeners__:
+            if hasattr(listener, "close"):
+                listener.close()
+        if self.__authenticator__ is not None:
+            self.__authenticator__.close()
+        if hasattr(self.__memory__, "close"):
+            self.__memory__.close()
+
+    def __is_deleted__(self, account):
+        """Checks if a record was dropped from memory by 'refresh_accounts'."""
+        if isinstance(account, AccountView):
+            return account.is_removed()
+        return account in self.__deleted__
+
+    def __forget_pins__(self):
+        """Discards the index of the pins by account number, it is rebuilt on next use."""
+        with self.__pins_lock__:
+            self.__pins__ = None
 
     @classmethod
     def param_is_good(cls, param):
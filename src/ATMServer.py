@@ -0,0 +1,216 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from ATM import ATM
+from ATMSession import ATMSession
+from AccountPersistence import AccountPersistence
+from AccountRefresher import AccountRefresher
+from CashDispenser import CashDispenser
+from ConnectionPool import ConnectionPool
+from DatabaseScript import DatabaseScript
+from FraudRules import FraudRules
+from Instrumentation import Instrumentation
+from PinAuthenticator import PinAuthenticator
+from RecordsLoader import RecordsLoader
+from ShardedATM import ShardedATM
+from TransactionHistory import TransactionHistory
+
+
+class ATMServer:
+    """Serves many ATM terminal sessions concurrently from a single process.
+
+    Every connection is an independent 'ATMSession', the same menu, pin validation and transaction flow as the console
+    interface, over a line based text protocol:
+    -> the server sends lines of text, a line ending with ': ' is a prompt
+    -> the client answers every prompt with a single line
+    -> the session ends when the server sends 'Goodbye...' and closes the connection
+
+    All sessions share one ATM, lookups and transactions are executed on a thread pool so that database access never
+    blocks the event loop, and the ATM serializes transactions on the same account so concurrent withdrawals can't
+    overdraw it. A 'ShardedATM' may be served in place of an ATM to spread the accounts over worker processes.
+
+    Example of usage:
+    server = ATMServer(ATM())
+    asyncio.run(server.serve(host="127.0.0.1", port=8888))
+    """
+
+    def __init__(self, atm, workers=32, idle_timeout=300.0):
+        """Initializes the server with the ATM shared by all the sessions.
+
+        :param atm: ATM used to validate pins, load accounts and perform transactions
+        :param workers: Number of threads executing lookups and transactions
+        :param idle_timeout: Seconds a session may wait for client input before it is closed
+        :return: An initialized server, call 'serve' to start accepting connections
+        """
+        self.__atm__ = atm
+        self.__executor__ = ThreadPoolExecutor(max_workers=workers)
+        self.__idle_timeout__ = idle_timeout
+        self.__active_sessions__ = 0
+        self.__total_sessions__ = 0
+
+    def get_active_sessions(self):
+        """Get the number of sessions currently connected."""
+        return self.__active_sessions__
+
+    def get_total_sessions(self):
+        """Get the number of sessions served since the server started."""
+        return self.__total_sessions__
+
+    async def serve(self, host=None, port=None, path=None):
+        """Accepts connections until the task is cancelled.
+
+        Listens on the Unix socket 'path' if specified else on the TCP address 'host':'port'.
+
+        :param host: Address of the TCP socket to listen on
+        :param port: Port of the TCP socket to listen on
+        :param path: Path of the Unix socket to listen on
+        :return: None
+        """
+        server = await self.start(host, port, path)
+        async with server:
+            await server.serve_forever()
+
+    async def start(self, host=None, port=None, path=None):
+        """Starts accepting connections in the background.
+
+        :param host: Address of the TCP socket to listen on
+        :param port: Port of the TCP socket to listen on
+        :param path: Path of the Unix socket to listen on
+        :return: The underlying 'asyncio' server
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.__session__, path=path)
+        return await asyncio.start_server(self.__session__, host=host, port=port)
+
+    def close(self):
+        """Waits for the pending lookups and transactions to finish and stops the worker threads."""
+        self.__executor__.shutdown(wait=True)
+
+    async def __session__(self, reader, writer):
+        """Runs a single terminal session on the connection."""
+        self.__active_sessions__ += 1
+        self.__total_sessions__ += 1
+        session = ATMSession(self.__atm__)
+        try:
+            await self.__send__(writer, *session.start())
+            while not session.is_finished():
+                line = await asyncio.wait_for(reader.readline(), self.__idle_timeout__)
+                if not line:
+                    break
+                await self.__send__(writer, *await self.__run__(session.feed, line.decode(errors="replace")))
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self.__active_sessions__ -= 1
+            writer.close()
+
+    async def __run__(self, function, *args):
+        """Executes a possibly blocking call on the worker threads."""
+        return await asyncio.get_running_loop().run_in_executor(self.__executor__, function, *args)
+
+    @staticmethod
+    async def __send__(writer, *lines):
+        """Sends lines of text to the client."""
+        writer.write("".join(line + "\n" for line in lines).encode())
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve concurrent ATM sessions over a local socket.")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address to listen on")
+    parser.add_argument("--port", type=int, default=8888, help="TCP port to listen on")
+    parser.add_argument("--unix", default=None, help="Unix socket path to listen on instead of TCP")
+    parser.add_argument("--database", default="accounts.db", help="database file with the bank account records")
+    parser.add_argument("--lazy", action="store_true", help="load the records on demand")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="load the records from a binary snapshot of the database, rebuilt when it changes")
+    parser.add_argument("--write-behind", action="store_true", help="batch the balance updates to the database")
+    parser.add_argument("--workers", type=int, default=32, help="threads executing lookups and transactions")
+    parser.add_argument("--pool-size", type=int, default=8, help="read connections shared by the sessions")
+    parser.add_argument("--cards", action="store_true",
+                        help="authenticate card numbers against the salted pin hashes created by PinAuthenticator.py")
+    parser.add_argument("--refresh-interval", type=float, default=None,
+                        help="seconds between polls of the changes made to the accounts by other processes")
+    parser.add_argument("--cassettes", default=None,
+                        help="notes in the cash cassettes as denomination:count pairs, such as 100:500,20:2000")
+    parser.add_argument("--rules", default=None, help="JSON file with the fraud rules evaluated on withdrawals")
+    parser.add_argument("--shards", type=int, default=None, help="partition the accounts across worker processes")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    arguments = parser.parse_args()
+    if arguments.shards is not None:
+        for option, value in (("--lazy", arguments.lazy), ("--snapshot", arguments.snapshot),
+                              ("--cards", arguments.cards), ("--refresh-interval", arguments.refresh_interval),
+                              ("--cassettes", arguments.cassettes), ("--rules", arguments.rules)):
+            if value not in (None, False):
+                parser.error("argument {}: not supported with --shards".format(option))
+
+    instrumentation = None
+    if arguments.metrics_port is not None:
+        instrumentation = Instrumentation()
+        instrumentation.instrument()
+        instrumentation.serve_http(arguments.metrics_port)
+
+    DatabaseScript.load_database(arguments.database)
+    pool = ConnectionPool(arguments.database, arguments.pool_size)
+    if arguments.shards is not None:
+        atm = ShardedATM(ShardedATM.partition_database(arguments.database, arguments.shards),
+                         os.path.splitext(arguments.database)[0] + ".coordinator.db",
+                         write_behind=arguments.write_behind)
+    else:
+        authenticator = None
+        if arguments.cards:
+            authenticator = PinAuthenticator(arguments.database, pool=pool)
+        dispenser = None
+        if arguments.cassettes is not None:
+            dispenser = CashDispenser({int(denomination): int(count) for denomination, count in
+                                       (cassette.split(":") for cassette in arguments.cassettes.split(","))})
+            if instrumentation is not None:
+                instrumentation.add_collector(dispenser.prometheus_text)
+        loading_mode = RecordsLoader.EAGER
+        if arguments.lazy:
+            loading_mode = RecordsLoader.LAZY
+        elif arguments.snapshot:
+            loading_mode = RecordsLoader.SNAPSHOT
+        refresher = None
+        if arguments.refresh_interval is not None:
+            refresher = AccountRefresher(arguments.database, arguments.refresh_interval, pool=pool)
+            if instrumentation is not None:
+                instrumentation.add_collector(refresher.prometheus_text)
+        atm = ATM(arguments.database, loading_mode, pool=pool,
+                  history=TransactionHistory(arguments.database, pool=pool), authenticator=authenticator,
+                  dispenser=dispenser, refresher=refresher,
+                  rules=None if arguments.rules is None else FraudRules.load(arguments.rules))
+        atm.add_listener(AccountPersistence(arguments.database, AccountPersistence.WRITE_BEHIND
+                                            if arguments.write_behind else AccountPersistence.WRITE_THROUGH, pool=pool,
+                                            origin=None if refresher is None else refresher.get_origin()))
+    server = ATMServer(atm, arguments.workers)
+    try:
+        asyncio.run(server.serve(arguments.host, arguments.port, arguments.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        atm.close()
+        pool.close()
+        if instrumentation is not None:
+            instrumentation.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from ATM import ATM
+from PinAuthenticator import PinAuthenticator
+
+
+class ATMSession:
+    """State machine of a terminal session, independent of how the session talks to the user.
+
+    The session is driven one line of input at a time and answers with the lines of text to show, a line ending with
+    ': ' is the prompt for the next line of input. It never reads or prints anything itself, so the same flow is run by
+    the console interface, by the server for every connection and by the replay of recorded session scripts.
+
+    The flow is the one of the console interface:
+    -> the pin, or the card number and pin if the ATM authenticates cards, with three(3) tries
+    -> the menu and the option, followed by the amount, account number or dates the option needs
+    -> the question whether to perform another transaction
+    The session is finished once it has said 'Goodbye...'.
+
+    Example of usage:
+    session = ATMSession(atm)
+    lines = session.start()
+    while not session.is_finished():
+        lines = session.feed(input(lines[-1]))
+    """
+
+    CARD_PROMPT = "Enter your card number and press [enter] to continue: "
+    PIN_PROMPT = "Enter your pin and press [enter] to continue: "
+    OPTION_PROMPT = "Enter option: "
+    WITHDRAW_PROMPT = "Enter amount to withdraw: "
+    DEPOSIT_PROMPT = "Enter amount to deposit: "
+    DESTINATION_PROMPT = "Enter account number to transfer to: "
+    TRANSFER_PROMPT = "Enter amount to transfer: "
+    START_DATE_PROMPT = "Enter first day of the statement (YYYY-MM-DD): "
+    END_DATE_PROMPT = "Enter last day of the statement (YYYY-MM-DD): "
+    CONTINUE_PROMPT = "Would you like to perform another transaction (Y/n): "
+    GOODBYE = "Goodbye..."
+
+    def __init__(self, atm):
+        """Initializes a session on the ATM, call 'start' to get the first prompt.
+
+        :param atm: ATM used to authenticate, load accounts and perform transactions
+        :return: A session waiting to be started
+        """
+        self.__atm__ = atm
+        self.__state__ = None
+        self.__account__ = None
+        self.__card__ = None
+        self.__destination__ = None
+        self.__start_date__ = None
+        self.__tries__ = 0
+        self.__finished__ = False
+
+    def start(self):
+        """Starts the session.
+
+        :return: List with the lines to show, the last one is the first prompt
+        """
+        if getattr(self.__atm__, "uses_cards", lambda: False)():
+            self.__state__ = self.__card_entered__
+            return [self.CARD_PROMPT]
+        self.__state__ = self.__pin_entered__
+        return [self.PIN_PROMPT]
+
+    def feed(self, line):
+        """Advances the session with a line of input.
+
+        If the session isn't started or is finished an 'Exception' is raised.
+
+        :param line: Line entered by the user, surrounding whitespace is ignored
+        :return: List with the lines to show, the last one is the next prompt unless the session is finished
+        """
+        if self.__state__ is None:
+            raise Exception("The session is not started or is finished")
+        output = []
+        self.__state__(line.strip(), output)
+        return output
+
+    def is_finished(self):
+        """Checks if the session has said goodbye."""
+        return self.__finished__
+
+    def get_account(self):
+        """Get the account of the session, None until it is authenticated."""
+        return self.__account__
+
+    def __finish__(self, output):
+        """Ends the session."""
+        output.append(self.GOODBYE)
+        self.__state__ = None
+        self.__finished__ = True
+
+    def __menu__(self, output):
+        """Shows the menu and asks for an option."""
+        output.extend(ATM.menu_lines())
+        output.append(self.OPTION_PROMPT)
+        self.__state__ = self.__option_entered__
+
+    def __ask__(self, output, prompt, state):
+        """Asks for the next line of input and sets the state handling it."""
+        output.append(prompt)
+        self.__state__ = state
+
+    def __pin_entered__(self, pin, output):
+        """Validates the pin, the session ends after three(3) invalid pins."""
+        atm = self.__atm__
+        if atm.validate_pin(pin):
+            self.__account__ = atm.load_account(pin)
+            self.__menu__(output)
+        elif self.__tries__ == 2:
+            self.__finish__(output)
+        else:
+            self.__tries__ += 1
+            output.append("That pin is invalid, you have {} more {}".format(
+                3 - self.__tries__, "tries" if self.__tries__ == 1 else "try"))
+            self.__ask__(output, self.PIN_PROMPT, self.__pin_entered__)
+
+    def __card_entered__(self, card, output):
+        """Keeps the card number and asks for its pin."""
+        self.__card__ = card
+        self.__ask__(output, self.PIN_PROMPT, self.__card_pin_entered__)
+
+    def __card_pin_entered__(self, pin, output):
+        """Authenticates the card, the session ends once the card is locked."""
+        atm = self.__atm__
+        result = atm.authenticate(self.__card__, pin)
+        if result == PinAuthenticator.GRANTED:
+            self.__account__ = atm.find_account(self.__card__)
+            self.__menu__(output)
+            return
+        remaining = atm.remaining_attempts(self.__card__)
+        if result == PinAuthenticator.LOCKED or remaining == 0:
+            output.append("This card is locked, please try again later")
+            self.__finish__(output)
+        else:
+            output.append("That pin is invalid, you have {} more {}".format(
+                remaining, "tries" if remaining > 1 else "try"))
+            self.__ask__(output, self.PIN_PROMPT, self.__card_pin_entered__)
+
+    def __option_entered__(self, option, output):
+        """Performs the option or asks for the input it needs."""
+        if option == "1":
+            self.__ask__(output, self.WITHDRAW_PROMPT, self.__withdraw_amount_entered__)
+        elif option == "2":
+            self.__ask__(output, self.DEPOSIT_PROMPT, self.__deposit_amount_entered__)
+        elif option == "3":
+            output.append(self.__account__.get_account_details())
+            self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+        elif option == "4":
+            output.extend(self.__atm__.statement(self.__account__))
+            self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+        elif option == "5":
+            self.__ask__(output, self.DESTINATION_PROMPT, self.__destination_entered__)
+        elif option == "6":
+            self.__ask__(output, self.START_DATE_PROMPT, self.__start_date_entered__)
+        else:
+            output.append("Invalid option\n")
+            self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+
+    def __withdraw_amount_entered__(self, text, output):
+        """Withdraws the amount entered."""
+        amount = self.__parse_amount__(text)
+        if amount is None:
+            output.append("Invalid amount\n")
+        elif self.__atm__.withdraw(self.__account__, amount) != amount:
+            output.append("Withdrawal declined\n")
+        self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+
+    def __deposit_amount_entered__(self, text, output):
+        """Deposits the amount entered."""
+        amount = self.__parse_amount__(text)
+        if amount is None:
+            output.append("Invalid amount\n")
+        else:
+            self.__atm__.deposit(self.__account__, amount)
+        self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+
+    def __destination_entered__(self, destination, output):
+        """Keeps the account number to transfer to and asks for the amount."""
+        self.__destination__ = destination
+        self.__ask__(output, self.TRANSFER_PROMPT, self.__transfer_amount_entered__)
+
+    def __transfer_amount_entered__(self, text, output):
+        """Transfers the amount entered."""
+        amount = self.__parse_amount__(text)
+        if amount is None:
+            output.append("Invalid amount\n")
+        elif self.__atm__.transfer(self.__account__.get_account_number(), self.__destination__, amount):
+            output.append("Transfer complete\n")
+        else:
+            output.append("Transfer failed\n")
+        self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+
+    def __start_date_entered__(self, text, output):
+        """Keeps the first day of the statement and asks for the last day."""
+        self.__start_date__ = self.__parse_date__(text)
+        if self.__start_date__ is None:
+            output.append("Invalid date\n")
+            self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+        else:
+            self.__ask__(output, self.END_DATE_PROMPT, self.__end_date_entered__)
+
+    def __end_date_entered__(self, text, output):
+        """Shows the statement of the days entered, both included."""
+        end_date = self.__parse_date__(text)
+        if end_date is None:
+            output.append("Invalid date\n")
+        else:
+            output.extend(self.__atm__.statement_between(
+                self.__account__, self.__start_date__.timestamp(),
+                (end_date + datetime.timedelta(days=1)).timestamp()))
+        self.__ask__(output, self.CONTINUE_PROMPT, self.__continue_entered__)
+
+    def __continue_entered__(self, answer, output):
+        """Shows the menu again or ends the session."""
+        if answer.lower() == "y":
+            self.__menu__(output)
+        else:
+            self.__finish__(output)
+
+    @staticmethod
+    def __parse_amount__(text):
+        """Converts an amount entered by the user, returns None if it isn't a non-negative whole number."""
+        return int(text) if text.isdigit() else None
+
+    @staticmethod
+    def __parse_date__(text):
+        """Converts a date entered by the user to the local midnight starting it, returns None if it isn't a valid
+        YYYY-MM-DD date."""
+        try:
+            return datetime.datetime.strptime(text, "%Y-%m-%d")
+        except ValueError:
+            return None
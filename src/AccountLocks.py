@@ -0,0 +1,84 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import threading
+import zlib
+
+
+class AccountLocks:
+    """Per-account mutual exclusion for transactions performed concurrently.
+
+    A fixed table of locks is shared by all the accounts, an account number always maps to the same lock so two
+    transactions on the same account never run at the same time while transactions on different accounts rarely
+    contend. Memory use is bounded by the number of stripes rather than the number of accounts.
+
+    Example of usage:
+    locks = AccountLocks()
+    with locks.lock_for(account.get_account_number()):
+        account.withdraw(100)
+    with locks.locks_for((source.get_account_number(), destination.get_account_number())):
+        ...
+    """
+
+    DEFAULT_STRIPES = 1024
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        """Initializes the lock table.
+
+        Checks that the argument 'stripes' passed in is a positive 'int' else an 'Exception' is raised.
+
+        :param stripes: Number of locks shared by the accounts
+        :return: An initialized lock table
+        """
+        if type(stripes) != int or stripes <= 0:
+            raise Exception("Invalid argument: stripes should be a positive <class 'int'> found {}".format(stripes))
+        self.__locks__ = [threading.Lock() for _ in range(stripes)]
+
+    def stripe_of(self, account_number):
+        """Get the index of the lock associated with the account number.
+
+        :param account_number: Account number to locate the lock of
+        :return: Index of the lock in the lock table
+        """
+        return zlib.crc32(account_number.encode()) % len(self.__locks__)
+
+    def lock_for(self, account_number):
+        """Get the lock associated with the account number.
+
+        :param account_number: Account number to locate the lock of
+        :return: Lock to hold while performing a transaction on the account
+        """
+        return self.__locks__[self.stripe_of(account_number)]
+
+    @contextlib.contextmanager
+    def locks_for(self, account_numbers):
+        """Context manager holding the locks of several accounts for the duration of a block.
+
+        The locks are always acquired in the order of their index in the lock table, so two blocks locking the same
+        accounts in a different order, such as transfers in opposite directions, can't deadlock. Accounts sharing a
+        lock only acquire it once.
+
+        :param account_numbers: Iterable of the account numbers to lock
+        :return: Context manager holding the locks
+        """
+        acquired = []
+        try:
+            for stripe in sorted({self.stripe_of(account_number) for account_number in account_numbers}):
+                self.__locks__[stripe].acquire()
+                acquired.append(stripe)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                self.__locks__[stripe].release()
@@ -0,0 +1,208 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from BankAccount import BankAccount
+from DatabaseConnection import DatabaseConnection
+
+
+class AccountPersistence:
+    """Writes the balance changes of bank accounts back to the database.
+
+    The changes are written as amounts added to the balances in the database rather than as the balances in memory, so
+    the changes committed meanwhile by other processes, such as a 'BatchProcessor' run, are kept. The balances in
+    memory are brought back in line with the database by an 'AccountRefresher'.
+
+    The object is used as a transaction listener of the ATM (or directly as the observer of a 'BankAccount') and
+    supports two modes of operation selected with class constants:
+    WRITE_THROUGH -> every balance change is written and committed before the transaction returns
+    WRITE_BEHIND  -> the changes of an account are added up while it is dirty and written in batches, a batch is
+                     committed in a single transaction when 'batch_size' accounts are dirty or every 'flush_interval'
+                     seconds
+
+    The database is switched to WAL journaling so that commits only append to the write-ahead log. In WRITE_BEHIND mode
+    changes that are not flushed yet are lost if the process dies, the window is bounded by the flush interval. A batch
+    that fails to be written, such as while another process holds the database lock for too long, is kept dirty and
+    written again by the next flush, the failures of the background flusher are counted in 'get_metrics'.
+
+    If a 'ConnectionPool' is supplied the balances are written with its write connections, so they are shared with the
+    other writers of the process rather than contending with them for the database lock.
+
+    If an origin is supplied, such as the origin of the process's 'AccountRefresher', the changes it writes are marked
+    with it in the change log of the accounts, so the refresher doesn't read back the changes it already holds.
+
+    Example of usage:
+    persistence = AccountPersistence("accounts.db", AccountPersistence.WRITE_BEHIND)
+    atm.add_listener(persistence)
+    ...
+    persistence.close()
+    """
+
+    WRITE_THROUGH = 0
+    WRITE_BEHIND = 1
+
+    def __init__(self, database_file, mode=WRITE_THROUGH, batch_size=512, flush_interval=1.0, pool=None, origin=None):
+        """Initializes the object with a connection to the specified database.
+
+        Checks that the argument 'mode' passed in is valid else an 'Exception' is raised.
+
+        In WRITE_BEHIND mode a background thread is started to flush the dirty accounts periodically.
+
+        :param database_file: Name of the database file to write the balances to
+        :param mode: One of the WRITE_THROUGH or WRITE_BEHIND class constants
+        :param batch_size: Number of dirty accounts that triggers a flush in WRITE_BEHIND mode
+        :param flush_interval: Maximum number of seconds a change stays unflushed in WRITE_BEHIND mode
+        :param pool: 'ConnectionPool' to write the balances with instead of a private connection
+        :param origin: Origin marking the changes written in the change log of the accounts
+        :return: An initialized object ready to record balance changes
+        """
+        if mode != self.WRITE_THROUGH and mode != self.WRITE_BEHIND:
+            raise Exception("Invalid persistence mode")
+        self.__database__ = None
+        if pool is None:
+            self.__database__ = DatabaseConnection(database_file, check_same_thread=False)
+            self.__database__.set_journal_mode("WAL", "FULL" if mode == self.WRITE_THROUGH else "NORMAL")
+        self.__pool__ = pool
+        self.__origin__ = origin
+        self.__mode__ = mode
+        self.__batch_size__ = batch_size
+        self.__flush_interval__ = flush_interval
+        self.__dirty__ = dict()
+        self.__errors__ = 0
+        self.__lock__ = threading.Lock()
+        self.__closed__ = threading.Event()
+        self.__flusher__ = None
+        if mode == self.WRITE_BEHIND:
+            self.__flusher__ = threading.Thread(target=self.__flush_periodically__, daemon=True)
+            self.__flusher__.start()
+
+    def transaction_applied(self, account, transaction_type, amount):
+        """Records the balance change of an account made by a deposit or withdrawal.
+
+        :param account: Bank account whose balance changed
+        :param transaction_type: Type of the transaction that was applied
+        :param amount: Amount of the transaction
+        :return: None
+        """
+        if transaction_type == BankAccount.WITHDRAW or transaction_type == BankAccount.TRANSFER_OUT:
+            amount = -amount
+        self.record_changes(((account.get_account_number(), amount),))
+
+    def transfers_applied(self, transfers):
+        """Records the balance changes of the accounts of transfers, both sides of every transfer are written together.
+
+        :param transfers: List of (source, destination, amount) tuples of the transfers applied
+        :return: None
+        """
+        changes = dict()
+        for source, destination, amount in transfers:
+            for account_number, change in ((source.get_account_number(), -amount),
+                                           (destination.get_account_number(), amount)):
+                changes[account_number] = changes.get(account_number, 0) + change
+        self.record_changes(changes.items())
+
+    def record_changes(self, changes):
+        """Records the balance changes of several accounts as a single unit.
+
+        In WRITE_THROUGH mode the changes are committed in one transaction, in WRITE_BEHIND mode they are added to the
+        dirty set together so a flush never writes only part of them.
+
+        :param changes: Iterable of (account_number, amount) pairs, the amount is added to the balance of the account
+        :return: None
+        """
+        with self.__lock__:
+            if self.__mode__ == self.WRITE_THROUGH:
+                self.__write__(changes)
+                return
+            dirty = self.__dirty__
+            for account_number, amount in changes:
+                dirty[account_number] = dirty.get(account_number, 0) + amount
+            if len(self.__dirty__) >= self.__batch_size__:
+                self.__flush_dirty__()
+
+    def is_dirty(self, account_number):
+        """Checks if a balance change of an account is not in the database yet.
+
+        The changes being flushed are written while holding the lock, so an account being flushed counts as dirty
+        until its changes are committed.
+
+        :param account_number: Account number of the account
+        :return: True if a change of the account is still to be written else False
+        """
+        with self.__lock__:
+            return account_number in self.__dirty__
+
+    def get_metrics(self):
+        """Get the number of dirty accounts and of failed flushes of the background flusher.
+
+        :return: Dictionary with the dirty_accounts and flush_errors
+        """
+        with self.__lock__:
+            return {"dirty_accounts": len(self.__dirty__), "flush_errors": self.__errors__}
+
+    def flush(self):
+        """Writes every dirty account to the database in a single transaction."""
+        with self.__lock__:
+            self.__flush_dirty__()
+
+    def close(self):
+        """Flushes the dirty accounts, stops the background flusher and closes the private connection to the database."""
+        self.__closed__.set()
+        if self.__flusher__ is not None:
+            self.__flusher__.join()
+        with self.__lock__:
+            self.__flush_dirty__()
+            if self.__database__ is not None:
+                self.__database__.close()
+
+    def __flush_dirty__(self):
+        """Writes the dirty accounts, the caller must hold the lock, they are kept dirty if the write fails."""
+        if self.__dirty__:
+            dirty, self.__dirty__ = self.__dirty__, dict()
+            try:
+                self.__write__(dirty.items())
+            except BaseException:
+                for account_number, amount in self.__dirty__.items():  # changes recorded since are added on top
+                    dirty[account_number] = dirty.get(account_number, 0) + amount
+                self.__dirty__ = dirty
+                raise
+
+    def __write__(self, changes):
+        """Adds the changes to the balances in a single transaction, the caller must hold the lock."""
+        if self.__pool__ is None:
+            self.__update__(self.__database__, changes)
+        else:
+            with self.__pool__.writer() as database:
+                self.__update__(database, changes)
+
+    def __update__(self, database, changes):
+        """Adds the changes to the balances in a single transaction on the specified connection."""
+        with database.transaction():
+            if self.__origin__ is not None:  # the transaction holds the write lock, later versions are its own
+                version = database.fetch_value("SELECT seq FROM sqlite_sequence WHERE name = 'account_changes'",
+                                               default=0)
+            database.execute_many("UPDATE accounts SET balance = balance + ? WHERE account_number = ?",
+                                  ((amount, account_number) for account_number, amount in changes))
+            if self.__origin__ is not None:
+                database.execute("UPDATE account_changes SET origin = ? WHERE version > ?", (self.__origin__, version))
+
+    def __flush_periodically__(self):
+        """Body of the background flusher thread."""
+        while not self.__closed__.wait(self.__flush_interval__):
+            try:
+                self.flush()
+            except Exception:
+                with self.__lock__:
+                    self.__errors__ += 1
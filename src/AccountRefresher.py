@@ -0,0 +1,253 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import uuid
+
+from DatabaseConnection import DatabaseConnection
+from DatabaseScript import DatabaseScript
+
+
+class AccountRefresher:
+    """Keeps the records of an ATM up to date with the changes made to the accounts table by other processes.
+
+    Triggers log the pin of every account inserted, updated or deleted in the 'account_changes' table under a version
+    that only ever grows, whichever process made the change. Every 'refresh_interval' seconds the refresher reads the
+    versions logged after the last one it applied, reads the current rows of the accounts they name and hands them to
+    'ATM.refresh_accounts', so a poll costs a range scan of the log and point lookups of the changed accounts instead
+    of a reload of the whole table.
+
+    The changes made by this process are already in memory. An 'AccountPersistence' created with the origin of the
+    refresher marks the changes it writes and the refresher skips them, so the balances written aren't read back. The
+    persistence adds its changes to the balances in the database, so a change committed by another process before the
+    poll is kept and reaches memory through its own entry of the log. The ATM reads the rows of the accounts it changes
+    again while holding their locks, so a local transaction committed after the refresher read a row is never undone,
+    and leaves the accounts whose balance is still to be flushed in write-behind mode alone, they are refreshed again
+    by the next poll.
+
+    The log only keeps the latest changes, a refresher that falls behind the oldest of them can't tell which accounts
+    changed and refreshes every account instead, the accounts in memory that are no longer in the table are deleted.
+
+    The metrics tell how far the records may lag behind the database:
+    -> version: last version of the log applied
+    -> staleness_seconds: seconds since the start of the last successful poll, the changes committed before it are
+       all in memory
+    -> max_staleness_seconds: largest staleness reached before a poll completed
+    -> polls, changes, full_refreshes and errors: counts since the refresher was created
+
+    Example of usage:
+    refresher = AccountRefresher("accounts.db", refresh_interval=0.5)
+    atm = ATM("accounts.db", refresher=refresher)
+    atm.add_listener(AccountPersistence("accounts.db", origin=refresher.get_origin()))
+    ...
+    atm.close()
+    """
+
+    def __init__(self, database_file, refresh_interval=1.0, batch_size=10000, pool=None):
+        """Initializes the object with a connection to the specified database and remembers the latest version of
+        the change log, create it before the records are loaded so no change made meanwhile is missed.
+
+        :param database_file: Name of the database file with the bank account records
+        :param refresh_interval: Seconds between two polls of the change log, None to only refresh on 'refresh' calls
+        :param batch_size: Maximum number of changes read from the log at a time
+        :param pool: 'ConnectionPool' to read the changes with instead of a private connection
+        :return: An initialized refresher, 'start' is called by the ATM once the records are loaded
+        """
+        DatabaseScript.load_database(database_file)
+        self.__database__ = None
+        if pool is None:
+            self.__database__ = DatabaseConnection(database_file, check_same_thread=False)
+            self.__database__.set_journal_mode("WAL", "NORMAL")
+        DatabaseScript.migrate_database(database_file)
+        self.__pool__ = pool
+        self.__refresh_interval__ = refresh_interval
+        self.__batch_size__ = batch_size
+        self.__origin__ = uuid.uuid4().hex
+        self.__atm__ = None
+        self.__lock__ = threading.Lock()
+        self.__database_lock__ = threading.Lock()
+        self.__closed__ = threading.Event()
+        self.__poller__ = None
+        self.__refreshed_at__ = time.time()
+        self.__version__ = self.__latest_version__()
+        self.__pending__ = set()
+        self.__max_staleness__ = 0.0
+        self.__polls__ = 0
+        self.__changes__ = 0
+        self.__full_refreshes__ = 0
+        self.__errors__ = 0
+
+    def get_origin(self):
+        """Get the origin marking the changes made by this process, for 'AccountPersistence'."""
+        return self.__origin__
+
+    def start(self, atm):
+        """Starts polling the change log for the ATM.
+
+        :param atm: ATM whose records are refreshed
+        :return: None
+        """
+        self.__atm__ = atm
+        if self.__refresh_interval__ is not None:
+            self.__poller__ = threading.Thread(target=self.__poll_periodically__, daemon=True)
+            self.__poller__.start()
+
+    def refresh(self):
+        """Applies the changes logged since the last refresh to the records of the ATM.
+
+        If the refresher isn't started an 'Exception' is raised.
+
+        :return: Number of accounts refreshed
+        """
+        if self.__atm__ is None:
+            raise Exception("The refresher is not started")
+        with self.__lock__:
+            started = time.time()
+            latest = self.__latest_version__()
+            pins, self.__pending__ = self.__pending__, set()
+            refreshed = 0
+            while self.__version__ < latest:
+                changes = self.__read__(lambda database: database.fetch_all(
+                    "SELECT version, pin, origin FROM account_changes WHERE version > ? AND version <= ? "
+                    "ORDER BY version LIMIT ?", (self.__version__, latest, self.__batch_size__)))
+                if not changes or changes[0][0] > self.__version__ + 1:  # the missing changes were discarded
+                    refreshed = self.__read__(self.__refresh_all__)
+                    self.__full_refreshes__ += 1
+                    self.__version__ = latest
+                    pins = set()
+                    break
+                pins.update(pin for _, pin, origin in changes if origin != self.__origin__)
+                refreshed += self.__refresh_pins__(pins)
+                pins = set()
+                self.__version__ = changes[-1][0]
+            refreshed += self.__refresh_pins__(pins)
+            self.__max_staleness__ = max(self.__max_staleness__, time.time() - self.__refreshed_at__)
+            self.__refreshed_at__ = started
+            self.__polls__ += 1
+            self.__changes__ += refreshed
+            return refreshed
+
+    def get_metrics(self):
+        """Get the staleness and counts of the refresher.
+
+        :return: Dictionary with the version, staleness_seconds, max_staleness_seconds, polls, changes, full_refreshes
+                 and errors
+        """
+        return {
+            "version": self.__version__,
+            "staleness_seconds": time.time() - self.__refreshed_at__,
+            "max_staleness_seconds": self.__max_staleness__,
+            "polls": self.__polls__,
+            "changes": self.__changes__,
+            "full_refreshes": self.__full_refreshes__,
+            "errors": self.__errors__,
+        }
+
+    def prometheus_text(self):
+        """Get the metrics in the Prometheus text exposition format, see 'Instrumentation.add_collector'.
+
+        :return: Metrics as a 'str'
+        """
+        metrics = self.get_metrics()
+        lines = []
+        for name, kind, description in (
+                ("version", "gauge", "Last version of the account change log applied in memory."),
+                ("staleness_seconds", "gauge", "Seconds since the start of the last successful refresh."),
+                ("max_staleness_seconds", "gauge", "Largest staleness reached before a refresh completed."),
+                ("polls", "counter", "Polls of the account change log."),
+                ("changes", "counter", "Accounts refreshed from the database."),
+                ("full_refreshes", "counter", "Refreshes of every account after falling behind the change log."),
+                ("errors", "counter", "Polls of the account change log that raised an exception.")):
+            metric = "atm_refresh_{}{}".format(name, "_total" if kind == "counter" else "")
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, kind))
+            lines.append("{} {}".format(metric, metrics[name]))
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """Stops polling and closes the private connection to the database."""
+        self.__closed__.set()
+        if self.__poller__ is not None:
+            self.__poller__.join()
+        with self.__database_lock__:
+            if self.__database__ is not None:
+                self.__database__.close()
+
+    def __latest_version__(self):
+        """Get the latest version of the change log."""
+        return self.__read__(lambda database: database.fetch_value(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'account_changes'", default=0))
+
+    def __refresh_pins__(self, pins, chunk_size=500):
+        """Reads the current rows of the accounts of the pins and applies them, returns the number of pins."""
+        pins = list(pins)
+        for start in range(0, len(pins), chunk_size):
+            chunk = pins[start:start + chunk_size]
+            rows = self.__read__(lambda database: self.__rows__(database, chunk))
+            self.__pending__.update(self.__atm__.refresh_accounts(
+                [(pin, rows.get(pin)) for pin in chunk],
+                lambda locked: self.__read__(lambda database: self.__rows__(database, locked))))
+        return len(pins)
+
+    def __refresh_all__(self, database, chunk_size=10000):
+        """Reads the rows of every account and applies them, along with the deletion of the accounts in memory that
+        aren't in the table anymore, returns the number of accounts."""
+        count = 0
+        chunk = []
+        pins = set()
+        for row in database.fetch_iter("SELECT {}, account_number, first_name, last_name, balance FROM accounts".format(
+                DatabaseScript.RECORD_KEY), fetch_size=chunk_size):
+            chunk.append((row[0], tuple(row[1:])))
+            pins.add(row[0])
+            if len(chunk) == chunk_size:
+                self.__apply__(database, chunk)
+                count += len(chunk)
+                chunk = []
+        chunk.extend((pin, None) for pin in self.__atm__.loaded_pins() if pin not in pins)
+        self.__apply__(database, chunk)
+        return count + len(chunk)
+
+    def __apply__(self, database, records):
+        """Applies rows read from the database, remembering the pins left alone to refresh them again later."""
+        self.__pending__.update(self.__atm__.refresh_accounts(records, lambda pins: self.__rows__(database, pins)))
+
+    @staticmethod
+    def __rows__(database, pins, chunk_size=500):
+        """Reads the current rows of the accounts of the pins, returns them keyed by pin."""
+        rows = dict()
+        for start in range(0, len(pins), chunk_size):
+            chunk = pins[start:start + chunk_size]
+            for row in database.fetch_all(
+                    "SELECT {0}, account_number, first_name, last_name, balance FROM accounts "
+                    "WHERE {0} IN ({1})".format(DatabaseScript.RECORD_KEY, ", ".join("?" * len(chunk))), chunk):
+                rows[row[0]] = tuple(row[1:])
+        return rows
+
+    def __read__(self, query):
+        """Runs a query on a pooled read connection or on the private connection."""
+        if self.__pool__ is not None:
+            with self.__pool__.reader() as database:
+                return query(database)
+        with self.__database_lock__:
+            return query(self.__database__)
+
+    def __poll_periodically__(self):
+        """Body of the background poller thread."""
+        while not self.__closed__.wait(self.__refresh_interval__):
+            try:
+                self.refresh()
+            except Exception:
+                with self.__lock__:
+                    self.__errors__ += 1
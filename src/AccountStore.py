@@ -0,0 +1,279 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import zlib
+from array import array
+
+from AccountView import AccountView
+
+
+class AccountStore:
+    """Compact column oriented storage of the bank account records.
+
+    Instead of one 'BankAccount' object per record, every record is a row spread over a few flat buffers:
+    -> balances are kept in a column of 64 bit integers
+    -> the pin, account number, first name and last name of every row are packed into a single byte buffer as length
+       prefixed UTF-8 strings, a column of 32 bit offsets locates the four strings of each row
+    -> pins are mapped to rows by an open addressing hash table of 32 bit row indices
+
+    Removing a record leaves its row in the buffers: the pin offset of the row is set to REMOVED and its slot of the
+    pin index to a tombstone which lookups probe past, so views of the row still held elsewhere stay readable while the
+    pin no longer finds it.
+
+    This takes tens of bytes per record where a dictionary of 'BankAccount' objects takes hundreds.
+
+    The store supports the subset of the dictionary protocol used by the ATM, looking up a pin returns an 'AccountView'
+    which behaves like a 'BankAccount' and reads and writes the row in place:
+    -> pin in store
+    -> store[pin]
+    -> store.get(pin)
+    -> store.pop(pin)
+    -> len(store)
+
+    Example of usage:
+    store = AccountStore()
+    store.append("2050", "10001", "David", "Chen", 10000)
+    account = store.get("2050")
+    account.withdraw(500)
+    """
+
+    PIN = 0
+    ACCOUNT_NUMBER = 1
+    FIRST_NAME = 2
+    LAST_NAME = 3
+    FIELDS = 4
+
+    MAX_STRING_LENGTH = 255
+
+    EMPTY = -1
+    TOMBSTONE = -2
+    REMOVED = 0xFFFFFFFF
+
+    def __init__(self, capacity=1024):
+        """Initializes an empty store.
+
+        :param capacity: Number of rows the pin index is sized for before it has to grow
+        :return: An empty store
+        """
+        self.__balances__ = array("q")
+        self.__offsets__ = array("I")
+        self.__strings__ = bytearray()
+        self.__index__ = array("i", [self.EMPTY]) * self.__table_size__(capacity)
+        self.__removed__ = 0
+        self.__lock__ = threading.Lock()
+
+    def __contains__(self, pin):
+        return self.find(pin) >= 0
+
+    def __getitem__(self, pin):
+        row = self.find(pin)
+        if row < 0:
+            raise KeyError(pin)
+        return AccountView(self, row)
+
+    def __len__(self):
+        return len(self.__balances__) - self.__removed__
+
+    def items(self):
+        """Generates (pin, 'AccountView') pairs for every record of the store."""
+        for row in range(len(self.__balances__)):
+            if self.__offsets__[row * self.FIELDS + self.PIN] != self.REMOVED:
+                yield self.get_string(row, self.PIN), AccountView(self, row)
+
+    def get_buffers(self):
+        """Get the buffers holding the records, as used by 'from_buffers'.
+
+        :return: Tuple of the balances, string offsets, string bytes and pin index buffers
+        """
+        with self.__lock__:
+            return self.__balances__, self.__offsets__, self.__strings__, self.__index__
+
+    @classmethod
+    def from_buffers(cls, balances, offsets, strings, index):
+        """Creates a store from the buffers of another store, such as buffers read back from a file, without
+        appending the records one by one or rebuilding the pin index.
+
+        Checks that the buffers hold the same number of rows and that the pin index is a power of two at least twice
+        the number of rows else an 'Exception' is raised.
+
+        :param balances: Array of 64 bit integers ('q') with the balance of every row
+        :param offsets: Array of unsigned integers ('I') with the offsets of the four strings of every row
+        :param strings: Bytearray with the length prefixed strings
+        :param index: Array of integers ('i') with the pin index
+        :return: A store holding the records of the buffers
+        """
+        size = len(index)
+        if len(offsets) != len(balances) * cls.FIELDS or size < max(8, len(balances) * 2) or size & (size - 1):
+            raise Exception("Invalid argument: the buffers don't describe a valid store")
+        store = cls(0)
+        store.__balances__ = balances
+        store.__offsets__ = offsets
+        store.__strings__ = strings
+        store.__index__ = index
+        store.__removed__ = offsets[cls.PIN::cls.FIELDS].count(cls.REMOVED)
+        return store
+
+    def get(self, pin, default=None):
+        """Get a view of the bank account record associated with the pin.
+
+        :param pin: Pin to locate the associated bank account record
+        :param default: Value returned if no record is associated with the pin
+        :return: 'AccountView' of the record associated with the pin else the default value
+        """
+        row = self.find(pin)
+        return AccountView(self, row) if row >= 0 else default
+
+    def pop(self, pin, default=None):
+        """Removes the bank account record associated with the pin.
+
+        :param pin: Pin to locate the associated bank account record
+        :param default: Value returned if no record is associated with the pin
+        :return: 'AccountView' of the record removed else the default value
+        """
+        with self.__lock__:
+            slot = self.__slot__(pin)
+            row = self.__index__[slot]
+            if row < 0:
+                return default
+            self.__index__[slot] = self.TOMBSTONE
+            self.__offsets__[row * self.FIELDS + self.PIN] = self.REMOVED
+            self.__removed__ += 1
+            return AccountView(self, row)
+
+    def append(self, pin, account_number, first_name, last_name, balance):
+        """Adds a bank account record to the store.
+
+        Checks that the string arguments passed in encode to at most MAX_STRING_LENGTH bytes else an 'Exception' is
+        raised. If a record is already associated with the pin it is replaced, as a dictionary keyed by pin would.
+
+        :param pin: Pin associated with the account
+        :param account_number: Account number associated with the account
+        :param first_name: First name associated with the account
+        :param last_name: Last name associated with the account
+        :param balance: Balance associated with the account
+        :return: Row of the record in the store
+        """
+        with self.__lock__:
+            row = self.find(pin)
+            if row >= 0:
+                for field, value in ((self.ACCOUNT_NUMBER, account_number), (self.FIRST_NAME, first_name),
+                                     (self.LAST_NAME, last_name)):
+                    self.__offsets__[row * self.FIELDS + field] = self.__pack__(value)
+                self.__balances__[row] = balance
+                return row
+            row = len(self.__balances__)
+            for value in (pin, account_number, first_name, last_name):
+                self.__offsets__.append(self.__pack__(value))
+            self.__balances__.append(balance)
+            if (row + 1) * 2 > len(self.__index__):
+                self.__rehash__(len(self.__index__) * 2)
+            else:
+                self.__insert__(row)
+            return row
+
+    def find(self, pin):
+        """Get the row of the record associated with the pin.
+
+        :param pin: Pin to locate the associated bank account record
+        :return: Row of the record else -1 if no record is associated with the pin
+        """
+        return self.__index__[self.__slot__(pin)]
+
+    def is_removed(self, row):
+        """Checks if a row was removed from the store."""
+        return self.__offsets__[row * self.FIELDS + self.PIN] == self.REMOVED
+
+    def get_balance(self, row):
+        """Get the balance of a row."""
+        return self.__balances__[row]
+
+    def set_balance(self, row, balance):
+        """Change the balance of a row."""
+        self.__balances__[row] = balance
+
+    def get_string(self, row, field):
+        """Get one of the string fields of a row.
+
+        :param row: Row of the record
+        :param field: One of the PIN, ACCOUNT_NUMBER, FIRST_NAME or LAST_NAME class constants
+        :return: Value of the field
+        """
+        return self.__string_bytes__(row, field).decode()
+
+    def set_string(self, row, field, value):
+        """Change one of the string fields of a row other than the pin.
+
+        The new value is appended to the string buffer, the space taken by the previous value is not reclaimed.
+
+        :param row: Row of the record
+        :param field: One of the ACCOUNT_NUMBER, FIRST_NAME or LAST_NAME class constants
+        :param value: New value of the field
+        :return: None
+        """
+        if field == self.PIN:
+            raise Exception("The pin of a record can't be changed in place")
+        with self.__lock__:
+            self.__offsets__[row * self.FIELDS + field] = self.__pack__(value)
+
+    def __string_bytes__(self, row, field):
+        """Get the encoded value of one of the string fields of a row."""
+        offset = self.__offsets__[row * self.FIELDS + field]
+        return bytes(self.__strings__[offset + 1:offset + 1 + self.__strings__[offset]])
+
+    def __pack__(self, value):
+        """Appends a length prefixed string to the string buffer and returns its offset."""
+        data = value.encode()
+        if len(data) > self.MAX_STRING_LENGTH:
+            raise Exception("Invalid argument: {} is longer than {} bytes".format(value, self.MAX_STRING_LENGTH))
+        offset = len(self.__strings__)
+        self.__strings__.append(len(data))
+        self.__strings__ += data
+        return offset
+
+    def __slot__(self, pin):
+        """Get the slot of the pin index holding the row of the pin, or the empty slot ending its probe sequence."""
+        key = pin.encode()
+        index = self.__index__
+        mask = len(index) - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            row = index[slot]
+            if row == self.EMPTY or row >= 0 and self.__string_bytes__(row, self.PIN) == key:
+                return slot
+            slot = (slot + 1) & mask
+
+    def __insert__(self, row):
+        """Adds a row to the pin index."""
+        index = self.__index__
+        mask = len(index) - 1
+        slot = zlib.crc32(self.__string_bytes__(row, self.PIN)) & mask
+        while index[slot] >= 0:
+            slot = (slot + 1) & mask
+        index[slot] = row
+
+    def __rehash__(self, size):
+        """Rebuilds the pin index with the specified number of slots."""
+        self.__index__ = array("i", [self.EMPTY]) * size
+        for row in range(len(self.__balances__)):
+            if self.__offsets__[row * self.FIELDS + self.PIN] != self.REMOVED:
+                self.__insert__(row)
+
+    @staticmethod
+    def __table_size__(capacity):
+        """Get the smallest power of two holding 'capacity' rows at a load factor of at most one half."""
+        size = 8
+        while size < capacity * 2:
+            size *= 2
+        return size
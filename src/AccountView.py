@@ -0,0 +1,159 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from BankAccount import BankAccount
+
+
+class AccountView:
+    """View of a row of an 'AccountStore' with the same interface as a 'BankAccount'.
+
+    The view holds no account state of its own, every read and write goes to the row of the store, so any number of
+    views of the same row observe the same balance. Views are cheap to create and are not meant to be kept around.
+    """
+
+    __slots__ = ("__store__", "__row__", "__observer__")
+
+    DEPOSIT = BankAccount.DEPOSIT
+    WITHDRAW = BankAccount.WITHDRAW
+
+    def __init__(self, store, row):
+        """Initializes a view of a row of the store.
+
+        :param store: 'AccountStore' holding the record
+        :param row: Row of the record in the store
+        :return: A view of the record
+        """
+        self.__store__ = store
+        self.__row__ = row
+        self.__observer__ = None
+
+    def is_removed(self):
+        """Checks if the row of the view was removed from the store."""
+        return self.__store__.is_removed(self.__row__)
+
+    def get_account_number(self):
+        """Get the object's stored account number."""
+        return self.__store__.get_string(self.__row__, self.__store__.ACCOUNT_NUMBER)
+
+    def set_first_name(self, first_name):
+        """Change the first name field of the object.
+
+        Checks that the argument passed in is of type 'str' else an 'Exception' is raised.
+
+        :param first_name: New name to overwrite the previously stored name
+        :return: None
+        """
+        if type(first_name) != str:
+            raise Exception("Invalid argument: first_name of type {} should be: <class 'str'>".format(type(first_name)))
+        self.__store__.set_string(self.__row__, self.__store__.FIRST_NAME, first_name)
+
+    def get_first_name(self):
+        """Get the object's stored first name.
+
+        :return: Current first name associated with the account
+        """
+        return self.__store__.get_string(self.__row__, self.__store__.FIRST_NAME)
+
+    def set_last_name(self, last_name):
+        """Change the last name field of the object.
+
+        Checks that the argument passed in is of type 'str' else an 'Exception' is raised.
+
+        :param last_name: New name to overwrite the previously stored name
+        :return: None
+        """
+        if type(last_name) != str:
+            raise Exception("Invalid argument: last_name of type {} should be: <class 'str'>".format(type(last_name)))
+        self.__store__.set_string(self.__row__, self.__store__.LAST_NAME, last_name)
+
+    def get_last_name(self):
+        """Get the object's stored last name.
+
+        :return: Current last name associated with the account
+        """
+        return self.__store__.get_string(self.__row__, self.__store__.LAST_NAME)
+
+    def set_observer(self, observer):
+        """Attach an observer to be notified of the balance changes made through this view.
+
+        :param observer: Object providing a 'transaction_applied' method or None to detach the current observer
+        :return: None
+        """
+        self.__observer__ = observer
+
+    def get_balance(self):
+        """Get the object's stored balance.
+
+        :return: Current account balance
+        """
+        return self.__store__.get_balance(self.__row__)
+
+    def set_balance(self, balance):
+        """Overwrites the stored balance, used to restore the state of the account from a durable copy.
+
+        Checks that the argument passed in is of type 'int' else an 'Exception' is raised.
+
+        :param balance: Balance to store
+        :return: None
+        """
+        if type(balance) != int:
+            raise Exception("Invalid argument: balance of type {} should be: <class 'int'>".format(type(balance)))
+        self.__store__.set_balance(self.__row__, balance)
+
+    def deposit(self, amount):
+        """Increments the current balance by the specified amount.
+
+        Checks that the argument passed in is of type 'int' else an 'Exception' is raised.
+
+        If the amount specified is less than zero(0), no operation is performed and the balance remains unchanged.
+
+        :param amount: Amount to increment the current balance
+        :return: None
+        """
+        if type(amount) != int:
+            raise Exception("Invalid argument: amount of type {} should be: <class 'int'>".format(type(amount)))
+        if amount > 0:
+            self.__store__.set_balance(self.__row__, self.__store__.get_balance(self.__row__) + amount)
+            if self.__observer__ is not None:
+                self.__observer__.transaction_applied(self, self.DEPOSIT, amount)
+
+    def withdraw(self, amount):
+        """Decrements the current balance by the specified amount if its less than or equal to the current balance and
+        returns the specified amount. If amount specified is greater than the current balance, no operation is
+        performed, the balance remains unchanged and zero(0) is returned.
+
+        Checks that the argument passed in is of type 'int' else an 'Exception' is raised.
+
+        :param amount: Amount to decrement the current balance
+        :return: Amount specified if its less than or equal to the current balance
+        """
+        if type(amount) != int:
+            raise Exception("Invalid argument: amount of type {} should be: <class 'int'>".format(type(amount)))
+        balance = self.__store__.get_balance(self.__row__)
+        if amount <= balance:
+            self.__store__.set_balance(self.__row__, balance - amount)
+            if self.__observer__ is not None:
+                self.__observer__.transaction_applied(self, self.WITHDRAW, amount)
+            return amount
+        else:
+            return 0
+
+    def get_account_details(self):
+        """Returns a string representation with the current state of the record in the same format as
+        'BankAccount.get_account_details'.
+
+        :return: String representation of the current state of the record
+        """
+        return "Account Number: {}\nName: {}\nBalance: ${}".format(self.get_account_number(), (
+            self.get_first_name() + ' ' + self.get_last_name()), self.get_balance())
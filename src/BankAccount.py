@@ -33,8 +33,18 @@ class BankAccount:
      myAccount.withdraw(300)
      bankStatement = myAccount.get_account_details()
      print(bankStatement)
+
+    An observer can be attached to the account to be notified of every balance change, it must provide a method with
+    the signature 'transaction_applied(account, transaction_type, amount)' where 'transaction_type' is one of the
+    DEPOSIT or WITHDRAW class constants. The TRANSFER_OUT and TRANSFER_IN class constants are the transaction types of
+    the two halves of a transfer between accounts performed by the ATM.
      """
 
+    DEPOSIT = "deposit"
+    WITHDRAW = "withdraw"
+    TRANSFER_OUT = "transfer_out"
+    TRANSFER_IN = "transfer_in"
+
     def __init__(self, account_number, first_name, last_name, initial_balance):
         """Initializes a bank account object with the specified arguments.
 
@@ -51,6 +61,7 @@ class BankAccount:
         self.__first_name__ = first_name
         self.__last_name__ = last_name
         self.__balance__ = initial_balance if initial_balance >= 0 else 0
+        self.__observer__ = None
 
     def get_account_number(self):
         """Get the object's stored account number."""
@@ -94,6 +105,14 @@ class BankAccount:
         """
         return self.__last_name__
 
+    def set_observer(self, observer):
+        """Attach an observer to be notified of the balance changes of the object.
+
+        :param observer: Object providing a 'transaction_applied' method or None to detach the current observer
+        :return: None
+        """
+        self.__observer__ = observer
+
     def get_balance(self):
         """Get the object's stored balance.
 
@@ -101,6 +120,20 @@ class BankAccount:
         """
         return self.__balance__
 
+    def set_balance(self, balance):
+        """Overwrites the stored balance, used to restore the state of the account from a durable copy.
+
+        Checks that the argument passed in is of type 'int' else an 'Exception' is raised.
+
+        Unlike 'deposit' and 'withdraw' the observer is not notified since no transaction takes place.
+
+        :param balance: Balance to store
+        :return: None
+        """
+        if type(balance) != int:
+            raise Exception("Invalid argument: balance of type {} should be: <class 'int'>".format(type(balance)))
+        self.__balance__ = balance
+
     def deposit(self, amount):
         """Increments the current balance by the specified amount.
 
@@ -113,7 +146,10 @@ class BankAccount:
         """
         if type(amount) != int:
             raise Exception("Invalid argument: amount of type {} should be: <class 'int'>".format(type(amount)))
-        self.__balance__ += amount if amount > 0 else 0
+        if amount > 0:
+            self.__balance__ += amount
+            if self.__observer__ is not None:
+                self.__observer__.transaction_applied(self, self.DEPOSIT, amount)
 
     def withdraw(self, amount):
         """Decrements the current balance by the specified amount if its less than or equal to the current balance and
@@ -129,6 +165,8 @@ class BankAccount:
             raise Exception("Invalid argument: amount of type {} should be: <class 'int'>".format(type(amount)))
         if amount <= self.__balance__:
             self.__balance__ -= amount
+            if self.__observer__ is not None:
+                self.__observer__.transaction_applied(self, self.WITHDRAW, amount)
             return amount
         else:
             return 0
@@ -0,0 +1,262 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import csv
+import struct
+import time
+
+from BankAccount import BankAccount
+from DatabaseConnection import DatabaseConnection
+from DatabaseScript import DatabaseScript
+
+
+class BatchProcessor:
+    """Applies large files of deposits and withdrawals to the bank accounts in the database.
+
+    Transaction records are streamed from the file through a pipeline of generators, so the file is never held in
+    memory, and processed in chunks:
+    -> the records of a chunk are grouped by account number
+    -> the accounts of the chunk are read from the database with a few bulk queries
+    -> the records are applied to 'BankAccount' objects in file order with the usual semantics, a withdrawal for more
+       than the balance is rejected and leaves the balance unchanged
+    -> the new balances of the chunk are committed in a single transaction
+    The accounts are read in the transaction writing their balances, which holds the write lock of the database, so an
+    ATM or another process can't commit a change of the accounts in between that the new balances would overwrite.
+
+    Two file formats are supported:
+    CSV    -> one 'account_number,type,amount' record per line where type is 'deposit' or 'withdraw'
+    BINARY -> fixed size records packed as RECORD_FORMAT: a 16 byte NUL padded account number, a type byte (0 for a
+              deposit, 1 for a withdrawal) and a signed 64 bit little endian amount
+
+    Example of usage:
+    processor = BatchProcessor("accounts.db")
+    report = processor.process("settlement.csv", BatchProcessor.CSV)
+    processor.close()
+    """
+
+    CSV = 0
+    BINARY = 1
+
+    RECORD_FORMAT = "<16sBq"
+    RECORD_TYPES = (BankAccount.DEPOSIT, BankAccount.WITHDRAW)
+
+    def __init__(self, database_file, chunk_size=50000):
+        """Initializes the processor with a connection to the specified database.
+
+        :param database_file: Name of the database file with the bank account records
+        :param chunk_size: Number of transaction records committed together
+        :return: An initialized processor
+        """
+        self.__database__ = DatabaseConnection(database_file)
+        DatabaseScript.migrate_database(database_file)
+        self.__database__.set_journal_mode("WAL", "NORMAL")
+        self.__chunk_size__ = chunk_size
+
+    def process(self, transactions_file, file_format=CSV, rejected_file=None):
+        """Applies every transaction record of the file to the accounts in the database.
+
+        Checks that the argument 'file_format' passed in is valid else an 'Exception' is raised.
+
+        :param transactions_file: Name of the file with the transaction records
+        :param file_format: One of the CSV or BINARY class constants
+        :param rejected_file: Name of a CSV file to write the rejected records to along with the reason
+        :return: Dictionary with the number of applied and rejected records, the elapsed seconds and the throughput
+        """
+        if file_format == self.CSV:
+            records = self.read_csv(transactions_file)
+        elif file_format == self.BINARY:
+            records = self.read_binary(transactions_file)
+        else:
+            raise Exception("Invalid transactions file format")
+
+        applied = 0
+        rejected = 0
+        start = time.perf_counter()
+        rejects = open(rejected_file, "w", newline="") if rejected_file is not None else None
+        try:
+            writer = csv.writer(rejects) if rejects is not None else None
+            for chunk in self.chunks(records, self.__chunk_size__):
+                chunk_applied, chunk_rejected = self.__apply_chunk__(chunk)
+                applied += chunk_applied
+                rejected += len(chunk_rejected)
+                if writer is not None:
+                    writer.writerows(chunk_rejected)
+        finally:
+            if rejects is not None:
+                rejects.close()
+        elapsed = time.perf_counter() - start
+        return {
+            "applied": applied,
+            "rejected": rejected,
+            "seconds": elapsed,
+            "transactions_per_second": (applied + rejected) / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def close(self):
+        """Closes the connection to the database."""
+        self.__database__.close()
+
+    @staticmethod
+    def read_csv(transactions_file):
+        """Generates (account_number, type, amount) records from a CSV file.
+
+        A leading 'account_number,type,amount' header line and blank lines are skipped, lines that can't be parsed are
+        generated with a None amount so they are reported as rejected.
+
+        :param transactions_file: Name of the CSV file
+        :return: Generator of transaction records
+        """
+        with open(transactions_file, newline="") as source:
+            rows = csv.reader(source)
+            for row in rows:
+                if rows.line_num == 1 and [field.strip() for field in row] == ["account_number", "type", "amount"]:
+                    continue
+                if not any(field.strip() for field in row):
+                    continue
+                if len(row) != 3:
+                    yield ",".join(row), None, None
+                    continue
+                account_number, transaction_type, amount = (field.strip() for field in row)
+                try:
+                    yield account_number, transaction_type.lower(), int(amount)
+                except ValueError:
+                    yield account_number, transaction_type, None
+
+    @staticmethod
+    def read_binary(transactions_file, buffer_records=65536):
+        """Generates (account_number, type, amount) records from a binary file of RECORD_FORMAT records.
+
+        A truncated last record is generated with a None amount so it is reported as rejected.
+
+        :param transactions_file: Name of the binary file
+        :param buffer_records: Number of records read from the file at a time
+        :return: Generator of transaction records
+        """
+        record = struct.Struct(BatchProcessor.RECORD_FORMAT)
+        types = BatchProcessor.RECORD_TYPES
+        with open(transactions_file, "rb") as source:
+            while True:
+                data = source.read(record.size * buffer_records)
+                if not data:
+                    break
+                end = len(data) - len(data) % record.size
+                for account_number, transaction_type, amount in record.iter_unpack(data[:end]):
+                    yield (account_number.rstrip(b"\0").decode(),
+                           types[transaction_type] if transaction_type < len(types) else str(transaction_type), amount)
+                if end < len(data):  # only the last read of the file can end within a record
+                    yield data[end:].hex(), None, None
+
+    @staticmethod
+    def write_binary(transactions_file, records):
+        """Writes (account_number, type, amount) records to a binary file of RECORD_FORMAT records.
+
+        :param transactions_file: Name of the binary file
+        :param records: Iterable of transaction records
+        :return: None
+        """
+        record = struct.Struct(BatchProcessor.RECORD_FORMAT)
+        types = BatchProcessor.RECORD_TYPES
+        with open(transactions_file, "wb") as destination:
+            for account_number, transaction_type, amount in records:
+                destination.write(record.pack(account_number.encode(), types.index(transaction_type), amount))
+
+    @staticmethod
+    def chunks(records, chunk_size):
+        """Groups a stream of records into lists of at most 'chunk_size' records.
+
+        :param records: Iterable of records
+        :param chunk_size: Maximum number of records in a chunk
+        :return: Generator of lists of records
+        """
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def __apply_chunk__(self, chunk):
+        """Applies a chunk of records and commits the new balances, returns the applied count and rejected rows."""
+        rejected = []
+        grouped = dict()
+        for record in chunk:
+            account_number, transaction_type, amount = record
+            if amount is None:
+                rejected.append(record + ("malformed record",))
+            elif transaction_type not in self.RECORD_TYPES:
+                rejected.append(record + ("unknown transaction type",))
+            elif amount <= 0:
+                rejected.append(record + ("invalid amount",))
+            else:
+                grouped.setdefault(account_number, []).append(record)
+
+        applied = 0
+        with self.__database__.transaction():
+            accounts = self.__load_accounts__(list(grouped))
+            for account_number, records in grouped.items():
+                account = accounts.get(account_number)
+                for record in records:
+                    if account is None:
+                        rejected.append(record + ("unknown account",))
+                    elif record[1] == BankAccount.DEPOSIT:
+                        account.deposit(record[2])
+                        applied += 1
+                    elif account.withdraw(record[2]) == record[2]:
+                        applied += 1
+                    else:
+                        rejected.append(record + ("insufficient funds",))
+            self.__database__.execute_many("UPDATE accounts SET balance = ? WHERE account_number = ?",
+                                           ((account.get_balance(), account_number)
+                                            for account_number, account in accounts.items()))
+        return applied, rejected
+
+    def __load_accounts__(self, account_numbers, batch=500):
+        """Reads the accounts with the specified account numbers, returns them keyed by account number."""
+        accounts = dict()
+        for start in range(0, len(account_numbers), batch):
+            keys = account_numbers[start:start + batch]
+            for account in self.__database__.fetch_iter(
+                    "SELECT account_number, first_name, last_name, balance FROM accounts WHERE account_number IN ({})"
+                    .format(",".join("?" * len(keys))), keys, BankAccount):
+                accounts[account.get_account_number()] = account
+        return accounts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a file of deposits and withdrawals to the bank accounts.")
+    parser.add_argument("transactions_file", help="file with the transaction records")
+    parser.add_argument("--database", default="accounts.db", help="database file with the bank account records")
+    parser.add_argument("--binary", action="store_true", help="the file holds binary records instead of CSV")
+    parser.add_argument("--rejected", default=None, help="CSV file to write the rejected records to")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="records committed together")
+    arguments = parser.parse_args()
+
+    processor = BatchProcessor(arguments.database, arguments.chunk_size)
+    try:
+        report = processor.process(arguments.transactions_file,
+                                   BatchProcessor.BINARY if arguments.binary else BatchProcessor.CSV,
+                                   arguments.rejected)
+    finally:
+        processor.close()
+    print("Applied: {}".format(report["applied"]))
+    print("Rejected: {}".format(report["rejected"]))
+    print("Elapsed: {:.3f}s".format(report["seconds"]))
+    print("Throughput: {:.0f} transactions/s".format(report["transactions_per_second"]))
+
+
+if __name__ == "__main__":
+    main()
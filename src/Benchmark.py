@@ -0,0 +1,215 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from ATM import ATM
+from DatabaseScript import DatabaseScript
+from RecordsLoader import RecordsLoader
+
+
+class Benchmark:
+    """Measures the load -> authenticate -> transact hot path of the simulator.
+
+    For every database size a synthetic database is generated once and reused by later runs, then a fresh process
+    measures:
+    -> the time taken by 'DatabaseScript.load_database' to create the sample database
+    -> the startup time of an ATM, which loads the records with 'RecordsLoader', and the peak resident memory after it
+    -> the throughput of 'ATM.validate_pin' followed by 'ATM.load_account' for random pins
+    -> the throughput of 'BankAccount.deposit' and 'BankAccount.withdraw'
+
+    Measuring every size in its own process keeps the peak resident memory of one size from hiding the next.
+
+    The results are reported as JSON so that runs on different commits can be compared.
+
+    Example of usage:
+    benchmark = Benchmark("benchmarks", [1000, 100000])
+    print(json.dumps(benchmark.run(), indent=2))
+    """
+
+    DEFAULT_SIZES = (1000, 100000, 10000000)
+    LOADING_MODES = {"eager": RecordsLoader.EAGER, "lazy": RecordsLoader.LAZY, "compact": RecordsLoader.COMPACT,
+                     "snapshot": RecordsLoader.SNAPSHOT}
+
+    def __init__(self, directory, sizes=DEFAULT_SIZES, loading_mode="eager", operations=100000, seed=0):
+        """Initializes the benchmark.
+
+        Checks that the argument 'loading_mode' passed in is one of the keys of LOADING_MODES else an 'Exception' is
+        raised.
+
+        :param directory: Directory holding the generated databases
+        :param sizes: Numbers of records of the databases to measure
+        :param loading_mode: Name of the records loading mode of the ATM
+        :param operations: Number of operations timed for every throughput measurement
+        :param seed: Seed of the generated databases and of the pins looked up
+        :return: An initialized benchmark, call 'run' to measure
+        """
+        if loading_mode not in self.LOADING_MODES:
+            raise Exception("Invalid argument: unknown loading_mode {}".format(loading_mode))
+        self.__directory__ = directory
+        self.__sizes__ = list(sizes)
+        self.__loading_mode__ = loading_mode
+        self.__operations__ = operations
+        self.__seed__ = seed
+
+    def run(self):
+        """Measures every database size.
+
+        :return: Dictionary with the description of the environment and the results for every size
+        """
+        os.makedirs(self.__directory__, exist_ok=True)
+        results = []
+        for size in self.__sizes__:
+            database_file = os.path.join(self.__directory__, "accounts_{}.db".format(size))
+            start = time.perf_counter()
+            DatabaseScript.load_synthetic_database(database_file, size, self.__seed__)
+            generation_seconds = time.perf_counter() - start
+
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                result = pool.apply(measure, (database_file, self.LOADING_MODES[self.__loading_mode__],
+                                              self.__operations__, self.__seed__))
+            result["size"] = size
+            result["generation_seconds"] = generation_seconds
+            results.append(result)
+        return {
+            "commit": self.__commit__(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "loading_mode": self.__loading_mode__,
+            "results": results,
+        }
+
+    @staticmethod
+    def __commit__():
+        """Get the commit of the working tree if it is a git checkout."""
+        try:
+            return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+        except OSError:
+            return None
+
+
+def measure(database_file, loading_mode, operations, seed):
+    """Measures the hot path against a single database, meant to run in a fresh process.
+
+    :param database_file: Name of the database file with the bank account records
+    :param loading_mode: One of the 'RecordsLoader' loading mode class constants
+    :param operations: Number of operations timed for every throughput measurement
+    :param seed: Seed of the pins looked up
+    :return: Dictionary with the measured results
+    """
+    generator = random.Random(seed)
+    pins = sample_pins(database_file, min(operations, 10000), generator)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        DatabaseScript.load_database(os.path.join(directory, "accounts.db"))
+        load_database_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    atm = ATM(database_file, loading_mode)
+    startup_seconds = time.perf_counter() - start
+    startup_peak_rss = peak_rss()
+
+    lookups = [pins[generator.randrange(len(pins))] for _ in range(operations)]
+    start = time.perf_counter()
+    for pin in lookups:
+        if atm.validate_pin(pin):
+            atm.load_account(pin)
+    authenticate_seconds = time.perf_counter() - start
+
+    accounts = [atm.load_account(pin) for pin in pins]
+    start = time.perf_counter()
+    for number in range(operations):
+        accounts[number % len(accounts)].deposit(10)
+    deposit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for number in range(operations):
+        accounts[number % len(accounts)].withdraw(10)
+    withdraw_seconds = time.perf_counter() - start
+    atm.close()
+
+    return {
+        "load_database_seconds": load_database_seconds,
+        "startup_seconds": startup_seconds,
+        "startup_peak_rss_bytes": startup_peak_rss,
+        "authenticate_ops_per_second": operations / authenticate_seconds,
+        "deposit_ops_per_second": operations / deposit_seconds,
+        "withdraw_ops_per_second": operations / withdraw_seconds,
+        "peak_rss_bytes": peak_rss(),
+    }
+
+
+def sample_pins(database_file, count, generator):
+    """Reads the pins of random records of the database without scanning the accounts table.
+
+    :param database_file: Name of the database file with the bank account records
+    :param count: Number of pins to read
+    :param generator: Random number generator choosing the records
+    :return: List of pins
+    """
+    connection = sqlite3.connect(database_file)
+    rows = connection.execute("SELECT MAX(rowid) FROM accounts").fetchone()[0] or 0
+    pins = []
+    for _ in range(count if rows else 0):
+        record = connection.execute("SELECT {} FROM accounts WHERE rowid = ?".format(DatabaseScript.RECORD_KEY),
+                                    (generator.randint(1, rows),)).fetchone()
+        if record is not None:
+            pins.append(record[0])
+    connection.close()
+    return pins
+
+
+def peak_rss():
+    """Get the peak resident memory of the current process in bytes."""
+    maximum = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximum if sys.platform == "darwin" else maximum * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the load, authenticate and transact hot path.")
+    parser.add_argument("--directory", default="benchmarks", help="directory holding the generated databases")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in Benchmark.DEFAULT_SIZES),
+                        help="comma separated numbers of records to measure")
+    parser.add_argument("--loading-mode", default="eager", choices=sorted(Benchmark.LOADING_MODES),
+                        help="records loading mode of the ATM")
+    parser.add_argument("--operations", type=int, default=100000, help="operations per throughput measurement")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated data")
+    parser.add_argument("--output", default=None, help="file to write the JSON report to instead of stdout")
+    arguments = parser.parse_args()
+
+    benchmark = Benchmark(arguments.directory, [int(size) for size in arguments.sizes.split(",")],
+                          arguments.loading_mode, arguments.operations, arguments.seed)
+    report = json.dumps(benchmark.run(), indent=2)
+    if arguments.output is None:
+        print(report)
+    else:
+        with open(arguments.output, "w") as destination:
+            destination.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
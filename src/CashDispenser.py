@@ -0,0 +1,222 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+
+class CashDispenser:
+    """Model of the cash cassettes of an ATM and of the choice of the notes to dispense.
+
+    Every cassette holds notes of one denomination. An amount can be dispensed if some combination of the notes left
+    adds up to it exactly, the solver looks for the combination using as many large notes as possible.
+
+    The solver is a memoized search over the denominations from the largest to the smallest: the combinations for an
+    amount using only the denominations from position 'i' onwards depend on the counts of those denominations alone, so
+    they are remembered in one table per position. Solving an amount never uses more notes of a denomination than fit
+    in the amount, so a count only matters to the amounts larger than the notes left. When the count of a cassette
+    changes from 'a' to 'b' notes of 'd', only the entries for amounts of at least (min(a, b) + 1) * d are discarded,
+    from the tables of its position and of the larger denominations. While the cassettes are well stocked dispensing
+    discards nothing and amounts which have been solved before are answered with a single lookup, 'get_statistics'
+    tells how often the tables are hit.
+
+    Example of usage:
+    dispenser = CashDispenser({100: 50, 50: 100, 20: 200})
+    notes = dispenser.dispense(170)    # {100: 1, 50: 1, 20: 1}
+    dispenser.load(20, 500)
+    """
+
+    def __init__(self, cassettes):
+        """Initializes the dispenser with the notes of its cassettes.
+
+        Checks that the denominations and counts are positive and non-negative 'int' values else an 'Exception' is
+        raised.
+
+        :param cassettes: Dictionary of the number of notes keyed by denomination
+        :return: An initialized dispenser
+        """
+        for denomination, count in cassettes.items():
+            self.__check__(denomination, count)
+        self.__denominations__ = sorted(cassettes, reverse=True)
+        self.__positions__ = {denomination: position for position, denomination in enumerate(self.__denominations__)}
+        self.__counts__ = [cassettes[denomination] for denomination in self.__denominations__]
+        self.__tables__ = [dict() for _ in self.__denominations__]
+        self.__largest__ = [0] * len(self.__denominations__)
+        self.__hits__ = 0
+        self.__misses__ = 0
+        self.__discarded__ = 0
+        self.__lock__ = threading.Lock()
+
+    def get_cassettes(self):
+        """Get the number of notes left in every cassette.
+
+        :return: Dictionary of the number of notes keyed by denomination
+        """
+        with self.__lock__:
+            return dict(zip(self.__denominations__, self.__counts__))
+
+    def get_total(self):
+        """Get the total amount of cash left in the cassettes."""
+        with self.__lock__:
+            return sum(denomination * count for denomination, count in zip(self.__denominations__, self.__counts__))
+
+    def can_dispense(self, amount):
+        """Checks if an amount can be dispensed with the notes left.
+
+        :param amount: Amount to dispense
+        :return: True if a combination of the notes left adds up to the amount else False
+        """
+        with self.__lock__:
+            return self.__solve__(amount) is not None
+
+    def solve(self, amount):
+        """Get the notes that would be dispensed for an amount, without taking them from the cassettes.
+
+        :param amount: Amount to dispense
+        :return: Dictionary of the number of notes keyed by denomination, None if the amount can't be dispensed
+        """
+        with self.__lock__:
+            return self.__notes__(self.__solve__(amount))
+
+    def dispense(self, amount):
+        """Takes the notes for an amount from the cassettes.
+
+        :param amount: Amount to dispense
+        :return: Dictionary of the number of notes keyed by denomination, None if the amount can't be dispensed in
+                 which case the cassettes are unchanged
+        """
+        with self.__lock__:
+            combination = self.__solve__(amount)
+            if combination is None:
+                return None
+            self.__change__([-count for count in combination])
+            return self.__notes__(combination)
+
+    def load(self, denomination, count):
+        """Adds notes to a cassette, a cassette is added for a new denomination.
+
+        :param denomination: Denomination of the notes
+        :param count: Number of notes added
+        :return: None
+        """
+        self.__check__(denomination, count)
+        with self.__lock__:
+            if denomination not in self.__positions__:
+                self.__denominations__ = sorted(self.__denominations__ + [denomination], reverse=True)
+                counts = dict(zip(self.__positions__, self.__counts__))
+                counts[denomination] = 0
+                self.__positions__ = {value: position for position, value in enumerate(self.__denominations__)}
+                self.__counts__ = [counts[value] for value in self.__denominations__]
+                self.__tables__ = [dict() for _ in self.__denominations__]
+                self.__largest__ = [0] * len(self.__denominations__)
+            changes = [0] * len(self.__denominations__)
+            changes[self.__positions__[denomination]] = count
+            self.__change__(changes)
+
+    def restore(self, notes):
+        """Puts notes back into their cassettes, such as the notes of a withdrawal that didn't complete.
+
+        :param notes: Dictionary of the number of notes keyed by denomination, as returned by 'dispense'
+        :return: None
+        """
+        with self.__lock__:
+            changes = [0] * len(self.__denominations__)
+            for denomination, count in notes.items():
+                changes[self.__positions__[denomination]] = count
+            self.__change__(changes)
+
+    def get_statistics(self):
+        """Get the counts of the lookups of the solver tables.
+
+        :return: Dictionary with the hits and misses of the table lookups, the entries held by the tables and the
+                 entries discarded because of count changes
+        """
+        with self.__lock__:
+            return {"hits": self.__hits__, "misses": self.__misses__,
+                    "entries": sum(len(table) for table in self.__tables__), "discarded": self.__discarded__}
+
+    def prometheus_text(self):
+        """Get the statistics in the Prometheus text exposition format, see 'Instrumentation.add_collector'.
+
+        :return: Statistics as a 'str'
+        """
+        statistics = self.get_statistics()
+        lines = []
+        for name, kind, description in (
+                ("hits", "counter", "Lookups of amounts already solved by the dispense solver."),
+                ("misses", "counter", "Lookups of amounts the dispense solver had to solve."),
+                ("entries", "gauge", "Amounts held by the tables of the dispense solver."),
+                ("discarded", "counter", "Amounts discarded from the tables when the notes left changed.")):
+            metric = "atm_dispenser_{}{}".format(name, "_total" if kind == "counter" else "")
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, kind))
+            lines.append("{} {}".format(metric, statistics[name]))
+        return "\n".join(lines) + "\n"
+
+    def __solve__(self, amount, position=0):
+        """Get the number of notes of every denomination from 'position' onwards adding up to the amount, as a tuple,
+        or None if there is no such combination. The caller must hold the lock."""
+        if amount == 0:
+            return (0,) * (len(self.__denominations__) - position)
+        if position == len(self.__denominations__) or amount < 0:
+            return None
+        table = self.__tables__[position]
+        if amount in table:
+            self.__hits__ += 1
+            return table[amount]
+        self.__misses__ += 1
+        denomination = self.__denominations__[position]
+        result = None
+        for count in range(min(self.__counts__[position], amount // denomination), -1, -1):
+            rest = self.__solve__(amount - count * denomination, position + 1)
+            if rest is not None:
+                result = (count,) + rest
+                break
+        table[amount] = result
+        if amount > self.__largest__[position]:
+            self.__largest__[position] = amount
+        return result
+
+    def __change__(self, changes):
+        """Adds to the counts of the cassettes and discards the entries which depend on them. The caller must hold the
+        lock."""
+        threshold = None  # smallest amount affected by the changes of this position and of the smaller denominations
+        for position in range(len(changes) - 1, -1, -1):
+            if changes[position]:
+                count = self.__counts__[position]
+                self.__counts__[position] += changes[position]
+                affected = (min(count, self.__counts__[position]) + 1) * self.__denominations__[position]
+                threshold = affected if threshold is None else min(threshold, affected)
+            if threshold is None or self.__largest__[position] < threshold:
+                continue
+            table = self.__tables__[position]
+            discarded = [amount for amount in table if amount >= threshold]
+            for amount in discarded:
+                del table[amount]
+            self.__discarded__ += len(discarded)
+            self.__largest__[position] = threshold - 1
+
+    def __notes__(self, combination):
+        """Converts a combination of counts into a dictionary of the notes keyed by denomination."""
+        if combination is None:
+            return None
+        return {denomination: count for denomination, count in zip(self.__denominations__, combination) if count}
+
+    @staticmethod
+    def __check__(denomination, count):
+        """Validates a denomination and a number of notes."""
+        if type(denomination) != int or denomination <= 0:
+            raise Exception("Invalid argument: denomination should be a positive <class 'int'> found {}".format(
+                denomination))
+        if type(count) != int or count < 0:
+            raise Exception("Invalid argument: count should be a non-negative <class 'int'> found {}".format(count))
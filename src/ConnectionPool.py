@@ -0,0 +1,235 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+
+from DatabaseConnection import DatabaseConnection
+
+
+class ConnectionPool:
+    """Pool of database connections shared by threads and sessions.
+
+    SQLite allows many concurrent readers but a single writer, so the pool keeps two sets of connections:
+    -> 'size' read-only connections, any number of threads may use them concurrently thanks to WAL journaling
+    -> write connections, by default a single one so writers queue in the pool instead of contending for the
+       database lock
+
+    A connection is checked out for the duration of a 'with' block and returned to the pool afterwards. Connections
+    which have been idle for longer than 'health_check_interval' seconds are checked with a trivial query before they
+    are handed out, and connections which fail during use are replaced by new ones.
+
+    Example of usage:
+    pool = ConnectionPool("accounts.db", size=8)
+    with pool.reader() as database:
+        balance = database.fetch_value("SELECT balance FROM accounts WHERE pin = ?", ("2050",))
+    with pool.writer() as database:
+        with database.transaction():
+            database.execute("UPDATE accounts SET balance = ? WHERE pin = ?", (balance - 10, "2050"))
+    print(pool.statistics())
+    pool.close()
+    """
+
+    def __init__(self, database_file, size=4, writers=1, timeout=30.0, health_check_interval=30.0,
+                 synchronous="NORMAL"):
+        """Initializes the pool and opens all of its connections.
+
+        Checks that the arguments 'size' and 'writers' passed in are positive 'int' values else an 'Exception' is
+        raised.
+
+        :param database_file: Name of the database file to connect to
+        :param size: Number of read connections
+        :param writers: Number of write connections
+        :param timeout: Default number of seconds to wait for a connection before an 'Exception' is raised
+        :param health_check_interval: Number of idle seconds after which a connection is checked before use
+        :param synchronous: SQLite synchronous setting of the write connections
+        :return: An initialized pool
+        """
+        for name, value in (("size", size), ("writers", writers)):
+            if type(value) != int or value <= 0:
+                raise Exception("Invalid argument: {} should be a positive <class 'int'> found {}".format(name, value))
+        self.__database_file__ = database_file
+        self.__synchronous__ = synchronous
+        self.__timeout__ = timeout
+        self.__health_check_interval__ = health_check_interval
+        self.__lock__ = threading.Lock()
+        self.__closed__ = False
+        self.__sizes__ = {False: size, True: writers}
+        self.__in_use__ = {False: 0, True: 0}
+        self.__peak_in_use__ = {False: 0, True: 0}
+        self.__checkouts__ = 0
+        self.__wait_seconds__ = 0.0
+        self.__max_wait_seconds__ = 0.0
+        self.__timeouts__ = 0
+        self.__replaced__ = 0
+        self.__idle__ = {False: queue.LifoQueue(), True: queue.LifoQueue()}
+        for write in (True, False):
+            for _ in range(self.__sizes__[write]):
+                self.__idle__[write].put((self.__connect__(write), time.monotonic()))
+
+    @contextlib.contextmanager
+    def reader(self, timeout=None):
+        """Context manager checking out a read-only connection.
+
+        :param timeout: Seconds to wait for a connection, the default timeout of the pool if None
+        :return: Context manager yielding a 'DatabaseConnection'
+        """
+        with self.__checked_out__(False, timeout) as connection:
+            yield connection
+
+    @contextlib.contextmanager
+    def writer(self, timeout=None):
+        """Context manager checking out a write connection.
+
+        :param timeout: Seconds to wait for a connection, the default timeout of the pool if None
+        :return: Context manager yielding a 'DatabaseConnection'
+        """
+        with self.__checked_out__(True, timeout) as connection:
+            yield connection
+
+    def checkout(self, write=False, timeout=None):
+        """Takes a connection out of the pool, it must be given back with 'checkin'.
+
+        If no connection becomes available within the timeout an 'Exception' is raised.
+
+        :param write: True for a write connection, False for a read-only connection
+        :param timeout: Seconds to wait for a connection, the default timeout of the pool if None
+        :return: A 'DatabaseConnection'
+        """
+        if self.__closed__:
+            raise Exception("The connection pool is closed")
+        start = time.monotonic()
+        try:
+            connection, idle_since = self.__idle__[write].get(timeout=self.__timeout__ if timeout is None else timeout)
+        except queue.Empty:
+            with self.__lock__:
+                self.__timeouts__ += 1
+            raise Exception("No database connection became available in the pool")
+        now = time.monotonic()
+        with self.__lock__:
+            self.__in_use__[write] += 1
+            self.__peak_in_use__[write] = max(self.__peak_in_use__[write], self.__in_use__[write])
+            self.__checkouts__ += 1
+            self.__wait_seconds__ += now - start
+            self.__max_wait_seconds__ = max(self.__max_wait_seconds__, now - start)
+        if now - idle_since > self.__health_check_interval__ and not self.__healthy__(connection):
+            try:
+                connection = self.__replace__(connection, write)
+            except BaseException:  # give the slot back, it is replaced again at its next checkout
+                self.__release__(connection, write, float("-inf"))
+                raise
+        return connection
+
+    def checkin(self, connection, write=False, broken=False):
+        """Gives a connection back to the pool.
+
+        :param connection: Connection obtained from 'checkout'
+        :param write: True if it is a write connection
+        :param broken: True if the connection failed and must be replaced
+        :return: None
+        """
+        idle_since = time.monotonic()
+        if broken:
+            try:
+                connection = self.__replace__(connection, write)
+            except Exception:  # the database can't be opened right now, the slot is replaced at its next checkout
+                idle_since = float("-inf")
+        self.__release__(connection, write, idle_since)
+
+    def statistics(self):
+        """Get the usage metrics of the pool.
+
+        :return: Dictionary with the number of checkouts, the time spent waiting for connections, the number of
+                 connections in use and the current and peak utilization of the read and write connections
+        """
+        with self.__lock__:
+            return {
+                "checkouts": self.__checkouts__,
+                "wait_seconds_total": self.__wait_seconds__,
+                "wait_seconds_average": self.__wait_seconds__ / self.__checkouts__ if self.__checkouts__ else 0.0,
+                "wait_seconds_max": self.__max_wait_seconds__,
+                "timeouts": self.__timeouts__,
+                "replaced_connections": self.__replaced__,
+                "readers_in_use": self.__in_use__[False],
+                "writers_in_use": self.__in_use__[True],
+                "reader_utilization": self.__in_use__[False] / self.__sizes__[False],
+                "writer_utilization": self.__in_use__[True] / self.__sizes__[True],
+                "reader_peak_utilization": self.__peak_in_use__[False] / self.__sizes__[False],
+                "writer_peak_utilization": self.__peak_in_use__[True] / self.__sizes__[True],
+            }
+
+    def close(self):
+        """Closes the idle connections, connections in use are closed when they are given back."""
+        with self.__lock__:
+            self.__closed__ = True
+        for idle in self.__idle__.values():
+            while True:
+                try:
+                    connection, _ = idle.get_nowait()
+                except queue.Empty:
+                    break
+                connection.close()
+
+    @contextlib.contextmanager
+    def __checked_out__(self, write, timeout):
+        """Checks a connection out for the duration of a block, replacing it if the database reports it broken."""
+        connection = self.checkout(write, timeout)
+        broken = False
+        try:
+            yield connection
+        except (sqlite3.InterfaceError, sqlite3.ProgrammingError, sqlite3.DatabaseError) as error:
+            broken = not isinstance(error, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            raise
+        finally:
+            self.checkin(connection, write, broken)
+
+    def __release__(self, connection, write, idle_since):
+        """Puts a connection checked out back into the pool, or closes it if the pool is closed."""
+        with self.__lock__:
+            self.__in_use__[write] -= 1
+            closed = self.__closed__
+            if not closed:  # under the lock so 'close' can't drain the idle connections in between
+                self.__idle__[write].put((connection, idle_since))
+        if closed:
+            connection.close()
+
+    def __connect__(self, write):
+        """Opens a new connection of the specified kind."""
+        connection = DatabaseConnection(self.__database_file__, check_same_thread=False)
+        if write:
+            connection.set_journal_mode("WAL", self.__synchronous__)
+        else:
+            connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    def __replace__(self, connection, write):
+        """Closes a broken connection and opens a new one in its place."""
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+        with self.__lock__:
+            self.__replaced__ += 1
+        return self.__connect__(write)
+
+    @staticmethod
+    def __healthy__(connection):
+        """Checks that a connection can still execute queries."""
+        try:
+            return connection.fetch_value("SELECT 1") == 1
+        except sqlite3.Error:
+            return False
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
 import os
 import sqlite3
 
@@ -41,9 +42,21 @@ class DatabaseConnection:
     data_set = connection.sql_statement(connection.READ, "SELECT * FROM expenses")
     connection.sql_statement(connection.DELETE, "DELETE * FROM expenses")
     connection.sql_statement(connection.DELETE, "DROP TABLE IF EXIST expenses")
+
+    Besides 'sql_statement', a query API binds parameters to the '?' placeholders of the statements and optionally
+    converts the rows it returns into objects. Compiled statements are kept in a per-connection cache keyed by their
+    SQL text, so a statement executed repeatedly with different parameters is only prepared once.
+
+    Example of usage:
+    with connection.transaction():
+        connection.execute("UPDATE expenses SET expense = ? WHERE month = ?", (210.5, 'Jan'))
+        connection.execute_many("INSERT INTO expenses (month, year, expense) VALUES (?, ?, ?)", rows)
+    total = connection.fetch_value("SELECT SUM(expense) FROM expenses WHERE year = ?", (7,))
     """
 
-    def __init__(self, database_file):
+    DEFAULT_CACHED_STATEMENTS = 256
+
+    def __init__(self, database_file, check_same_thread=True, cached_statements=DEFAULT_CACHED_STATEMENTS):
         """Initializes a database-connection object to interact with the specified local database.
 
         Checks that the argument passed in is of type 'str' else an 'Exception' is raised.
@@ -51,6 +64,9 @@ class DatabaseConnection:
         If the specified database file doesn't exist an 'Exception' is raised.
 
         :param database_file: The local database file to connect to
+        :param check_same_thread: If False the connection may be used from threads other than the creating one, in
+                                  which case the caller is responsible for serializing access to it
+        :param cached_statements: Number of compiled statements kept for reuse by the connection
         :return: An initialized object with a connection to the specified database
         """
         if type(database_file) != str:
@@ -59,32 +75,178 @@ class DatabaseConnection:
         if not os.path.exists(database_file):
             raise Exception(
                 "Connection the to specified database {} could not be established: no such file".format(database_file))
-        self.__database__ = sqlite3.connect(database_file)
+        self.__database__ = sqlite3.connect(database_file, check_same_thread=check_same_thread,
+                                            cached_statements=cached_statements)
         self.CREATE = 0
         self.READ = 1
         self.UPDATE = 2
         self.DELETE = 3
 
-    def sql_statement(self, operation, sql):
+    def sql_statement(self, operation, sql, parameters=()):
         """Performs CRUD operations on the connected database.
 
         Checks that the argument 'sql' passed in is of type 'str' else an 'Exception' is raised.
         Checks that the argument 'operation' passed in is valid else an 'Exception' is raised.
 
+        Values supplied through 'parameters' are bound to the '?' placeholders of the statement by the database engine
+        rather than being formatted into the SQL text.
+
         :param operation: Operation to perform on the connected database
         :param sql: SQL statement to transmit to the underlying database engine
+        :param parameters: Sequence of values to bind to the placeholders of the statement
         :return: If a READ operation is to be performed, the result set is returned
         """
         if type(sql) != str:
             raise Exception(
                 "Invalid argument: sql of type {} should be: <class 'str'>".format(type(sql)))
         if operation == 0 or operation == 2 or operation == 3:
-            self.__database__.execute(sql)
+            self.__database__.execute(sql, parameters)
         elif operation == 1:
-            return self.__database__.execute(sql)
+            return self.__database__.execute(sql, parameters)
         else:
             raise Exception("Invalid SQL operation code")
 
+    def execute(self, sql, parameters=()):
+        """Executes a statement which doesn't return rows.
+
+        Checks that the argument 'sql' passed in is of type 'str' else an 'Exception' is raised.
+
+        :param sql: SQL statement with '?' placeholders
+        :param parameters: Sequence of values to bind to the placeholders
+        :return: Number of rows modified by the statement
+        """
+        self.__check_sql__(sql)
+        return self.__database__.execute(sql, parameters).rowcount
+
+    def execute_many(self, sql, parameter_sets):
+        """Executes a statement once for every set of parameters in a single call.
+
+        Checks that the argument 'sql' passed in is of type 'str' else an 'Exception' is raised.
+
+        The statement is compiled once and the parameter sets may be supplied by a generator so they never have to be
+        held in memory all at once.
+
+        :param sql: SQL statement with '?' placeholders
+        :param parameter_sets: Iterable of parameter sequences
+        :return: Number of rows modified by all the executions of the statement
+        """
+        self.__check_sql__(sql)
+        return self.__database__.executemany(sql, parameter_sets).rowcount
+
+    def fetch_one(self, sql, parameters=(), row_type=None):
+        """Executes a query and returns its first row.
+
+        Checks that the argument 'sql' passed in is of type 'str' else an 'Exception' is raised.
+
+        :param sql: SQL query with '?' placeholders
+        :param parameters: Sequence of values to bind to the placeholders
+        :param row_type: Callable receiving the columns of the row as arguments to convert it, e.g. 'BankAccount'
+        :return: First row of the result as a tuple or converted by 'row_type', None if the result is empty
+        """
+        self.__check_sql__(sql)
+        row = self.__database__.execute(sql, parameters).fetchone()
+        if row is None or row_type is None:
+            return row
+        return row_type(*row)
+
+    def fetch_all(self, sql, parameters=(), row_type=None):
+        """Executes a query and returns all its rows.
+
+        Checks that the argument 'sql' passed in is of type 'str' else an 'Exception' is raised.
+
+        :param sql: SQL query with '?' placeholders
+        :param parameters: Sequence of values to bind to the placeholders
+        :param row_type: Callable receiving the columns of a row as arguments to convert it
+        :return: List of the rows as tuples or converted by 'row_type'
+        """
+        return list(self.fetch_iter(sql, parameters, row_type))
+
+    def fetch_iter(self, sql, parameters=(), row_type=None, fetch_size=10000):
+        """Executes a query and generates its rows, reading at most 'fetch_size' rows from the database at a time.
+
+        Checks that the argument 'sql' passed in is of type 'str' else an 'Exception' is raised.
+
+        :param sql: SQL query with '?' placeholders
+        :param parameters: Sequence of values to bind to the placeholders
+        :param row_type: Callable receiving the columns of a row as arguments to convert it
+        :param fetch_size: Number of rows read from the database at a time
+        :return: Generator of the rows as tuples or converted by 'row_type'
+        """
+        self.__check_sql__(sql)
+        cursor = self.__database__.execute(sql, parameters)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                return
+            if row_type is None:
+                yield from rows
+            else:
+                for row in rows:
+                    yield row_type(*row)
+
+    def fetch_value(self, sql, parameters=(), default=None):
+        """Executes a query and returns the first column of its first row.
+
+        Checks that the argument 'sql' passed in is of type 'str' else an 'Exception' is raised.
+
+        :param sql: SQL query with '?' placeholders
+        :param parameters: Sequence of values to bind to the placeholders
+        :param default: Value returned if the result is empty
+        :return: First column of the first row else the default value
+        """
+        row = self.fetch_one(sql, parameters)
+        return default if row is None else row[0]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Context manager running the statements of its block in a single transaction.
+
+        The transaction takes the write lock of the database when it begins, so it never fails half way through
+        because another connection wrote first. It is committed when the block completes and rolled back if the block
+        raises an exception.
+
+        If a transaction is already in progress on the connection an 'Exception' is raised.
+
+        :return: Context manager yielding this connection
+        """
+        if self.__database__.in_transaction:
+            raise Exception("A transaction is already in progress on this connection")
+        self.__database__.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            self.__database__.rollback()
+            raise
+        else:
+            self.__database__.commit()
+
+    def set_journal_mode(self, journal_mode, synchronous="FULL"):
+        """Changes the journaling and synchronization behaviour of the connected database.
+
+        Checks that the arguments passed in are valid SQLite settings else an 'Exception' is raised.
+
+        :param journal_mode: SQLite journal mode such as 'WAL' or 'DELETE'
+        :param synchronous: SQLite synchronous setting such as 'FULL' or 'NORMAL'
+        :return: None
+        """
+        if journal_mode not in ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"):
+            raise Exception("Invalid argument: unknown journal_mode {}".format(journal_mode))
+        if synchronous not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise Exception("Invalid argument: unknown synchronous setting {}".format(synchronous))
+        self.__database__.execute("PRAGMA journal_mode = {}".format(journal_mode))
+        self.__database__.execute("PRAGMA synchronous = {}".format(synchronous))
+
+    def commit(self):
+        """Commits the current transaction of the connection."""
+        self.__database__.commit()
+
     def close(self):
         """Closes the connection to the database."""
         self.__database__.close()
+
+    @staticmethod
+    def __check_sql__(sql):
+        """Checks that the SQL statement is of type 'str' else an 'Exception' is raised."""
+        if type(sql) != str:
+            raise Exception(
+                "Invalid argument: sql of type {} should be: <class 'str'>".format(type(sql)))
@@ -12,12 +12,80 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import itertools
 import os
+import random
 import sqlite3
+import time
 
 
 class DatabaseScript:
-    """This module is used to populate the specified database with sample records for the purpose of simulation."""
+    """This module is used to populate the specified database with sample records for the purpose of simulation.
+
+    Besides the handful of hard-coded sample records, databases of any size can be populated with synthetic records for
+    benchmarking and load testing.
+
+    The schema of the database is versioned with SQLite's 'user_version', every entry of SCHEMA_MIGRATIONS holds the
+    statements that upgrade the schema to the next version and 'migrate_database' applies the ones that are missing.
+    """
+
+    # The records are keyed by pin in memory, an account whose pin is enrolled as a salted hash by 'PinAuthenticator'
+    # has no pin left and is keyed by CARD_KEY_PREFIX followed by its account number, which is never a valid pin
+    CARD_KEY_PREFIX = "#"
+    RECORD_KEY = "COALESCE(pin, '#' || account_number)"
+
+    SCHEMA_MIGRATIONS = (
+        # 1: unique indexes for the point lookups by pin and by account number
+        ("DROP INDEX IF EXISTS accounts_pin",
+         "DROP INDEX IF EXISTS accounts_account_number",
+         "CREATE UNIQUE INDEX accounts_pin ON accounts (pin)",
+         "CREATE UNIQUE INDEX accounts_account_number ON accounts (account_number)"),
+        # 2: transaction history of the accounts, indexed for the statements of an account by time
+        ("CREATE TABLE IF NOT EXISTS transactions (id INTEGER PRIMARY KEY, account_number TEXT NOT NULL, "
+         "timestamp REAL NOT NULL, type TEXT NOT NULL, amount INTEGER NOT NULL, balance INTEGER NOT NULL)",
+         "CREATE INDEX IF NOT EXISTS transactions_account_timestamp ON transactions (account_number, timestamp)"),
+        # 3: halves of the transfers between shards which are prepared but not yet committed or aborted
+        ("CREATE TABLE IF NOT EXISTS prepared_transfers (id TEXT PRIMARY KEY, account_number TEXT NOT NULL, "
+         "amount INTEGER NOT NULL)",),
+        # 4: salted pin hashes indexed by account number and the failed attempts shared by all the sessions
+        ("CREATE TABLE IF NOT EXISTS credentials (account_number TEXT PRIMARY KEY, salt BLOB NOT NULL, "
+         "pin_hash BLOB NOT NULL, iterations INTEGER NOT NULL)",
+         "CREATE TABLE IF NOT EXISTS login_attempts (account_number TEXT PRIMARY KEY, failures INTEGER NOT NULL, "
+         "locked_until REAL NOT NULL)"),
+        # 5: change log of the accounts filled by triggers, versions only ever grow and the latest 100000 are kept
+        ("CREATE TABLE IF NOT EXISTS account_changes (version INTEGER PRIMARY KEY AUTOINCREMENT, pin TEXT NOT NULL, "
+         "origin TEXT)",
+         "CREATE TRIGGER IF NOT EXISTS accounts_insert_change AFTER INSERT ON accounts BEGIN "
+         "INSERT INTO account_changes (pin) VALUES (new.pin); END",
+         "CREATE TRIGGER IF NOT EXISTS accounts_update_change AFTER UPDATE ON accounts BEGIN "
+         "INSERT INTO account_changes (pin) VALUES (new.pin); "
+         "INSERT INTO account_changes (pin) SELECT old.pin WHERE old.pin IS NOT new.pin; END",
+         "CREATE TRIGGER IF NOT EXISTS accounts_delete_change AFTER DELETE ON accounts BEGIN "
+         "INSERT INTO account_changes (pin) VALUES (old.pin); END",
+         "CREATE TRIGGER IF NOT EXISTS account_changes_retention AFTER INSERT ON account_changes BEGIN "
+         "DELETE FROM account_changes WHERE version <= new.version - 100000; END"),
+        # 6: record keys of the accounts whose pins are enrolled, which no longer keep their plaintext pin
+        ("CREATE UNIQUE INDEX IF NOT EXISTS accounts_record_key ON accounts (COALESCE(pin, '#' || account_number))",
+         "DROP TRIGGER IF EXISTS accounts_insert_change",
+         "DROP TRIGGER IF EXISTS accounts_update_change",
+         "DROP TRIGGER IF EXISTS accounts_delete_change",
+         "CREATE TRIGGER accounts_insert_change AFTER INSERT ON accounts BEGIN "
+         "INSERT INTO account_changes (pin) VALUES (COALESCE(new.pin, '#' || new.account_number)); END",
+         "CREATE TRIGGER accounts_update_change AFTER UPDATE ON accounts BEGIN "
+         "INSERT INTO account_changes (pin) VALUES (COALESCE(new.pin, '#' || new.account_number)); "
+         "INSERT INTO account_changes (pin) SELECT COALESCE(old.pin, '#' || old.account_number) "
+         "WHERE COALESCE(old.pin, '#' || old.account_number) IS NOT COALESCE(new.pin, '#' || new.account_number); END",
+         "CREATE TRIGGER accounts_delete_change AFTER DELETE ON accounts BEGIN "
+         "INSERT INTO account_changes (pin) VALUES (COALESCE(old.pin, '#' || old.account_number)); END",
+         "UPDATE accounts SET pin = NULL WHERE account_number IN (SELECT account_number FROM credentials)"),
+    )
+
+    FIRST_NAMES = ("David", "Rico", "Mark", "Susan", "Wayne", "Yevette", "Maxwell", "Anna", "Omar", "Grace", "Ivan",
+                   "Mei", "Lucas", "Priya", "Tomas", "Zoe")
+    LAST_NAMES = ("Chen", "Felix", "Hurd", "Barbara", "Mark", "Pauline", "Richards", "Novak", "Haddad", "Okafor",
+                  "Silva", "Tanaka", "Moreau", "Singh", "Kowalski", "Byrne")
+
     @staticmethod
     def load_database(database_file):
         """Populates the specified database file with sample data for simulation.
@@ -61,4 +129,163 @@ class DatabaseScript:
                 "INSERT INTO accounts (account_number, first_name, last_name, balance, pin)"
                 " VALUES ('10007', 'Maxwell', 'Richards', 300, '9584')")
             connection.commit()
+            DatabaseScript.__apply_migrations__(connection)
             connection.close()
+
+    @staticmethod
+    def migrate_database(database_file):
+        """Upgrades the schema of the specified database file to the latest version.
+
+        Checks that the argument 'database_file' passed in is of type 'str' else an 'Exception' is raised.
+
+        Migrations are applied in a single transaction holding the write lock, so concurrent callers never apply the
+        same migration twice. If the records violate a constraint introduced by a migration, such as two accounts with
+        the same pin, an 'Exception' is raised and the schema is left unchanged.
+
+        :param database_file: Name of the database file to upgrade
+        :return: Schema version of the database
+        """
+        if type(database_file) != str:
+            raise Exception(
+                "Invalid argument: database_file of type {} should be: <class 'str'>".format(type(database_file)))
+        connection = sqlite3.connect(database_file)
+        try:
+            return DatabaseScript.__apply_migrations__(connection)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def __apply_migrations__(connection):
+        """Applies the missing schema migrations on an open connection and returns the resulting schema version."""
+        latest = len(DatabaseScript.SCHEMA_MIGRATIONS)
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= latest:
+            return latest
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            for statements in DatabaseScript.SCHEMA_MIGRATIONS[version:]:
+                for statement in statements:
+                    connection.execute(statement)
+            connection.execute("PRAGMA user_version = {}".format(max(version, latest)))
+        except sqlite3.IntegrityError as error:
+            connection.rollback()
+            raise Exception("The database schema could not be migrated: {}".format(error))
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+        return max(version, latest)
+
+    @staticmethod
+    def load_synthetic_database(database_file, count, seed=0, transaction_size=1000000):
+        """Populates the specified database file with synthetic records for benchmarking and load testing.
+
+        Checks that the argument 'database_file' passed in is of type 'str' else an 'Exception' is raised.
+
+        If the specified database file already exist no operation is performed, else the file is created and populated
+        with 'count' records generated by 'synthetic_records'.
+
+        The records are inserted with bulk statements in large transactions while journaling and synchronous writes
+        are disabled, the schema migrations which build the lookup indexes are only applied once all the records are in
+        place. The database is populated under a temporary name and renamed when complete so an interrupted run never
+        leaves a partial database behind.
+
+        :param database_file: Name of the database file to populate with synthetic data
+        :param count: Number of records to generate
+        :param seed: Seed of the generated data, the same seed always generates the same records
+        :param transaction_size: Number of records inserted per transaction
+        :return: None
+        """
+        if type(database_file) != str:
+            raise Exception(
+                "Invalid argument: database_file of type {} should be: <class 'str'>".format(type(database_file)))
+        if os.path.exists(database_file):
+            return
+        temporary_file = database_file + ".tmp"
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+        connection = sqlite3.connect(temporary_file)
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA locking_mode = EXCLUSIVE")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        connection.execute("PRAGMA cache_size = -262144")  # 256 MiB, negative values are in KiB
+        connection.execute(
+            "CREATE TABLE accounts (account_number TEXT, first_name TEXT, last_name TEXT, balance INT, pin TEXT)")
+        records = DatabaseScript.synthetic_records(count, seed)
+        for _ in range(0, count, transaction_size):
+            connection.executemany(
+                "INSERT INTO accounts (account_number, first_name, last_name, balance, pin) VALUES (?, ?, ?, ?, ?)",
+                itertools.islice(records, transaction_size))
+            connection.commit()
+        DatabaseScript.__apply_migrations__(connection)
+        connection.execute("ANALYZE")
+        connection.commit()
+        connection.close()
+        os.replace(temporary_file, database_file)
+
+    @staticmethod
+    def synthetic_records(count, seed=0):
+        """Generates synthetic (account_number, first_name, last_name, balance, pin) records.
+
+        :param count: Number of records to generate
+        :param seed: Seed of the generated data
+        :return: Generator of records
+        """
+        for chunk in DatabaseScript.synthetic_chunks(count, seed):
+            yield from chunk
+
+    @staticmethod
+    def synthetic_chunks(count, seed=0, chunk_size=100000):
+        """Generates synthetic (account_number, first_name, last_name, balance, pin) records in lists of at most
+        'chunk_size' records.
+
+        Account numbers are sequential and pins are a seeded permutation of a range large enough for 'count' pins, so
+        both are unique without having to remember the values generated so far. The values of a whole chunk are drawn
+        at once which is much faster than drawing them record by record.
+
+        Checks that the argument 'count' passed in is a non-negative 'int' else an 'Exception' is raised.
+
+        :param count: Number of records to generate
+        :param seed: Seed of the generated data
+        :param chunk_size: Maximum number of records in a chunk
+        :return: Generator of lists of records
+        """
+        if type(count) != int or count < 0:
+            raise Exception("Invalid argument: count should be a non-negative <class 'int'> found {}".format(count))
+        generator = random.Random(seed)
+        width = max(4, len(str(count * 10)))
+        modulus = 10 ** width
+        multiplier = generator.randrange(1, modulus)
+        while multiplier % 2 == 0 or multiplier % 5 == 0:  # coprime with the modulus so the mapping is a permutation
+            multiplier = generator.randrange(1, modulus)
+        offset = generator.randrange(modulus)
+        for start in range(0, count, chunk_size):
+            size = min(chunk_size, count - start)
+            numbers = range(start, start + size)
+            yield list(zip(map(str, range(10000001 + start, 10000001 + start + size)),
+                           generator.choices(DatabaseScript.FIRST_NAMES, k=size),
+                           generator.choices(DatabaseScript.LAST_NAMES, k=size),
+                           generator.choices(range(100, 1000000), k=size),
+                           [str((multiplier * number + offset) % modulus).zfill(width) for number in numbers]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate a database with sample or synthetic bank account records.")
+    parser.add_argument("database_file", help="database file to create")
+    parser.add_argument("--synthetic", type=int, default=None, help="number of synthetic records to generate")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic records")
+    parser.add_argument("--transaction-size", type=int, default=1000000, help="records inserted per transaction")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    if arguments.synthetic is None:
+        DatabaseScript.load_database(arguments.database_file)
+    else:
+        DatabaseScript.load_synthetic_database(arguments.database_file, arguments.synthetic, arguments.seed,
+                                               arguments.transaction_size)
+    print("Populated {} in {:.2f}s".format(arguments.database_file, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import json
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+class FraudRules:
+    """Fraud and velocity rules evaluated on every withdrawal of an ATM.
+
+    A rule is described by a dictionary, such as one of the entries of a JSON rules file:
+    {"name": "daily-cap", "type": "amount", "window": 86400, "limit": 2000}
+    {"name": "hourly-count", "type": "count", "window": 3600, "limit": 5, "action": "flag"}
+    {"name": "unusual", "type": "unusual", "factor": 10, "min_history": 5}
+
+    Class constants are provided for the types of rules:
+    AMOUNT  -> the amounts withdrawn within the last 'window' seconds, this one included, may not exceed 'limit'
+    COUNT   -> the withdrawals within the last 'window' seconds, this one included, may not exceed 'limit'
+    UNUSUAL -> once an account has 'min_history' withdrawals, an amount may not exceed 'factor' times their average
+
+    A rule denies the withdrawals breaking it, or only counts them when its 'action' is 'flag'.
+
+    The rules are compiled once when the object is created. The rules with the same window share the counters of the
+    window, and only the smallest limit of the denying rules of a window has to be compared, so evaluating a withdrawal
+    takes a few comparisons per distinct window however many rules there are.
+
+    Every account has a sliding window counter per distinct window: the window is split in 'buckets' buckets holding
+    the count and total of the withdrawals of their slice of time, along with the count and total of the whole window.
+    Recording a withdrawal adds to the current bucket and expires the buckets which left the window, so windows are
+    exact to within one bucket and every update takes constant time. The average amount is an exponentially weighted
+    moving average.
+
+    The buckets of at most 'max_accounts' accounts are kept. The counters of the accounts which withdrew least recently
+    are folded into a summary of a few numbers: the count and total of every window, the average and the time of the
+    last withdrawal. A summarized account is restored as if the withdrawals still in its windows were all made at its
+    last withdrawal, so they expire as late as they possibly could and an account is never let past a limit by being
+    evicted. Summaries are dropped once their windows expired, only the average is kept if there are unusual rules, for
+    at most 'max_accounts' accounts, those of the least recently active accounts beyond it are dropped and these
+    accounts need 'min_history' withdrawals again before the unusual rules apply to them.
+
+    Example of usage:
+    rules = FraudRules.load("rules.json")
+    if rules.evaluate("10001", 500) is None:
+        ...
+        rules.record("10001", 500)
+    """
+
+    AMOUNT = "amount"
+    COUNT = "count"
+    UNUSUAL = "unusual"
+
+    DENY = "deny"
+    FLAG = "flag"
+
+    def __init__(self, rules, buckets=24, max_accounts=65536, smoothing=0.1):
+        """Compiles the rules.
+
+        Checks that every rule has a name, a known type and action and the settings of its type else an 'Exception' is
+        raised.
+
+        :param rules: Iterable of the dictionaries describing the rules
+        :param buckets: Number of buckets of the sliding window counters
+        :param max_accounts: Maximum number of accounts whose buckets are kept, the others are summarized
+        :param smoothing: Weight of the latest withdrawal in the average amount of an account
+        :return: An object ready to evaluate withdrawals
+        """
+        if type(buckets) != int or buckets <= 0:
+            raise Exception("Invalid argument: buckets should be a positive <class 'int'> found {}".format(buckets))
+        self.__buckets__ = buckets
+        self.__max_accounts__ = max_accounts
+        self.__smoothing__ = smoothing
+        self.__rules__ = [dict(rule) for rule in rules]
+        self.__windows__ = []
+        self.__unusual__ = []
+        self.__compile__()
+        self.__size__ = 3 + len(self.__windows__) * (3 + 2 * buckets)
+        self.__longest_window__ = max((bucket_seconds * buckets for bucket_seconds, *_ in self.__windows__), default=0)
+        self.__states__ = OrderedDict()
+        self.__summaries__ = OrderedDict()
+        self.__averages__ = OrderedDict()
+        self.__hits__ = {rule["name"]: 0 for rule in self.__rules__}
+        self.__lock__ = threading.Lock()
+
+    @staticmethod
+    def load(rules_file, **settings):
+        """Compiles the rules of a JSON file holding a list of rules.
+
+        :param rules_file: Name of the rules file
+        :param settings: Keyword arguments of the constructor
+        :return: An object ready to evaluate withdrawals
+        """
+        with open(rules_file) as source:
+            return FraudRules(json.load(source), **settings)
+
+    def evaluate(self, account_number, amount, now=None):
+        """Checks a withdrawal against the rules, without recording it.
+
+        The rules flagging the withdrawal and the first rule denying it are counted in 'get_hits'.
+
+        :param account_number: Account number of the account withdrawn from
+        :param amount: Amount to withdraw
+        :param now: Time of the withdrawal, the current time if not specified
+        :return: Name of a rule denying the withdrawal, None if it is allowed
+        """
+        if now is None:
+            now = time.time()
+        hits = self.__hits__
+        with self.__lock__:
+            state = self.__state__(account_number, now)
+            for bucket_seconds, base, amount_deny, count_deny, amount_flags, count_flags in self.__windows__:
+                count = total = 0
+                if state is not None:
+                    self.__advance__(state, base, int(now // bucket_seconds))
+                    count, total = state[base + 1], state[base + 2]
+                total += amount
+                count += 1
+                for (limits, names), value in (amount_flags, total), (count_flags, count):
+                    for name in names[:bisect.bisect_left(limits, value)]:  # the flagging limits below the value
+                        hits[name] += 1
+                if amount_deny is not None and total > amount_deny[0]:
+                    hits[amount_deny[1]] += 1
+                    return amount_deny[1]
+                if count_deny is not None and count > count_deny[0]:
+                    hits[count_deny[1]] += 1
+                    return count_deny[1]
+            if state is not None and self.__unusual__:
+                withdrawals, average = state[0], state[1]
+                for factor, min_history, name, action in self.__unusual__:
+                    if amount <= factor * average:
+                        break
+                    if withdrawals >= min_history:
+                        hits[name] += 1
+                        if action == self.DENY:
+                            return name
+        return None
+
+    def record(self, account_number, amount, now=None):
+        """Adds a withdrawal to the counters of its account.
+
+        :param account_number: Account number of the account withdrawn from
+        :param amount: Amount withdrawn
+        :param now: Time of the withdrawal, the current time if not specified
+        :return: None
+        """
+        if now is None:
+            now = time.time()
+        buckets = self.__buckets__
+        with self.__lock__:
+            state = self.__state__(account_number, now)
+            if state is None:
+                state = self.__states__[account_number] = array("d", bytes(8 * self.__size__))
+                self.__evict__(now)
+            else:
+                self.__states__.move_to_end(account_number)
+            for bucket_seconds, base, _, _, _, _ in self.__windows__:
+                epoch = int(now // bucket_seconds)
+                self.__advance__(state, base, epoch)
+                slot = epoch % buckets
+                state[base + 1] += 1
+                state[base + 2] += amount
+                state[base + 3 + slot] += 1
+                state[base + 3 + buckets + slot] += amount
+            state[0] += 1
+            state[1] += (amount - state[1]) * max(self.__smoothing__, 1.0 / state[0])
+            state[2] = max(state[2], now)
+
+    def get_hits(self):
+        """Get the number of withdrawals each rule denied or flagged.
+
+        :return: Dictionary of the counts keyed by rule name
+        """
+        with self.__lock__:
+            return dict(self.__hits__)
+
+    def get_rules(self):
+        """Get the dictionaries describing the rules."""
+        return [dict(rule) for rule in self.__rules__]
+
+    def __state__(self, account_number, now):
+        """Get the counters of an account, restoring them from its summary if it was evicted, None if it has none."""
+        state = self.__states__.get(account_number)
+        if state is not None:
+            return state
+        summary = self.__summaries__.pop(account_number, None)
+        if summary is None:
+            summary = self.__averages__.pop(account_number, None)
+            if summary is None:
+                return None
+        buckets = self.__buckets__
+        state = self.__states__[account_number] = array("d", bytes(8 * self.__size__))
+        state[0:3] = summary[:3]
+        for position, (bucket_seconds, base, _, _, _, _) in enumerate(self.__windows__):
+            if 3 + 2 * position >= len(summary):
+                break
+            count, total = summary[3 + 2 * position], summary[4 + 2 * position]
+            epoch = int(summary[2] // bucket_seconds)  # the latest bucket any of the withdrawals could be in
+            state[base] = epoch
+            state[base + 1] = state[base + 3 + epoch % buckets] = count
+            state[base + 2] = state[base + 3 + buckets + epoch % buckets] = total
+        self.__evict__(now)
+        return state
+
+    def __evict__(self, now):
+        """Summarizes the least recently active accounts beyond 'max_accounts' and drops the expired summaries."""
+        while len(self.__states__) > self.__max_accounts__:
+            account_number, state = self.__states__.popitem(last=False)
+            summary = state[:3]
+            for bucket_seconds, base, _, _, _, _ in self.__windows__:
+                self.__advance__(state, base, int(now // bucket_seconds))
+                summary.extend((state[base + 1], state[base + 2]))
+            self.__summaries__[account_number] = summary
+        while self.__summaries__:  # in the order the accounts were last active
+            account_number, summary = next(iter(self.__summaries__.items()))
+            if summary[2] + self.__longest_window__ > now:
+                break
+            del self.__summaries__[account_number]
+            if self.__unusual__:
+                self.__averages__[account_number] = summary[:3]
+                if len(self.__averages__) > self.__max_accounts__:
+                    self.__averages__.popitem(last=False)
+
+    def __advance__(self, state, base, epoch):
+        """Moves a window counter to the bucket of an epoch, expiring the buckets which left the window."""
+        last = int(state[base])
+        if epoch <= last:
+            return
+        buckets = self.__buckets__
+        if epoch - last >= buckets:
+            for position in range(base + 1, base + 3 + 2 * buckets):
+                state[position] = 0
+        else:
+            for expired in range(last + 1, epoch + 1):
+                slot = expired % buckets
+                state[base + 1] -= state[base + 3 + slot]
+                state[base + 2] -= state[base + 3 + buckets + slot]
+                state[base + 3 + slot] = 0
+                state[base + 3 + buckets + slot] = 0
+        state[base] = epoch
+
+    def __compile__(self):
+        """Groups the rules by window and orders the limits of every group."""
+        windows = OrderedDict()
+        names = set()
+        for rule in self.__rules__:
+            name, kind, action = rule.get("name"), rule.get("type"), rule.get("action", self.DENY)
+            if type(name) != str or name in names:
+                raise Exception("Invalid rule {}: every rule needs a distinct name".format(rule))
+            names.add(name)
+            if action != self.DENY and action != self.FLAG:
+                raise Exception("Invalid rule {}: unknown action {}".format(name, action))
+            if kind == self.UNUSUAL:
+                factor, min_history = rule.get("factor"), rule.get("min_history", 1)
+                if type(factor) not in (int, float) or factor <= 0 or type(min_history) != int:
+                    raise Exception("Invalid rule {}: factor should be a positive number".format(name))
+                self.__unusual__.append((factor, min_history, name, action))
+                continue
+            if kind != self.AMOUNT and kind != self.COUNT:
+                raise Exception("Invalid rule {}: unknown type {}".format(name, kind))
+            window, limit = rule.get("window"), rule.get("limit")
+            if type(window) not in (int, float) or window <= 0 or type(limit) not in (int, float):
+                raise Exception("Invalid rule {}: window should be a positive number and limit a number".format(name))
+            windows.setdefault(window, {self.AMOUNT: [], self.COUNT: []})[kind].append((limit, name, action))
+        for position, (window, groups) in enumerate(windows.items()):
+            compiled = [window / self.__buckets__, 3 + position * (3 + 2 * self.__buckets__)]
+            flags = []
+            for kind in (self.AMOUNT, self.COUNT):
+                limits = sorted(groups[kind])
+                denying = [(limit, name) for limit, name, action in limits if action == self.DENY]
+                compiled.append(denying[0] if denying else None)
+                flagging = [(limit, name) for limit, name, action in limits if action == self.FLAG]
+                flags.append(([limit for limit, _ in flagging], [name for _, name in flagging]))
+            self.__windows__.append(tuple(compiled + flags))
+        self.__unusual__.sort()
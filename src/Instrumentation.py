@@ -0,0 +1,326 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import functools
+import heapq
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ATM import ATM
+from AccountView import AccountView
+from BankAccount import BankAccount
+from DatabaseConnection import DatabaseConnection
+
+
+class Instrumentation:
+    """Opt-in latency, call and error metrics for the hot path operations.
+
+    Instrumenting replaces the methods listed in OPERATIONS with timing wrappers on their classes, and uninstrumenting
+    puts the original methods back, so while instrumentation is disabled the operations run exactly the original code
+    with no overhead at all.
+
+    An operation generating its results, such as 'DatabaseConnection.fetch_iter', is measured over the time spent
+    producing them, from the first result requested until the generator is exhausted or closed, excluding the time the
+    caller spends between two results.
+
+    For every operation the following metrics are recorded:
+    -> a histogram of the call latencies with the bucket boundaries of LATENCY_BUCKETS
+    -> the number of calls and the number of calls that raised an exception
+    -> the slowest calls, along with the SQL text for database operations
+
+    The metrics can be exported in the Prometheus text format, served over HTTP or dumped periodically as JSON.
+
+    Example of usage:
+    instrumentation = Instrumentation()
+    instrumentation.instrument()
+    instrumentation.serve_http(9100)
+    ...
+    print(instrumentation.prometheus_text())
+    instrumentation.uninstrument()
+    """
+
+    OPERATIONS = (
+        (ATM, "validate_pin"),
+        (ATM, "load_account"),
+        (BankAccount, "deposit"),
+        (BankAccount, "withdraw"),
+        (AccountView, "deposit"),
+        (AccountView, "withdraw"),
+        (DatabaseConnection, "sql_statement"),
+        (DatabaseConnection, "execute"),
+        (DatabaseConnection, "execute_many"),
+        (DatabaseConnection, "fetch_one"),
+        (DatabaseConnection, "fetch_value"),
+        (DatabaseConnection, "fetch_all"),
+        (DatabaseConnection, "fetch_iter"),
+    )
+
+    LATENCY_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                       0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    __active__ = None
+
+    def __init__(self, slow_calls=32, slow_call_hook=None, slow_call_threshold=0.01):
+        """Initializes the registry of metrics, nothing is measured until 'instrument' is called.
+
+        :param slow_calls: Number of slowest calls kept with their details
+        :param slow_call_hook: Callable invoked as hook(operation, seconds, sql) for every call slower than the
+                               threshold, the sql argument is None for operations that aren't database operations
+        :param slow_call_threshold: Seconds above which a call is passed to the slow call hook
+        :return: An initialized registry
+        """
+        self.__lock__ = threading.Lock()
+        self.__histograms__ = dict()
+        self.__calls__ = dict()
+        self.__errors__ = dict()
+        self.__sums__ = dict()
+        self.__slowest__ = []
+        self.__sequence__ = itertools.count()
+        self.__slow_calls__ = slow_calls
+        self.__slow_call_hook__ = slow_call_hook
+        self.__slow_call_threshold__ = slow_call_threshold
+        self.__originals__ = []
+        self.__threads__ = []
+        self.__stopped__ = threading.Event()
+        self.__http_server__ = None
+        self.__collectors__ = []
+
+    def instrument(self):
+        """Starts measuring the operations by wrapping their methods.
+
+        If another 'Instrumentation' is already measuring the operations an 'Exception' is raised.
+
+        :return: None
+        """
+        if Instrumentation.__active__ is not None:
+            raise Exception("The operations are already instrumented")
+        Instrumentation.__active__ = self
+        for owner, name in self.OPERATIONS:
+            original = owner.__dict__[name]
+            self.__originals__.append((owner, name, original))
+            setattr(owner, name, self.__wrap__(original, "{}.{}".format(owner.__name__, name),
+                                               owner is DatabaseConnection))
+
+    def uninstrument(self):
+        """Stops measuring the operations by restoring their original methods, the recorded metrics are kept."""
+        for owner, name, original in reversed(self.__originals__):
+            setattr(owner, name, original)
+        self.__originals__ = []
+        if Instrumentation.__active__ is self:
+            Instrumentation.__active__ = None
+
+    def snapshot(self):
+        """Get a copy of the recorded metrics.
+
+        :return: Dictionary keyed by operation with the calls, errors, error rate, total seconds and latency bucket
+                 counts of every operation, along with the slowest calls
+        """
+        with self.__lock__:
+            operations = dict()
+            for operation, counts in self.__histograms__.items():
+                calls = self.__calls__[operation]
+                operations[operation] = {
+                    "calls": calls,
+                    "errors": self.__errors__[operation],
+                    "error_rate": self.__errors__[operation] / calls if calls else 0.0,
+                    "seconds_total": self.__sums__[operation],
+                    "buckets": dict(zip([str(bound) for bound in self.LATENCY_BUCKETS] + ["+Inf"], counts)),
+                }
+            slowest = [{"operation": operation, "seconds": seconds, "sql": sql}
+                       for seconds, _, operation, sql in sorted(self.__slowest__, reverse=True)]
+        return {"operations": operations, "slowest_calls": slowest}
+
+    def add_collector(self, collector):
+        """Adds metrics of another component to the Prometheus text, such as 'AccountRefresher.prometheus_text'.
+
+        :param collector: Callable returning metrics in the Prometheus text exposition format
+        :return: None
+        """
+        self.__collectors__.append(collector)
+
+    def prometheus_text(self):
+        """Get the recorded metrics in the Prometheus text exposition format.
+
+        :return: Metrics as a 'str'
+        """
+        snapshot = self.snapshot()["operations"]
+        lines = ["# HELP atm_operation_duration_seconds Latency of the ATM operations.",
+                 "# TYPE atm_operation_duration_seconds histogram"]
+        for operation, metrics in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in metrics["buckets"].items():
+                cumulative += count
+                lines.append('atm_operation_duration_seconds_bucket{{operation="{}",le="{}"}} {}'.format(
+                    operation, bound, cumulative))
+            lines.append('atm_operation_duration_seconds_sum{{operation="{}"}} {}'.format(
+                operation, metrics["seconds_total"]))
+            lines.append('atm_operation_duration_seconds_count{{operation="{}"}} {}'.format(operation, metrics["calls"]))
+        lines.append("# HELP atm_operation_errors_total Calls of the ATM operations that raised an exception.")
+        lines.append("# TYPE atm_operation_errors_total counter")
+        for operation, metrics in sorted(snapshot.items()):
+            lines.append('atm_operation_errors_total{{operation="{}"}} {}'.format(operation, metrics["errors"]))
+        return "\n".join(lines) + "\n" + "".join(collector() for collector in self.__collectors__)
+
+    def serve_http(self, port, host="127.0.0.1"):
+        """Serves the metrics in the Prometheus text format at http://host:port/metrics from a background thread.
+
+        :param port: Port to listen on
+        :param host: Address to listen on
+        :return: None
+        """
+        instrumentation = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = instrumentation.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, message_format, *args):
+                pass
+
+        self.__http_server__ = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.__start_thread__(self.__http_server__.serve_forever)
+
+    def dump_json_periodically(self, json_file, interval=10.0):
+        """Writes the metrics as JSON to a file every 'interval' seconds from a background thread.
+
+        The file is replaced atomically so readers never see a partially written dump.
+
+        :param json_file: Name of the file to write the metrics to
+        :param interval: Seconds between two dumps
+        :return: None
+        """
+        def dump():
+            while not self.__stopped__.wait(interval):
+                self.dump_json(json_file)
+        self.__start_thread__(dump)
+
+    def dump_json(self, json_file):
+        """Writes the metrics as JSON to a file.
+
+        :param json_file: Name of the file to write the metrics to
+        :return: None
+        """
+        temporary_file = json_file + ".tmp"
+        with open(temporary_file, "w") as destination:
+            json.dump(self.snapshot(), destination, indent=2)
+        os.replace(temporary_file, json_file)
+
+    def close(self):
+        """Uninstruments the operations and stops the HTTP server and the periodic dumps."""
+        self.uninstrument()
+        self.__stopped__.set()
+        if self.__http_server__ is not None:
+            self.__http_server__.shutdown()
+            self.__http_server__.server_close()
+        for thread in self.__threads__:
+            thread.join()
+        self.__threads__ = []
+
+    def record(self, operation, seconds, failed=False, sql=None):
+        """Records a single call of an operation.
+
+        :param operation: Name of the operation
+        :param seconds: Duration of the call
+        :param failed: True if the call raised an exception
+        :param sql: SQL text executed by the call, if any
+        :return: None
+        """
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS, seconds)
+        with self.__lock__:
+            counts = self.__histograms__.get(operation)
+            if counts is None:
+                counts = self.__histograms__[operation] = [0] * (len(self.LATENCY_BUCKETS) + 1)
+                self.__calls__[operation] = 0
+                self.__errors__[operation] = 0
+                self.__sums__[operation] = 0.0
+            counts[bucket] += 1
+            self.__calls__[operation] += 1
+            self.__sums__[operation] += seconds
+            if failed:
+                self.__errors__[operation] += 1
+            if len(self.__slowest__) < self.__slow_calls__:
+                heapq.heappush(self.__slowest__, (seconds, next(self.__sequence__), operation, sql))
+            elif seconds > self.__slowest__[0][0]:
+                heapq.heapreplace(self.__slowest__, (seconds, next(self.__sequence__), operation, sql))
+        if self.__slow_call_hook__ is not None and seconds > self.__slow_call_threshold__:
+            self.__slow_call_hook__(operation, seconds, sql)
+
+    def __wrap__(self, method, operation, database):
+        """Get a timing wrapper of a method."""
+        record = self.record
+        clock = time.perf_counter
+        sql_position = 2 if method.__name__ == "sql_statement" else 1
+
+        def sql_of(args, kwargs):
+            if not database:
+                return None
+            return args[sql_position] if len(args) > sql_position else kwargs.get("sql")
+
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def timed_generator(*args, **kwargs):
+                seconds = 0.0
+                failed = False
+                results = method(*args, **kwargs)
+                try:
+                    while True:
+                        start = clock()
+                        try:
+                            result = next(results)
+                        except StopIteration:
+                            return
+                        finally:
+                            seconds += clock() - start
+                        yield result
+                except GeneratorExit:
+                    raise
+                except BaseException:
+                    failed = True
+                    raise
+                finally:
+                    results.close()
+                    record(operation, seconds, failed, sql_of(args, kwargs))
+            return timed_generator
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                result = method(*args, **kwargs)
+            except BaseException:
+                record(operation, clock() - start, True, sql_of(args, kwargs))
+                raise
+            record(operation, clock() - start, False, sql_of(args, kwargs))
+            return result
+        return timed
+
+    def __start_thread__(self, target):
+        """Runs a target in a daemon thread stopped by 'close'."""
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.__threads__.append(thread)
@@ -13,55 +13,36 @@
 # limitations under the License.
 
 from ATM import ATM
+from ATMSession import ATMSession
+from AccountPersistence import AccountPersistence
+from DatabaseScript import DatabaseScript
+from PinAuthenticator import PinAuthenticator
+from TransactionHistory import TransactionHistory
 
 # ----------------------------------------------------------
 # Initialize the ATM
-# ----------------------------------------------------------
-atm = ATM()
-
-account = None  # account for processing
-
-# ----------------------------------------------------------
-# Access point: get user pin
-# ----------------------------------------------------------
-pin = atm.get_input("Enter your pin and press [enter] to continue: ")
-
-# ----------------------------------------------------------
-# Validation: check pin
-# Give user three(3) tries to get it correct
-# ----------------------------------------------------------
-tries = 0
-while tries <= 2:
-    if atm.validate_pin(pin):
-        account = atm.load_account(pin)
-        break
-    else:
-        if tries == 2:
-            exit("Goodbye...")
-        tries += 1
-        print("That pin is invalid, you have {} more {}".format(3 - tries, "tries" if tries == 1 else "try"))
-        pin = atm.get_input("Enter your pin and press [enter] to continue: ")
-
-# ----------------------------------------------------------
-# Initialize transactions loop
-# ----------------------------------------------------------
-while True:
-    atm.menu()
-    option = int(atm.get_input("Enter option: "))
-
-    if option == 1:
-        account.withdraw(int(atm.get_input("Enter amount to withdraw: ")))
-    elif option == 2:
-        account.deposit(int(atm.get_input("Enter amount to deposit: ")))
-    elif option == 3:
-        print(account.get_account_details())
-    else:
-        print("Invalid option\n")
-
-    # ----------------------------------------------------------
-    # Check for continuation
-    # ----------------------------------------------------------
-    if atm.get_input("Would you like to perform another transaction (Y/n): ").lower() == "y":
-        continue
-    else:
-        break
+# Balance changes are written through to the database,
+# transactions are recorded for the mini statements and
+# cards are authenticated against salted pin hashes
+# ----------------------------------------------------------
+DatabaseScript.load_database("accounts.db")
+authenticator = PinAuthenticator("accounts.db")
+authenticator.enroll()  # the plaintext pins left, such as those of a database created before the cards, are hashed
+atm = ATM(history=TransactionHistory("accounts.db"), authenticator=authenticator)
+atm.add_listener(AccountPersistence("accounts.db"))
+
+# ----------------------------------------------------------
+# Run the session
+# The session decides what to show and what to ask, the
+# console only prints its lines and reads the answers
+# ----------------------------------------------------------
+session = ATMSession(atm)
+lines = session.start()
+while not session.is_finished():
+    for line in lines[:-1]:
+        print(line)
+    lines = session.feed(atm.get_input(lines[-1]))
+for line in lines:
+    print(line)
+
+atm.close()
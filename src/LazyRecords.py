@@ -0,0 +1,189 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import weakref
+from collections import OrderedDict
+
+from DatabaseConnection import DatabaseConnection
+from DatabaseScript import DatabaseScript
+from BankAccount import BankAccount
+
+
+class LazyRecords:
+    """Pin keyed view of the bank account records that are fetched from the database on demand.
+
+    Instead of materializing the whole accounts table, a record is read with an indexed point query the first time its
+    pin is looked up and kept in a bounded least-recently-used cache of 'BankAccount' objects.
+
+    The object supports the subset of the dictionary protocol used by the ATM:
+    -> pin in records
+    -> records[pin]
+    -> records.get(pin)
+    -> len(records)
+
+    An account evicted from the cache while a session still holds it is returned again as long as it is referenced,
+    every caller always shares the same object of an account so its lock guards its only balance. Accounts evicted and
+    no longer referenced are re-read from the database the next time they are needed, so balance changes made
+    in-memory only survive eviction when they are also written back to the database.
+
+    Lookups use a private connection serialized by a lock, or read connections of a 'ConnectionPool' if one is
+    supplied so that lookups from several threads run concurrently.
+
+    Example of usage:
+    records = LazyRecords("accounts.db", 1024)
+    if "2050" in records:
+        account = records.get("2050")
+    records.close()
+    """
+
+    DEFAULT_CACHE_SIZE = 4096
+
+    def __init__(self, database_file, cache_size=DEFAULT_CACHE_SIZE, pool=None):
+        """Initializes the object with a connection to the specified database and an empty cache.
+
+        Checks that the argument 'cache_size' passed in is a positive 'int' else an 'Exception' is raised.
+
+        The schema of the database is migrated to the latest version if needed, which provides the unique index on the
+        pin column that lookups rely on to avoid scanning the accounts table.
+
+        :param database_file: Name of the database file to load records from
+        :param cache_size: Maximum number of 'BankAccount' objects kept in memory
+        :param pool: 'ConnectionPool' to read the records with instead of a private connection
+        :return: An initialized object ready to serve lookups by pin
+        """
+        if type(cache_size) != int or cache_size <= 0:
+            raise Exception("Invalid argument: cache_size should be a positive <class 'int'> found {}".format(
+                cache_size))
+        self.__database__ = DatabaseConnection(database_file, check_same_thread=False) if pool is None else None
+        DatabaseScript.migrate_database(database_file)
+        self.__pool__ = pool
+        self.__cache__ = OrderedDict()
+        self.__cache_size__ = cache_size
+        self.__live__ = weakref.WeakValueDictionary()
+        self.__lock__ = threading.Lock()
+
+    def __contains__(self, pin):
+        return self.get(pin) is not None
+
+    def __getitem__(self, pin):
+        account = self.get(pin)
+        if account is None:
+            raise KeyError(pin)
+        return account
+
+    def __len__(self):
+        return self.__query__(lambda database: database.fetch_value("SELECT COUNT(*) FROM accounts"))
+
+    def get(self, pin, default=None):
+        """Get the bank account record associated with the pin.
+
+        Cached records are returned directly and marked as most recently used, as are records evicted from the cache
+        that are still referenced elsewhere, otherwise the record is fetched from the database and added to the cache,
+        evicting the least recently used record when the cache is full.
+
+        :param pin: Pin to locate the associated bank account record
+        :param default: Value returned if no record is associated with the pin
+        :return: Bank account record associated with the pin else the default value
+        """
+        with self.__lock__:
+            account = self.__cached__(pin)
+            if account is not None:
+                return account
+        account = self.__query__(lambda database: database.fetch_one(
+            "SELECT account_number, first_name, last_name, balance FROM accounts WHERE {} = ?".format(
+                DatabaseScript.RECORD_KEY), (pin,), BankAccount))
+        if account is None:
+            return default
+        with self.__lock__:
+            cached = self.__cached__(pin)
+            if cached is not None:  # loaded by another thread meanwhile, every caller must share the same object
+                return cached
+            self.__live__[pin] = account
+            self.__insert__(pin, account)
+            return account
+
+    def cached(self, pin):
+        """Get the bank account record associated with the pin if it is in memory, without reading the database.
+
+        :param pin: Pin to locate the associated bank account record
+        :return: Bank account record associated with the pin in memory else None
+        """
+        with self.__lock__:
+            account = self.__cache__.get(pin)
+            return account if account is not None else self.__live__.get(pin)
+
+    def cached_pins(self):
+        """Get the pins of the bank account records in memory.
+
+        :return: List of pins
+        """
+        with self.__lock__:
+            return list(set(self.__cache__).union(self.__live__.keys()))
+
+    def pop(self, pin, default=None):
+        """Drops the bank account record associated with the pin from memory, it is read from the database again the
+        next time it is needed.
+
+        :param pin: Pin to locate the associated bank account record
+        :param default: Value returned if the record isn't in memory
+        :return: Bank account record associated with the pin in memory else the default value
+        """
+        with self.__lock__:
+            live = self.__live__.pop(pin, None)
+            return self.__cache__.pop(pin, default if live is None else live)
+
+    def find_pin(self, account_number):
+        """Get the pin associated with an account number.
+
+        :param account_number: Account number to locate the associated bank account record
+        :return: Pin of the record else None if no record is associated with the account number
+        """
+        return self.__query__(lambda database: database.fetch_value(
+            "SELECT {} FROM accounts WHERE account_number = ?".format(DatabaseScript.RECORD_KEY), (account_number,)))
+
+    def close(self):
+        """Closes the private connection to the database and discards the cached records."""
+        with self.__lock__:
+            self.__cache__.clear()
+            self.__live__.clear()
+            if self.__database__ is not None:
+                self.__database__.close()
+
+    def __cached__(self, pin):
+        """Get the record of a pin from the cache or from the records still referenced, marking it as most recently
+        used, the caller must hold the lock."""
+        account = self.__cache__.get(pin)
+        if account is not None:
+            self.__cache__.move_to_end(pin)
+            return account
+        account = self.__live__.get(pin)
+        if account is not None:
+            self.__insert__(pin, account)
+        return account
+
+    def __insert__(self, pin, account):
+        """Adds a record to the cache, evicting the least recently used record when it is full, the caller must hold
+        the lock."""
+        self.__cache__[pin] = account
+        if len(self.__cache__) > self.__cache_size__:
+            self.__cache__.popitem(last=False)
+
+    def __query__(self, query):
+        """Runs a query on a pooled read connection or on the private connection."""
+        if self.__pool__ is not None:
+            with self.__pool__.reader() as database:
+                return query(database)
+        with self.__lock__:
+            return query(self.__database__)
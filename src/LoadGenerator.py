@@ -0,0 +1,169 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import asyncio
+import random
+import time
+
+
+class LoadGenerator:
+    """Opens many concurrent sessions against an 'ATMServer' and measures their throughput and latency.
+
+    Every session enters a pin, preceded by the card number of the pin if the server authenticates cards, alternates
+    withdrawals and deposits of the amount actually withdrawn, and then ends the session. A declined withdrawal is
+    followed by a balance inquiry instead of a deposit, so the balances of the accounts are left unchanged when the
+    sessions perform an even number of transactions.
+
+    Example of usage:
+    generator = LoadGenerator(["2050", "9014"], sessions=1000, concurrency=100)
+    report = asyncio.run(generator.run(host="127.0.0.1", port=8888))
+    """
+
+    def __init__(self, pins, sessions=1000, concurrency=100, transactions=4, seed=0, cards=None):
+        """Initializes the generator.
+
+        :param pins: Pins used by the sessions, chosen at random for each session
+        :param sessions: Total number of sessions to run
+        :param concurrency: Maximum number of sessions connected at the same time
+        :param transactions: Number of transactions performed by each session
+        :param seed: Seed of the random choices so runs are reproducible
+        :param cards: Card numbers of the pins, in the same order, if the server authenticates cards
+        :return: An initialized generator, call 'run' to generate the load
+        """
+        self.__pins__ = list(pins)
+        self.__cards__ = None if cards is None else list(cards)
+        if self.__cards__ is not None and len(self.__cards__) != len(self.__pins__):
+            raise Exception("Invalid argument: cards should have a card number for each of the {} pins".format(
+                len(self.__pins__)))
+        self.__sessions__ = sessions
+        self.__concurrency__ = concurrency
+        self.__transactions__ = transactions
+        self.__random__ = random.Random(seed)
+        self.__latencies__ = []
+        self.__failures__ = 0
+
+    async def run(self, host=None, port=None, path=None):
+        """Runs all the sessions and reports the results.
+
+        :param host: Address of the TCP socket of the server
+        :param port: Port of the TCP socket of the server
+        :param path: Path of the Unix socket of the server, used instead of TCP if specified
+        :return: Dictionary with the measured results
+        """
+        semaphore = asyncio.Semaphore(self.__concurrency__)
+        start = time.perf_counter()
+        await asyncio.gather(*(self.__session__(semaphore, host, port, path) for _ in range(self.__sessions__)))
+        elapsed = time.perf_counter() - start
+        latencies = sorted(self.__latencies__)
+        completed = self.__sessions__ - self.__failures__
+        return {
+            "sessions": completed,
+            "failures": self.__failures__,
+            "seconds": elapsed,
+            "sessions_per_second": completed / elapsed,
+            "transactions_per_second": completed * self.__transactions__ / elapsed,
+            "latency_p50_ms": self.__percentile__(latencies, 0.50) * 1000,
+            "latency_p99_ms": self.__percentile__(latencies, 0.99) * 1000,
+        }
+
+    async def __session__(self, semaphore, host, port, path):
+        """Runs a single session against the server."""
+        answers = self.__script__()
+        answer = next(answers)
+        async with semaphore:
+            try:
+                if path is not None:
+                    reader, writer = await asyncio.open_unix_connection(path)
+                else:
+                    reader, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                self.__failures__ += 1
+                return
+            try:
+                sent = None
+                received = []
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    if not line.endswith(b": \n"):
+                        received.append(line)
+                        continue
+                    if sent is not None:
+                        self.__latencies__.append(time.perf_counter() - sent)
+                        answer = answers.send(received)
+                        received = []
+                    writer.write(answer.encode() + b"\n")
+                    sent = time.perf_counter()
+                    await writer.drain()
+            except (ConnectionError, StopIteration):
+                self.__failures__ += 1
+            finally:
+                writer.close()
+
+    def __script__(self):
+        """Generates the answers of a session to the prompts of the server in order, after the first answer it is sent
+        the lines received before each prompt."""
+        choice = self.__random__.randrange(len(self.__pins__))
+        if self.__cards__ is not None:
+            yield self.__cards__[choice]
+        yield self.__pins__[choice]
+        amount = self.__random__.randint(1, 20)
+        withdrawn = 0
+        for transaction in range(self.__transactions__):
+            if transaction % 2 == 0:
+                yield "1"
+                lines = yield str(amount)
+                withdrawn = 0 if any(line.startswith(b"Withdrawal declined") for line in lines) else amount
+            elif withdrawn:
+                yield "2"
+                yield str(withdrawn)
+            else:
+                yield "3"
+            yield "y" if transaction < self.__transactions__ - 1 else "n"
+
+    @staticmethod
+    def __percentile__(values, fraction):
+        """Get the value at the specified fraction of the sorted values."""
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate concurrent session load against an ATM server.")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address of the server")
+    parser.add_argument("--port", type=int, default=8888, help="TCP port of the server")
+    parser.add_argument("--unix", default=None, help="Unix socket path of the server instead of TCP")
+    parser.add_argument("--pins", default="2050,9014,5572,9393,8226,1022,9584", help="comma separated pins to use")
+    parser.add_argument("--cards", default=None,
+                        help="comma separated card numbers of the pins, if the server authenticates cards, "
+                             "e.g. 10001,10002,10003,10004,10005,10006,10007")
+    parser.add_argument("--sessions", type=int, default=1000, help="total number of sessions")
+    parser.add_argument("--concurrency", type=int, default=100, help="sessions connected at the same time")
+    parser.add_argument("--transactions", type=int, default=4, help="transactions per session")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random choices")
+    arguments = parser.parse_args()
+
+    generator = LoadGenerator(arguments.pins.split(","), arguments.sessions, arguments.concurrency,
+                              arguments.transactions, arguments.seed,
+                              None if arguments.cards is None else arguments.cards.split(","))
+    report = asyncio.run(generator.run(arguments.host, arguments.port, arguments.unix))
+    for key, value in report.items():
+        print("{}: {}".format(key, round(value, 3) if type(value) == float else value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from DatabaseConnection import DatabaseConnection
+from DatabaseScript import DatabaseScript
+
+
+class PinAuthenticator:
+    """Verifies card number and pin pairs against salted pin hashes, with lockout after repeated failures.
+
+    The pins are stored in the 'credentials' table as PBKDF2 hashes with a random salt per account, keyed by the
+    account number printed on the card, so a pin is verified with a point lookup of the card number and no table ever
+    maps a pin to an account.
+
+    Hashing is deliberately slow, so the results of recent successful verifications are kept in a bounded cache as an
+    HMAC of the pin under a key that only lives in the memory of the process, repeated logins of the same card within
+    'cache_seconds' are then verified without hashing. The expiry bounds how long a pin changed by another process is
+    still accepted.
+
+    Failed attempts are counted in the 'login_attempts' table of the database, so they are shared by all the sessions
+    and processes using the database. After 'max_attempts' consecutive failures the card is locked for
+    'lockout_seconds', a successful verification resets the count. Attempts with unknown card numbers are counted
+    too, so guessing card numbers is throttled the same way as guessing pins.
+
+    Class constants are provided for the results of an authentication:
+    GRANTED -> the pin matches the card
+    DENIED  -> the pin doesn't match the card or there is no such card
+    LOCKED  -> the card is locked after too many failures, the pin isn't checked
+
+    The pins are enrolled once, by running this module on the database, which hashes the pins of the accounts table
+    and clears them so no plaintext pin is left.
+
+    Example of usage:
+    python PinAuthenticator.py accounts.db
+    authenticator = PinAuthenticator("accounts.db")
+    if authenticator.authenticate("10001", "2050") == PinAuthenticator.GRANTED:
+        ...
+    authenticator.close()
+    """
+
+    GRANTED = 0
+    DENIED = 1
+    LOCKED = 2
+
+    DEFAULT_ITERATIONS = 100000
+
+    def __init__(self, database_file, max_attempts=3, lockout_seconds=900.0, cache_size=65536, cache_seconds=300.0,
+                 iterations=DEFAULT_ITERATIONS, pool=None):
+        """Initializes the object with a connection to the specified database.
+
+        :param database_file: Name of the database file holding the credentials
+        :param max_attempts: Number of consecutive failures after which a card is locked
+        :param lockout_seconds: Number of seconds a card stays locked
+        :param cache_size: Maximum number of recent successful verifications kept in memory
+        :param cache_seconds: Number of seconds a successful verification is kept in memory
+        :param iterations: Number of PBKDF2 iterations of the hashes created by 'enroll'
+        :param pool: 'ConnectionPool' to read and write the credentials with instead of a private connection
+        :return: An initialized object ready to authenticate cards
+        """
+        self.__database__ = None
+        if pool is None:
+            self.__database__ = DatabaseConnection(database_file, check_same_thread=False)
+            self.__database__.set_journal_mode("WAL", "NORMAL")
+        DatabaseScript.migrate_database(database_file)
+        self.__pool__ = pool
+        self.__max_attempts__ = max_attempts
+        self.__lockout_seconds__ = lockout_seconds
+        self.__cache_size__ = cache_size
+        self.__cache_seconds__ = cache_seconds
+        self.__iterations__ = iterations
+        self.__cache__ = OrderedDict()
+        self.__cache_key__ = os.urandom(32)
+        self.__dummy_salt__ = os.urandom(16)
+        self.__lock__ = threading.Lock()
+        self.__database_lock__ = threading.Lock()
+
+    def enroll(self, batch_size=1000):
+        """Replaces the plaintext pins of the accounts table with pin hashes.
+
+        The hash of every pin left in the accounts table is created, replacing the hash of a pin changed since, and the
+        pin is cleared in the same transaction, the account is then keyed by 'DatabaseScript.CARD_KEY_PREFIX' and its
+        account number. Enrollment is a one-off step run once the accounts are created, see 'main'.
+
+        :param batch_size: Number of accounts enrolled per transaction
+        :return: Number of accounts enrolled
+        """
+        enrolled = 0
+        while True:
+            rows = self.__read__(lambda database: database.fetch_all(
+                "SELECT account_number, pin FROM accounts WHERE pin IS NOT NULL LIMIT ?", (batch_size,)))
+            if not rows:
+                return enrolled
+            credentials = []
+            for account_number, pin in rows:
+                salt = os.urandom(16)
+                credentials.append((account_number, salt, self.__pin_hash__(pin, salt, self.__iterations__),
+                                    self.__iterations__))
+
+            def store(database):
+                database.execute_many(
+                    "INSERT OR REPLACE INTO credentials (account_number, salt, pin_hash, iterations) "
+                    "VALUES (?, ?, ?, ?)", credentials)
+                database.execute_many("UPDATE accounts SET pin = NULL WHERE account_number = ? AND pin = ?", rows)
+            self.__write__(store)
+            enrolled += len(rows)
+
+    def set_pin(self, account_number, pin):
+        """Changes the pin of a card.
+
+        :param account_number: Account number of the card
+        :param pin: New pin
+        :return: None
+        """
+        salt = os.urandom(16)
+        self.__write__(lambda database: database.execute(
+            "INSERT OR REPLACE INTO credentials (account_number, salt, pin_hash, iterations) VALUES (?, ?, ?, ?)",
+            (account_number, salt, self.__pin_hash__(pin, salt, self.__iterations__), self.__iterations__)))
+        with self.__lock__:
+            self.__cache__.pop(account_number, None)
+
+    def authenticate(self, account_number, pin):
+        """Verifies the pin of a card.
+
+        An attempt that isn't verified by the cache is counted as a failure before the pin is hashed, in a single
+        transaction that also checks the lock, so concurrent sessions can't make more than 'max_attempts' guesses
+        between them. The count is reset once the pin matches, and the lock is checked again before access is granted
+        so a correct pin still being hashed when the card is locked is refused.
+
+        :param account_number: Account number of the card
+        :param pin: Pin entered for the card
+        :return: One of the GRANTED, DENIED or LOCKED class constants
+        """
+        digest = hmac.new(self.__cache_key__, pin.encode(), hashlib.sha256).digest()
+        with self.__lock__:
+            cached, expiry = self.__cache__.get(account_number, (None, 0.0))
+            if cached is not None:
+                self.__cache__.move_to_end(account_number)
+        if cached is not None and expiry >= time.time() and hmac.compare_digest(cached, digest):
+            return self.__granted__(account_number)
+        if not self.__write__(lambda database: self.__reserve__(database, account_number)):
+            return self.LOCKED
+        credentials = self.__read__(lambda database: database.fetch_one(
+            "SELECT salt, pin_hash, iterations FROM credentials WHERE account_number = ?", (account_number,)))
+        if credentials is None:  # hash anyway so unknown cards take as long as wrong pins
+            self.__pin_hash__(pin, self.__dummy_salt__, self.__iterations__)
+            return self.__failed__(account_number)
+        salt, pin_hash, iterations = credentials
+        if not hmac.compare_digest(self.__pin_hash__(pin, salt, iterations), pin_hash):
+            return self.__failed__(account_number)
+        with self.__lock__:
+            self.__cache__[account_number] = (digest, time.time() + self.__cache_seconds__)
+            if len(self.__cache__) > self.__cache_size__:
+                self.__cache__.popitem(last=False)
+        return self.__granted__(account_number)
+
+    def remaining_attempts(self, account_number):
+        """Get the number of failed attempts a card may still make before it is locked.
+
+        :param account_number: Account number of the card
+        :return: Number of attempts, zero(0) if the card is locked
+        """
+        failures, locked_until = self.__attempts__(account_number)
+        if locked_until > time.time():
+            return 0
+        return max(0, self.__max_attempts__ - failures)
+
+    def close(self):
+        """Closes the private connection to the database and discards the cached verifications."""
+        with self.__lock__:
+            self.__cache__.clear()
+        with self.__database_lock__:
+            if self.__database__ is not None:
+                self.__database__.close()
+
+    def __attempts__(self, account_number):
+        """Get the (failures, locked_until) of a card."""
+        return self.__read__(lambda database: database.fetch_one(
+            "SELECT failures, locked_until FROM login_attempts WHERE account_number = ?", (account_number,))) or (0, 0.0)
+
+    def __reserve__(self, database, account_number):
+        """Counts an attempt of a card as a failure unless it is locked, the caller must be in a transaction.
+
+        A card whose attempts are all taken by attempts still in progress, or by attempts of a process that died before
+        completing them, is locked. Returns True if the attempt may proceed."""
+        failures, locked_until = database.fetch_one(
+            "SELECT failures, locked_until FROM login_attempts WHERE account_number = ?", (account_number,)) or (0, 0.0)
+        now = time.time()
+        if locked_until > now:
+            return False
+        if failures >= self.__max_attempts__:
+            database.execute("UPDATE login_attempts SET failures = 0, locked_until = ? WHERE account_number = ?",
+                             (now + self.__lockout_seconds__, account_number))
+            return False
+        database.execute(
+            "INSERT INTO login_attempts (account_number, failures, locked_until) VALUES (?, 1, 0) "
+            "ON CONFLICT (account_number) DO UPDATE SET failures = failures + 1", (account_number,))
+        return True
+
+    def __failed__(self, account_number):
+        """Locks a card whose failed attempts reached the maximum number of attempts, the failure is already counted."""
+        def check(database):
+            failures = database.fetch_value("SELECT failures FROM login_attempts WHERE account_number = ?",
+                                            (account_number,), default=0)
+            if failures < self.__max_attempts__:
+                return self.DENIED
+            database.execute("UPDATE login_attempts SET failures = 0, locked_until = ? WHERE account_number = ?",
+                             (time.time() + self.__lockout_seconds__, account_number))
+            return self.LOCKED
+        with self.__lock__:
+            self.__cache__.pop(account_number, None)
+        return self.__write__(check)
+
+    def __granted__(self, account_number):
+        """Resets the failed attempts of a card whose pin matched, unless the card was locked meanwhile."""
+        def reset(database):
+            if database.fetch_value("SELECT locked_until FROM login_attempts WHERE account_number = ?",
+                                    (account_number,), default=0.0) > time.time():
+                return self.LOCKED
+            database.execute("DELETE FROM login_attempts WHERE account_number = ?", (account_number,))
+            return self.GRANTED
+        failures, locked_until = self.__attempts__(account_number)
+        if not failures and not locked_until:
+            return self.GRANTED
+        return self.__write__(reset)
+
+    def __read__(self, query):
+        """Runs a query on a pooled read connection or on the private connection."""
+        if self.__pool__ is not None:
+            with self.__pool__.reader() as database:
+                return query(database)
+        with self.__database_lock__:
+            return query(self.__database__)
+
+    def __write__(self, statements):
+        """Runs statements in a single transaction on a pooled write connection or on the private connection."""
+        if self.__pool__ is not None:
+            with self.__pool__.writer() as database:
+                with database.transaction():
+                    return statements(database)
+        with self.__database_lock__:
+            with self.__database__.transaction():
+                return statements(self.__database__)
+
+    @staticmethod
+    def __pin_hash__(pin, salt, iterations):
+        """Get the PBKDF2 hash of a pin."""
+        return hashlib.pbkdf2_hmac("sha256", pin.encode(), salt, iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replace the plaintext pins of the accounts with salted pin hashes.")
+    parser.add_argument("database_file", help="database file with the bank account records")
+    parser.add_argument("--iterations", type=int, default=PinAuthenticator.DEFAULT_ITERATIONS,
+                        help="PBKDF2 iterations of the pin hashes")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    authenticator = PinAuthenticator(arguments.database_file, iterations=arguments.iterations)
+    try:
+        enrolled = authenticator.enroll()
+    finally:
+        authenticator.close()
+    print("Enrolled {} accounts of {} in {:.2f}s".format(enrolled, arguments.database_file, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
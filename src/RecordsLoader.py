@@ -12,12 +12,53 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
+from AccountStore import AccountStore
 from DatabaseConnection import DatabaseConnection
+from DatabaseScript import DatabaseScript
 from BankAccount import BankAccount
+from LazyRecords import LazyRecords
+from RecordsSnapshot import RecordsSnapshot
 
 
 class RecordsLoader:
-    """Loads bank account records from local database file"""
+    """Loads bank account records from local database file
+
+    Class constants are provided to select how the records are held in memory:
+    EAGER   -> every record is loaded up front into a dictionary
+    LAZY    -> records are fetched by pin on demand and kept in a bounded cache
+    COMPACT -> every record is loaded up front into a column oriented 'AccountStore'
+    SNAPSHOT -> as COMPACT, but the store is read from a binary snapshot of the database when it hasn't changed
+    """
+
+    EAGER = 0
+    LAZY = 1
+    COMPACT = 2
+    SNAPSHOT = 3
+
+    @staticmethod
+    def load(database_file, loading_mode=EAGER, cache_size=LazyRecords.DEFAULT_CACHE_SIZE, pool=None):
+        """Loads the bank account records using the specified loading mode.
+
+        Checks that the argument 'loading_mode' passed in is valid else an 'Exception' is raised.
+
+        :param database_file: Name of the database file to load records from
+        :param loading_mode: One of the loading mode class constants
+        :param cache_size: Maximum number of cached records when loading lazily
+        :param pool: 'ConnectionPool' used by lazily loaded records instead of a private connection
+        :return: Pin keyed collection of the bank account records
+        """
+        if loading_mode == RecordsLoader.EAGER:
+            return RecordsLoader.load_records(database_file)
+        elif loading_mode == RecordsLoader.LAZY:
+            return RecordsLoader.load_records_lazy(database_file, cache_size, pool)
+        elif loading_mode == RecordsLoader.COMPACT:
+            return RecordsLoader.load_records_compact(database_file)
+        elif loading_mode == RecordsLoader.SNAPSHOT:
+            return RecordsLoader.load_records_snapshot(database_file)
+        else:
+            raise Exception("Invalid records loading mode")
 
     @staticmethod
     def load_records(database_file):
@@ -37,8 +78,86 @@ class RecordsLoader:
                 "Invalid argument: database_file of type {} should be: <class 'str'>".format(type(database_file)))
         database = DatabaseConnection(database_file)
         records = dict()
-        result_set = database.sql_statement(database.READ, "SELECT * FROM accounts")
+        result_set = database.sql_statement(
+            database.READ, "SELECT account_number, first_name, last_name, balance, {} FROM accounts".format(
+                DatabaseScript.RECORD_KEY))
         for record in result_set:  # grab each record from the result-set
             records[record[4]] = BankAccount(record[0], record[1], record[2], record[3])
         database.close()
         return records
+
+    @staticmethod
+    def load_records_lazy(database_file, cache_size=LazyRecords.DEFAULT_CACHE_SIZE, pool=None):
+        """\
+        Opens the specified local database file with the bank account records without loading them, records are read
+        by pin the first time they are requested and kept in a bounded least-recently-used cache.
+
+        Checks that the argument 'database_file' passed in is of type 'str' else an 'Exception' is raised.
+
+        If the specified database file doesn't exist an 'Exception' is raised.
+
+        :param database_file: Name of the database file to load records from
+        :param cache_size: Maximum number of records kept in memory
+        :param pool: 'ConnectionPool' to read the records with instead of a private connection
+        :return: Dictionary like object with the bank account records
+        """
+        if type(database_file) != str:
+            raise Exception(
+                "Invalid argument: database_file of type {} should be: <class 'str'>".format(type(database_file)))
+        return LazyRecords(database_file, cache_size, pool)
+
+    @staticmethod
+    def load_records_compact(database_file, fetch_size=10000):
+        """\
+        Opens the specified local database file with the bank account records and store the records in-memory in a
+        column oriented 'AccountStore' which takes a fraction of the memory of a dictionary of 'BankAccount' objects.
+
+        Checks that the argument 'database_file' passed in is of type 'str' else an 'Exception' is raised.
+
+        If the specified database file doesn't exist an 'Exception' is raised.
+
+        :param database_file: Name of the database file to load records from
+        :param fetch_size: Number of records read from the result-set at a time
+        :return: Dictionary like object with the bank account records
+        """
+        if type(database_file) != str:
+            raise Exception(
+                "Invalid argument: database_file of type {} should be: <class 'str'>".format(type(database_file)))
+        database = DatabaseConnection(database_file)
+        records = AccountStore(database.fetch_value("SELECT COUNT(*) FROM accounts"))
+        for record in database.fetch_iter("SELECT {}, account_number, first_name, last_name, balance FROM accounts"
+                                          .format(DatabaseScript.RECORD_KEY), fetch_size=fetch_size):
+            records.append(record[0], record[1], record[2], record[3], record[4])
+        database.close()
+        return records
+
+    @staticmethod
+    def load_records_snapshot(database_file, snapshot_file=None):
+        """\
+        Loads the bank account records into a column oriented 'AccountStore' from a binary snapshot of the specified
+        local database file, which is memory-mapped and copied into the store without decoding the records.
+
+        If there is no snapshot or the database has changed since the snapshot was written, the records are loaded
+        from the database as with 'load_records_compact' and a new snapshot is written for the next start.
+
+        Checks that the argument 'database_file' passed in is of type 'str' else an 'Exception' is raised.
+
+        If the specified database file doesn't exist an 'Exception' is raised.
+
+        :param database_file: Name of the database file to load records from
+        :param snapshot_file: Name of the snapshot file, the database file name followed by '.index' if not specified
+        :return: Dictionary like object with the bank account records
+        """
+        if type(database_file) != str:
+            raise Exception(
+                "Invalid argument: database_file of type {} should be: <class 'str'>".format(type(database_file)))
+        if not os.path.exists(database_file):
+            raise Exception("The specified database {} could not be loaded: no such file".format(database_file))
+        if snapshot_file is None:
+            snapshot_file = database_file + ".index"
+        data_version = RecordsSnapshot.data_version(database_file)
+        records = RecordsSnapshot.read(snapshot_file, data_version)
+        if records is None:
+            records = RecordsLoader.load_records_compact(database_file)
+            RecordsSnapshot.write(snapshot_file, records, data_version)
+        return records
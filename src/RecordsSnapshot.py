@@ -0,0 +1,137 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import os
+import struct
+import time
+from array import array
+
+from AccountStore import AccountStore
+
+
+class RecordsSnapshot:
+    """Binary startup snapshot of the records of an 'AccountStore', tied to the state of the database they came from.
+
+    The snapshot file holds a header followed by the buffers of the store exactly as they are laid out in memory:
+    -> header: magic, format version, byte order and item sizes of the platform, data version of the database and the
+       lengths of the buffers
+    -> the balances, string offsets, string bytes and pin index buffers
+
+    Reading memory-maps the file and copies every buffer into its array in a single block, so the records are loaded in
+    the time it takes to copy the file instead of decoding every row of the database, and the pin index isn't rebuilt.
+
+    The data version identifies the state of the database file by the inode, size and modification time of the file
+    and of its write-ahead log. A snapshot is only read back for the data version it was written with, any change to
+    the database invalidates it. A database modified within the last RACY_SECONDS has no data version, since a change
+    made within the same tick of a coarse file system clock wouldn't change the modification time.
+
+    Example of usage:
+    data_version = RecordsSnapshot.data_version("accounts.db")
+    store = RecordsSnapshot.read("accounts.db.index", data_version)
+    if store is None:
+        store = RecordsLoader.load_records_compact("accounts.db")
+        RecordsSnapshot.write("accounts.db.index", store, data_version)
+    """
+
+    MAGIC = b"ATMINDX1"
+    VERSION = 1
+    BYTE_ORDER = 0x01020304
+    HEADER = struct.Struct("=8sIIII5q3Q")
+    RACY_SECONDS = 2.0
+
+    @staticmethod
+    def data_version(database_file):
+        """Get the data version of a database file.
+
+        :param database_file: Name of the database file
+        :return: Tuple identifying the state of the database, None if it was modified too recently to be identified
+        """
+        status = os.stat(database_file)
+        log_size, log_modified = 0, 0
+        if os.path.exists(database_file + "-wal"):
+            log = os.stat(database_file + "-wal")
+            if log.st_size:  # an empty log is recreated by every connection and holds no changes
+                log_size, log_modified = log.st_size, log.st_mtime_ns
+        if time.time_ns() - max(status.st_mtime_ns, log_modified) < RecordsSnapshot.RACY_SECONDS * 1e9:
+            return None
+        return status.st_ino, status.st_size, status.st_mtime_ns, log_size, log_modified
+
+    @staticmethod
+    def read(snapshot_file, data_version):
+        """Loads the records of a snapshot file.
+
+        :param snapshot_file: Name of the snapshot file
+        :param data_version: Data version of the database the records must come from
+        :return: 'AccountStore' with the records, None if there is no valid snapshot for the data version
+        """
+        if data_version is None or not os.path.exists(snapshot_file):
+            return None
+        header = RecordsSnapshot.HEADER
+        with open(snapshot_file, "rb") as source:
+            size = os.fstat(source.fileno()).st_size
+            if size < header.size:
+                return None
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                fields = header.unpack_from(mapping)
+                if fields[:5] != RecordsSnapshot.__layout__() or fields[5:10] != tuple(data_version):
+                    return None
+                rows, strings_length, index_length = fields[10:]
+                lengths = (rows * 8, rows * AccountStore.FIELDS * array("I").itemsize, strings_length,
+                           index_length * array("i").itemsize)
+                if header.size + sum(lengths) != size:
+                    return None
+                balances, offsets, strings, index = array("q"), array("I"), bytearray(), array("i")
+                with memoryview(mapping) as view:
+                    start = header.size
+                    for buffer, length in zip((balances, offsets, strings, index), lengths):
+                        with view[start:start + length] as section:
+                            if buffer is strings:
+                                strings += section
+                            else:
+                                buffer.frombytes(section)
+                        start += length
+        try:
+            return AccountStore.from_buffers(balances, offsets, strings, index)
+        except Exception:
+            return None
+
+    @staticmethod
+    def write(snapshot_file, store, data_version):
+        """Writes the records of a store to a snapshot file, replacing the previous snapshot atomically.
+
+        :param snapshot_file: Name of the snapshot file
+        :param store: 'AccountStore' with the records
+        :param data_version: Data version of the database the records were loaded from
+        :return: True if the snapshot was written, False if the data version is unknown
+        """
+        if data_version is None:
+            return False
+        balances, offsets, strings, index = store.get_buffers()
+        temporary = "{}.{}.tmp".format(snapshot_file, os.getpid())
+        with open(temporary, "wb") as destination:
+            destination.write(RecordsSnapshot.HEADER.pack(*RecordsSnapshot.__layout__(), *data_version,
+                                                          len(balances), len(strings), len(index)))
+            for buffer in (balances, offsets, strings, index):
+                destination.write(buffer)
+            destination.flush()
+            os.fsync(destination.fileno())
+        os.replace(temporary, snapshot_file)
+        return True
+
+    @staticmethod
+    def __layout__():
+        """Get the magic, format version, byte order and item sizes identifying the layout of the buffers."""
+        return (RecordsSnapshot.MAGIC, RecordsSnapshot.VERSION, RecordsSnapshot.BYTE_ORDER, array("I").itemsize,
+                array("i").itemsize)
@@ -0,0 +1,161 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import time
+
+from ATM import ATM
+from ATMSession import ATMSession
+from PinAuthenticator import PinAuthenticator
+from RecordsLoader import RecordsLoader
+
+
+class SessionReplayer:
+    """Replays recorded session scripts through the session flow without a terminal.
+
+    A session script file holds the lines a user enters, one per line, in the order the session asks for them. Blank
+    lines separate the sessions of a file and lines starting with '#' are comments, for example:
+    # withdraw 500 then check the balance
+    2050
+    1
+    500
+    y
+    3
+    n
+
+    When the ATM authenticates cards, as the 'accounts.db' of the console interface does once its pins are enrolled,
+    every session starts with the card number followed by the pin instead of the pin alone.
+
+    Every session is run through an 'ATMSession' and produces a transcript: the lines the session showed, with every
+    prompt followed by the answer read from the script, as they would appear on a console. The sessions are replayed
+    one after another on the same ATM, so replaying the same scripts against the same database always produces the
+    same transcripts, which can be compared with the transcripts of a previous run to catch regressions.
+
+    Example of usage:
+    replayer = SessionReplayer(ATM("accounts.db"))
+    for inputs in SessionReplayer.read_scripts("sessions.txt"):
+        print("\\n".join(replayer.replay(inputs)))
+    """
+
+    END_OF_SCRIPT = "<end of script>"
+
+    def __init__(self, atm):
+        """Initializes the replayer with the ATM the sessions are run on.
+
+        :param atm: ATM used by the sessions
+        :return: An initialized replayer
+        """
+        self.__atm__ = atm
+
+    @staticmethod
+    def read_scripts(script_file):
+        """Reads the sessions of a session script file.
+
+        :param script_file: Name of the session script file
+        :return: List of sessions, each one a list of the lines entered
+        """
+        sessions = []
+        inputs = []
+        with open(script_file) as source:
+            for line in source:
+                line = line.rstrip("\n")
+                if line.startswith("#"):
+                    continue
+                if line.strip():
+                    inputs.append(line)
+                elif inputs:
+                    sessions.append(inputs)
+                    inputs = []
+        if inputs:
+            sessions.append(inputs)
+        return sessions
+
+    def replay(self, inputs):
+        """Runs a session with the lines of a script.
+
+        If the script ends before the session does, END_OF_SCRIPT is added to the transcript and the session is
+        abandoned, lines left over once the session is finished are ignored.
+
+        :param inputs: Lines entered during the session
+        :return: List with the lines of the transcript
+        """
+        session = ATMSession(self.__atm__)
+        transcript = []
+        lines = session.start()
+        answers = iter(inputs)
+        while not session.is_finished():
+            transcript.extend(lines[:-1])
+            answer = next(answers, None)
+            if answer is None:
+                transcript.append(lines[-1])
+                transcript.append(self.END_OF_SCRIPT)
+                return transcript
+            transcript.append(lines[-1] + answer)
+            lines = session.feed(answer)
+        transcript.extend(lines)
+        return transcript
+
+    def replay_all(self, sessions):
+        """Runs many sessions one after another.
+
+        :param sessions: Iterable of sessions, each one a list of the lines entered
+        :return: List with the transcript of every session
+        """
+        return [self.replay(inputs) for inputs in sessions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded ATM session scripts without a terminal.")
+    parser.add_argument("scripts", nargs="+", help="session script files to replay")
+    parser.add_argument("--database", default="accounts.db", help="database file with the bank account records")
+    parser.add_argument("--compact", action="store_true", help="hold the records in a compact column store")
+    parser.add_argument("--cards", action="store_true",
+                        help="authenticate card numbers against the salted pin hashes created by PinAuthenticator.py")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times the scripts are replayed")
+    parser.add_argument("--transcripts", default=None, help="file to write the transcripts of the first replay to")
+    parser.add_argument("--expected", default=None, help="transcripts file of a previous run to compare with")
+    arguments = parser.parse_args()
+
+    sessions = []
+    for script_file in arguments.scripts:
+        sessions.extend(SessionReplayer.read_scripts(script_file))
+    authenticator = PinAuthenticator(arguments.database) if arguments.cards else None
+    atm = ATM(arguments.database, RecordsLoader.COMPACT if arguments.compact else RecordsLoader.EAGER,
+              authenticator=authenticator)
+    replayer = SessionReplayer(atm)
+
+    start = time.perf_counter()
+    transcripts = replayer.replay_all(sessions)
+    for _ in range(arguments.repeat - 1):
+        replayer.replay_all(sessions)
+    elapsed = time.perf_counter() - start
+    atm.close()
+    print("sessions: {}".format(len(sessions) * arguments.repeat))
+    print("seconds: {:.3f}".format(elapsed))
+    print("sessions_per_second: {:.0f}".format(len(sessions) * arguments.repeat / elapsed))
+
+    text = "".join("\n".join(transcript) + "\n\n" for transcript in transcripts)
+    if arguments.transcripts is not None:
+        with open(arguments.transcripts, "w") as destination:
+            destination.write(text)
+    if arguments.expected is not None:
+        with open(arguments.expected) as source:
+            expected = source.read()
+        if expected != text:
+            raise SystemExit("The transcripts differ from {}".format(arguments.expected))
+        print("The transcripts match {}".format(arguments.expected))
+
+
+if __name__ == "__main__":
+    main()
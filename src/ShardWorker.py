@@ -0,0 +1,212 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ATM import ATM
+from AccountPersistence import AccountPersistence
+from DatabaseConnection import DatabaseConnection
+from RecordsLoader import RecordsLoader
+
+
+class ShardWorker:
+    """Serves the accounts of one shard from a dedicated process.
+
+    The worker owns an ATM loaded from the database file of its shard and executes the requests forwarded by a
+    'ShardedATM' over a 'multiprocessing' connection one at a time, so the accounts of a shard are never accessed
+    concurrently and the shards run in parallel on separate cores.
+
+    A request is an (operation, arguments) tuple, the reply is ("ok", result) or ("error", message). Besides the ATM
+    operations the worker takes part in the two-phase commit of the transfers between shards:
+    prepare -> the half of a transfer is recorded in the 'prepared_transfers' table, a debit is taken from the balance
+               straight away so the funds can't be withdrawn before the transfer completes
+    commit  -> a credit is added to the balance and the prepared half is removed
+    abort   -> a debit is given back to the balance and the prepared half is removed
+    Each step is a single SQLite transaction so a prepared half survives a crash of the worker until the coordinator
+    decides its outcome.
+    """
+
+    def __init__(self, shard_file, loading_mode=RecordsLoader.EAGER, write_behind=False):
+        """Initializes the worker with the accounts of its shard.
+
+        :param shard_file: Name of the database file of the shard
+        :param loading_mode: 'RecordsLoader.EAGER' or 'RecordsLoader.COMPACT'
+        :param write_behind: If True the balance changes are written to the database in batches
+        :return: A worker ready to execute requests
+        """
+        self.__atm__ = ATM(shard_file, loading_mode)
+        self.__persistence__ = AccountPersistence(shard_file, AccountPersistence.WRITE_BEHIND if write_behind
+                                                  else AccountPersistence.WRITE_THROUGH)
+        self.__atm__.add_listener(self.__persistence__)
+        self.__database__ = DatabaseConnection(shard_file)
+        self.__database__.set_journal_mode("WAL", "NORMAL" if write_behind else "FULL")
+        self.__accounts__ = dict()
+        for _, account in self.__atm__.accounts():
+            self.__accounts__[account.get_account_number()] = account
+        self.__operations__ = {
+            "pins": self.pins,
+            "validate_pin": self.__atm__.validate_pin,
+            "load_account": self.load_account,
+            "deposit": self.deposit,
+            "withdraw": self.withdraw,
+            "transfer": self.transfer,
+            "prepare": self.prepare,
+            "commit": self.commit,
+            "abort": self.abort,
+            "prepared": self.prepared,
+        }
+
+    @staticmethod
+    def run(shard_file, connection, loading_mode=RecordsLoader.EAGER, write_behind=False):
+        """Body of a worker process, executes the requests received on the connection until it is told to stop.
+
+        :param shard_file: Name of the database file of the shard
+        :param connection: 'multiprocessing' connection to the router
+        :param loading_mode: 'RecordsLoader.EAGER' or 'RecordsLoader.COMPACT'
+        :param write_behind: If True the balance changes are written to the database in batches
+        :return: None
+        """
+        worker = ShardWorker(shard_file, loading_mode, write_behind)
+        connection.send(("ok", None))
+        try:
+            while True:
+                operation, arguments = connection.recv()
+                if operation == "stop":
+                    break
+                connection.send(worker.execute(operation, arguments))
+        except EOFError:
+            pass
+        finally:
+            worker.close()
+            connection.close()
+
+    def execute(self, operation, arguments):
+        """Executes a request.
+
+        :param operation: Name of the operation
+        :param arguments: Tuple of the arguments of the operation
+        :return: ("ok", result) if the operation succeeded else ("error", message)
+        """
+        try:
+            return "ok", self.__operations__[operation](*arguments)
+        except Exception as error:
+            return "error", "{}: {}".format(operation, error)
+
+    def pins(self):
+        """Get the pins of the accounts of the shard."""
+        return [pin for pin, _ in self.__atm__.accounts()]
+
+    def load_account(self, pin):
+        """Get the (account_number, first_name, last_name, balance) of the account associated with the pin, None if
+        there is no such account."""
+        account = self.__atm__.load_account(pin)
+        if account is None:
+            return None
+        return account.get_account_number(), account.get_first_name(), account.get_last_name(), account.get_balance()
+
+    def deposit(self, account_number, amount):
+        """Deposits into an account and returns its balance."""
+        account = self.__account__(account_number)
+        self.__atm__.deposit(account, amount)
+        return account.get_balance()
+
+    def withdraw(self, account_number, amount):
+        """Withdraws from an account and returns the amount withdrawn and the balance."""
+        account = self.__account__(account_number)
+        return self.__atm__.withdraw(account, amount), account.get_balance()
+
+    def transfer(self, source_number, destination_number, amount):
+        """Moves an amount between two accounts of the shard in a single SQLite transaction.
+
+        :return: True if the transfer was made, False if an account doesn't exist, both are the same account or the
+                 balance of the source account is insufficient
+        """
+        source = self.__accounts__.get(source_number)
+        destination = self.__accounts__.get(destination_number)
+        if source is None or destination is None or source is destination or amount <= 0 \
+                or source.get_balance() < amount:
+            return False
+        balances = ((source, source.get_balance() - amount), (destination, destination.get_balance() + amount))
+        self.__write__(balances)
+        return True
+
+    def prepare(self, transfer_id, account_number, amount):
+        """Prepares the half of a transfer between shards.
+
+        :param transfer_id: Identifier of the transfer
+        :param account_number: Account number of the account of the shard taking part in the transfer
+        :param amount: Amount added to the balance, negative for the debited account
+        :return: True if the half is prepared, False if the account doesn't exist or the balance of a debited account
+                 is insufficient
+        """
+        account = self.__accounts__.get(account_number)
+        if account is None:
+            return False
+        balance = account.get_balance()
+        if amount == 0 or balance + amount < 0:
+            return False
+        self.__write__(((account, balance + amount),) if amount < 0 else (),
+                       "INSERT INTO prepared_transfers (id, account_number, amount) VALUES (?, ?, ?)",
+                       (transfer_id, account_number, amount))
+        return True
+
+    def commit(self, transfer_id):
+        """Completes a prepared half of a transfer, a transfer which isn't prepared is ignored."""
+        self.__resolve__(transfer_id, True)
+
+    def abort(self, transfer_id):
+        """Cancels a prepared half of a transfer, a transfer which isn't prepared is ignored."""
+        self.__resolve__(transfer_id, False)
+
+    def prepared(self):
+        """Get the identifiers of the transfers prepared but not yet committed or aborted."""
+        return [row[0] for row in self.__database__.fetch_all("SELECT id FROM prepared_transfers")]
+
+    def close(self):
+        """Writes the pending balance changes and closes the database connections."""
+        self.__atm__.close()
+        self.__database__.close()
+
+    def __resolve__(self, transfer_id, committed):
+        """Commits or aborts a prepared half of a transfer."""
+        row = self.__database__.fetch_one("SELECT account_number, amount FROM prepared_transfers WHERE id = ?",
+                                          (transfer_id,))
+        if row is None:
+            return
+        account = self.__account__(row[0])
+        amount = row[1]
+        if (amount > 0) == committed:  # a committed credit or an aborted debit changes the balance
+            balances = ((account, account.get_balance() + abs(amount)),)
+        else:
+            balances = ()
+        self.__write__(balances, "DELETE FROM prepared_transfers WHERE id = ?", (transfer_id,))
+
+    def __write__(self, balances, sql=None, parameters=()):
+        """Writes new balances along with an optional statement in a single transaction, then updates the accounts.
+
+        The pending balance changes are flushed first so a later batch can't overwrite the balances written here.
+        """
+        self.__persistence__.flush()
+        with self.__database__.transaction():
+            self.__database__.execute_many("UPDATE accounts SET balance = ? WHERE account_number = ?",
+                                           [(balance, account.get_account_number()) for account, balance in balances])
+            if sql is not None:
+                self.__database__.execute(sql, parameters)
+        for account, balance in balances:
+            account.set_balance(balance)
+
+    def __account__(self, account_number):
+        """Get the account of the shard with the account number, an 'Exception' is raised if there is none."""
+        account = self.__accounts__.get(account_number)
+        if account is None:
+            raise Exception("No account {} in this shard".format(account_number))
+        return account
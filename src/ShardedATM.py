@@ -0,0 +1,292 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import os
+import sqlite3
+import threading
+import uuid
+import zlib
+
+from ATM import ATM
+from BankAccount import BankAccount
+from DatabaseConnection import DatabaseConnection
+from DatabaseScript import DatabaseScript
+from RecordsLoader import RecordsLoader
+from ShardWorker import ShardWorker
+
+
+class ShardedATM:
+    """ATM whose accounts are partitioned across worker processes.
+
+    The accounts are hash partitioned by account number into shards, each shard has its own database file and is served
+    by a 'ShardWorker' process, so the shards use separate cores and the memory of separate processes. The router
+    forwards the ATM operations to the worker owning the account over a 'multiprocessing' pipe and keeps a directory
+    of the shard of every pin to route the pin based operations.
+
+    The router offers the same operations as the ATM, 'load_account' returns a detached 'BankAccount' copy of the
+    record whose balance is refreshed by the deposits and withdrawals made through the router.
+
+    Transfers within a shard are a single SQLite transaction of its worker. Transfers between shards use a two-phase
+    commit: both halves are prepared by their workers, the decision to commit is logged durably in the coordinator
+    database and then both halves are committed. Transfers left in doubt by a crash are resolved from the coordinator
+    log when the router starts again.
+
+    Example of usage:
+    shard_files = ShardedATM.partition_database("accounts.db", 4)
+    atm = ShardedATM(shard_files, "accounts.coordinator.db")
+    if atm.validate_pin("2050"):
+        account = atm.load_account("2050")
+        atm.withdraw(account, 100)
+    atm.close()
+    """
+
+    def __init__(self, shard_files, coordinator_file, loading_mode=RecordsLoader.EAGER, write_behind=False):
+        """Starts a worker process for every shard and resolves the transfers left in doubt.
+
+        :param shard_files: Names of the database files of the shards, in shard order
+        :param coordinator_file: Name of the database file logging the decisions of the transfers between shards
+        :param loading_mode: 'RecordsLoader.EAGER' or 'RecordsLoader.COMPACT', how the workers hold their accounts
+        :param write_behind: If True the workers write the balance changes to their database in batches
+        :return: A router ready to forward the ATM operations
+        """
+        context = multiprocessing.get_context("spawn")
+        self.__shards__ = []
+        self.__processes__ = []
+        for shard_file in shard_files:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=ShardWorker.run, daemon=True,
+                                      args=(shard_file, worker_connection, loading_mode, write_behind))
+            process.start()
+            worker_connection.close()
+            self.__shards__.append((connection, threading.Lock()))
+            self.__processes__.append(process)
+        for connection, _ in self.__shards__:
+            status, message = connection.recv()
+            if status != "ok":
+                raise Exception(message)
+
+        self.__decisions__ = sqlite3.connect(coordinator_file, check_same_thread=False)
+        self.__decisions__.execute("PRAGMA journal_mode = WAL")
+        self.__decisions__.execute("PRAGMA synchronous = FULL")
+        self.__decisions__.execute("CREATE TABLE IF NOT EXISTS transfer_decisions (id TEXT PRIMARY KEY)")
+        self.__decisions__.commit()
+        self.__decisions_lock__ = threading.Lock()
+        self.__resolve_in_doubt__()
+
+        self.__directory__ = dict()
+        for shard in range(len(self.__shards__)):
+            for pin in self.__request__(shard, "pins"):
+                self.__directory__[pin] = shard
+
+    @staticmethod
+    def shard_of(account_number, shards):
+        """Get the shard of an account, the same in every process unlike the randomized 'hash' of a 'str'.
+
+        :param account_number: Account number of the account
+        :param shards: Number of shards
+        :return: Index of the shard owning the account
+        """
+        return zlib.crc32(account_number.encode()) % shards
+
+    @staticmethod
+    def partition_database(database_file, shards):
+        """Splits the accounts of a database into shard database files.
+
+        Shard files which already exist are left as they are, so the partitioning is done once and the shards keep
+        their balances across restarts.
+
+        :param database_file: Name of the database file with all the accounts
+        :param shards: Number of shards
+        :return: List with the names of the shard database files
+        """
+        if type(shards) != int or shards <= 0:
+            raise Exception("Invalid argument: shards should be a positive <class 'int'> found {}".format(shards))
+        base, _ = os.path.splitext(database_file)
+        shard_files = ["{}.shard{}of{}.db".format(base, shard, shards) for shard in range(shards)]
+        if all(os.path.exists(shard_file) for shard_file in shard_files):
+            return shard_files
+        connections = []
+        for shard_file in shard_files:
+            temporary_file = shard_file + ".tmp"
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+            connection = sqlite3.connect(temporary_file)
+            connection.execute(
+                "CREATE TABLE accounts (account_number TEXT, first_name TEXT, last_name TEXT, balance INT, pin TEXT)")
+            connections.append(connection)
+        source = DatabaseConnection(database_file)
+        partitions = [[] for _ in range(shards)]
+        buffered = 0
+        for record in source.fetch_iter("SELECT account_number, first_name, last_name, balance, pin FROM accounts"):
+            partitions[ShardedATM.shard_of(record[0], shards)].append(record)
+            buffered += 1
+            if buffered == 100000:
+                ShardedATM.__insert_partitions__(connections, partitions)
+                buffered = 0
+        ShardedATM.__insert_partitions__(connections, partitions)
+        source.close()
+        for connection, shard_file in zip(connections, shard_files):
+            connection.commit()
+            DatabaseScript.migrate_database(shard_file + ".tmp")
+            connection.close()
+            os.replace(shard_file + ".tmp", shard_file)
+        return shard_files
+
+    def validate_pin(self, pin):
+        """Checks if the pin is valid, from the directory of the router without contacting a worker.
+
+        :param pin: Pin to perform validation
+        :return: True if the pin is valid else returns False
+        """
+        if ATM.param_is_good(pin):
+            return pin in self.__directory__
+
+    def load_account(self, pin):
+        """Get a copy of the bank account record associated with the pin.
+
+        :param pin: Pin to locate the associated bank account record
+        :return: 'BankAccount' copy of the record associated with the pin, None if there is no such record
+        """
+        if ATM.param_is_good(pin):
+            shard = self.__directory__.get(pin)
+            if shard is None:
+                return None
+            record = self.__request__(shard, "load_account", pin)
+            return None if record is None else BankAccount(*record)
+
+    def withdraw(self, account, amount):
+        """Withdraws the amount from the account in the worker owning it.
+
+        :param account: Bank account loaded by this router
+        :param amount: Amount to withdraw
+        :return: Amount withdrawn, zero(0) if the balance is insufficient
+        """
+        withdrawn, balance = self.__request__(self.__shard_of__(account.get_account_number()), "withdraw",
+                                              account.get_account_number(), amount)
+        account.set_balance(balance)
+        return withdrawn
+
+    def deposit(self, account, amount):
+        """Deposits the amount into the account in the worker owning it.
+
+        :param account: Bank account loaded by this router
+        :param amount: Amount to deposit
+        :return: None
+        """
+        account.set_balance(self.__request__(self.__shard_of__(account.get_account_number()), "deposit",
+                                             account.get_account_number(), amount))
+
+    def transfer(self, source_number, destination_number, amount):
+        """Moves an amount from one account to another atomically, whichever shards own them.
+
+        Checks that the argument 'amount' passed in is of type 'int' else an 'Exception' is raised.
+
+        :param source_number: Account number of the account debited
+        :param destination_number: Account number of the account credited
+        :param amount: Amount to move
+        :return: True if the transfer was made, False if an account doesn't exist, both are the same account, the
+                 amount isn't positive or the balance of the source account is insufficient
+        """
+        if type(amount) != int:
+            raise Exception("Invalid argument: amount of type {} should be: <class 'int'>".format(type(amount)))
+        if amount <= 0:
+            return False
+        source_shard = self.__shard_of__(source_number)
+        destination_shard = self.__shard_of__(destination_number)
+        if source_shard == destination_shard:
+            return self.__request__(source_shard, "transfer", source_number, destination_number, amount)
+        transfer_id = uuid.uuid4().hex
+        if not self.__request__(source_shard, "prepare", transfer_id, source_number, -amount):
+            return False
+        try:
+            prepared = self.__request__(destination_shard, "prepare", transfer_id, destination_number, amount)
+        except BaseException:
+            self.__request__(source_shard, "abort", transfer_id)
+            raise
+        if not prepared:
+            self.__request__(source_shard, "abort", transfer_id)
+            return False
+        with self.__decisions_lock__:
+            self.__decisions__.execute("INSERT INTO transfer_decisions (id) VALUES (?)", (transfer_id,))
+            self.__decisions__.commit()
+        self.__request__(source_shard, "commit", transfer_id)
+        self.__request__(destination_shard, "commit", transfer_id)
+        with self.__decisions_lock__:
+            self.__decisions__.execute("DELETE FROM transfer_decisions WHERE id = ?", (transfer_id,))
+            self.__decisions__.commit()
+        return True
+
+    def transfer_batch(self, transfers):
+        """Performs many transfers, each one succeeds or fails on its own as if it was made with 'transfer'.
+
+        :param transfers: Iterable of (source_number, destination_number, amount) tuples
+        :return: List with the result of every transfer, True if it was made else False
+        """
+        return [self.transfer(source_number, destination_number, amount)
+                for source_number, destination_number, amount in transfers]
+
+    def statement(self, account, count=10):
+        """Statements are not kept by the shards, provided for interface compatibility with the ATM."""
+        return ["Statements are not available"]
+
+    def statement_between(self, account, start, end):
+        """Statements are not kept by the shards, provided for interface compatibility with the ATM."""
+        return ["Statements are not available"]
+
+    def get_shards(self):
+        """Get the number of shards."""
+        return len(self.__shards__)
+
+    def close(self):
+        """Stops the worker processes once they have written their pending balance changes."""
+        for connection, lock in self.__shards__:
+            with lock:
+                connection.send(("stop", ()))
+                connection.close()
+        for process in self.__processes__:
+            process.join()
+        self.__decisions__.close()
+
+    def __request__(self, shard, operation, *arguments):
+        """Forwards an operation to the worker of a shard and waits for its result."""
+        connection, lock = self.__shards__[shard]
+        with lock:
+            connection.send((operation, arguments))
+            status, result = connection.recv()
+        if status != "ok":
+            raise Exception(result)
+        return result
+
+    def __shard_of__(self, account_number):
+        """Get the shard owning an account."""
+        return self.shard_of(account_number, len(self.__shards__))
+
+    def __resolve_in_doubt__(self):
+        """Commits the prepared transfers whose decision was logged and aborts the others."""
+        committed = {row[0] for row in self.__decisions__.execute("SELECT id FROM transfer_decisions")}
+        for shard in range(len(self.__shards__)):
+            for transfer_id in self.__request__(shard, "prepared"):
+                self.__request__(shard, "commit" if transfer_id in committed else "abort", transfer_id)
+        self.__decisions__.execute("DELETE FROM transfer_decisions")
+        self.__decisions__.commit()
+
+    @staticmethod
+    def __insert_partitions__(connections, partitions):
+        """Inserts the buffered records of every partition into its shard database."""
+        for connection, records in zip(connections, partitions):
+            connection.executemany(
+                "INSERT INTO accounts (account_number, first_name, last_name, balance, pin) VALUES (?, ?, ?, ?, ?)",
+                records)
+            records.clear()
@@ -0,0 +1,196 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from BankAccount import BankAccount
+from DatabaseConnection import DatabaseConnection
+from DatabaseScript import DatabaseScript
+
+
+class TransactionHistory:
+    """Store of the transactions performed on every account, queried for account statements.
+
+    The object is used as a transaction listener of the ATM and records every deposit, withdrawal and transfer in the
+    'transactions' table with the time of the transaction and the balance of the account after it. The table is
+    indexed by (account_number, timestamp) so the latest transactions of an account and the transactions of an account
+    within a period are read from a narrow range of the index, however many transactions the account and the table
+    hold.
+
+    Transactions are buffered and inserted in batches, a batch is committed in a single transaction when 'batch_size'
+    transactions are pending or every 'flush_interval' seconds. Queries flush the pending transactions first so a
+    statement always includes the transactions of the session that asks for it. A batch that fails to be inserted, such
+    as while another process holds the database lock for too long, stays pending and is inserted by the next flush, the
+    failures of the background flusher are counted in 'get_metrics'.
+
+    Example of usage:
+    history = TransactionHistory("accounts.db")
+    atm = ATM(history=history)
+    ...
+    for timestamp, transaction_type, amount, balance in history.last("10001", 10):
+        ...
+    atm.close()
+    """
+
+    INSERT = "INSERT INTO transactions (account_number, timestamp, type, amount, balance) VALUES (?, ?, ?, ?, ?)"
+    SELECT_LAST = ("SELECT timestamp, type, amount, balance FROM transactions WHERE account_number = ? "
+                   "ORDER BY timestamp DESC, id DESC LIMIT ?")
+    SELECT_BETWEEN = ("SELECT timestamp, type, amount, balance FROM transactions WHERE account_number = ? "
+                      "AND timestamp >= ? AND timestamp < ? ORDER BY timestamp, id")
+
+    def __init__(self, database_file, batch_size=512, flush_interval=1.0, pool=None):
+        """Initializes the object with a connection to the specified database.
+
+        :param database_file: Name of the database file holding the 'transactions' table
+        :param batch_size: Number of pending transactions that triggers a flush
+        :param flush_interval: Maximum number of seconds a transaction stays pending
+        :param pool: 'ConnectionPool' to read and write the history with instead of a private connection
+        :return: An initialized object ready to record transactions
+        """
+        self.__database__ = None
+        if pool is None:
+            self.__database__ = DatabaseConnection(database_file, check_same_thread=False)
+            self.__database__.set_journal_mode("WAL", "NORMAL")
+        DatabaseScript.migrate_database(database_file)
+        self.__pool__ = pool
+        self.__batch_size__ = batch_size
+        self.__flush_interval__ = flush_interval
+        self.__pending__ = []
+        self.__errors__ = 0
+        self.__lock__ = threading.Lock()
+        self.__closed__ = threading.Event()
+        self.__flusher__ = threading.Thread(target=self.__flush_periodically__, daemon=True)
+        self.__flusher__.start()
+
+    def transaction_applied(self, account, transaction_type, amount):
+        """Records a deposit or withdrawal performed on an account.
+
+        :param account: Bank account the transaction was applied to
+        :param transaction_type: Type of the transaction that was applied
+        :param amount: Amount of the transaction
+        :return: None
+        """
+        self.record(account.get_account_number(), transaction_type, amount, account.get_balance())
+
+    def transfers_applied(self, transfers):
+        """Records both halves of transfers between accounts.
+
+        :param transfers: List of (source, destination, amount) tuples of the transfers applied
+        :return: None
+        """
+        now = time.time()
+        with self.__lock__:
+            for source, destination, amount in transfers:
+                self.__pending__.append((source.get_account_number(), now, BankAccount.TRANSFER_OUT, amount,
+                                         source.get_balance()))
+                self.__pending__.append((destination.get_account_number(), now, BankAccount.TRANSFER_IN, amount,
+                                         destination.get_balance()))
+            if len(self.__pending__) >= self.__batch_size__:
+                self.__flush_pending__()
+
+    def record(self, account_number, transaction_type, amount, balance, timestamp=None):
+        """Records a transaction.
+
+        :param account_number: Account number of the account
+        :param transaction_type: One of the 'BankAccount' transaction type class constants
+        :param amount: Amount of the transaction
+        :param balance: Balance of the account after the transaction
+        :param timestamp: Time of the transaction in seconds since the epoch, the current time if None
+        :return: None
+        """
+        with self.__lock__:
+            self.__pending__.append((account_number, time.time() if timestamp is None else timestamp,
+                                     transaction_type, amount, balance))
+            if len(self.__pending__) >= self.__batch_size__:
+                self.__flush_pending__()
+
+    def last(self, account_number, count=10):
+        """Get the latest transactions of an account, the most recent first.
+
+        :param account_number: Account number of the account
+        :param count: Maximum number of transactions
+        :return: List of (timestamp, transaction_type, amount, balance) tuples
+        """
+        return self.__query__(self.SELECT_LAST, (account_number, count))
+
+    def between(self, account_number, start, end):
+        """Get the transactions of an account within a period, the oldest first.
+
+        :param account_number: Account number of the account
+        :param start: Start of the period in seconds since the epoch, inclusive
+        :param end: End of the period in seconds since the epoch, exclusive
+        :return: List of (timestamp, transaction_type, amount, balance) tuples
+        """
+        return self.__query__(self.SELECT_BETWEEN, (account_number, start, end))
+
+    def get_metrics(self):
+        """Get the number of pending transactions and of failed flushes of the background flusher.
+
+        :return: Dictionary with the pending_transactions and flush_errors
+        """
+        with self.__lock__:
+            return {"pending_transactions": len(self.__pending__), "flush_errors": self.__errors__}
+
+    def flush(self):
+        """Inserts the pending transactions in a single transaction."""
+        with self.__lock__:
+            self.__flush_pending__()
+
+    def close(self):
+        """Flushes the pending transactions, stops the background flusher and closes the private connection."""
+        self.__closed__.set()
+        self.__flusher__.join()
+        with self.__lock__:
+            self.__flush_pending__()
+            if self.__database__ is not None:
+                self.__database__.close()
+
+    def __query__(self, sql, parameters):
+        """Flushes the pending transactions and runs a query of the history."""
+        with self.__lock__:
+            self.__flush_pending__()
+            if self.__pool__ is None:
+                return self.__database__.fetch_all(sql, parameters)
+        with self.__pool__.reader() as database:
+            return database.fetch_all(sql, parameters)
+
+    def __flush_pending__(self):
+        """Inserts the pending transactions, the caller must hold the lock, they stay pending if the insert fails."""
+        if not self.__pending__:
+            return
+        pending, self.__pending__ = self.__pending__, []
+        try:
+            if self.__pool__ is None:
+                self.__insert__(self.__database__, pending)
+            else:
+                with self.__pool__.writer() as database:
+                    self.__insert__(database, pending)
+        except BaseException:
+            self.__pending__ = pending + self.__pending__  # ahead of the transactions recorded since
+            raise
+
+    def __insert__(self, database, pending):
+        """Inserts transactions in a single transaction on the specified connection."""
+        with database.transaction():
+            database.execute_many(self.INSERT, pending)
+
+    def __flush_periodically__(self):
+        """Body of the background flusher thread."""
+        while not self.__closed__.wait(self.__flush_interval__):
+            try:
+                self.flush()
+            except Exception:
+                with self.__lock__:
+                    self.__errors__ += 1
@@ -0,0 +1,383 @@
+# Copyright 2014 Rico Antonio Felix
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import struct
+import threading
+import time
+import zlib
+
+from BankAccount import BankAccount
+
+
+class TransactionJournal:
+    """Append-only binary journal of the transactions with periodic snapshots of all the accounts.
+
+    Every deposit and withdrawal is appended to the journal as a record with a sequence number, the time, the amount
+    and the balance of the account after the transaction. Records are buffered in memory and written by a background
+    thread which issues one fsync for every group of records, a transaction waits until its group is durable when the
+    journal is 'durable', so concurrent transactions share the cost of an fsync.
+
+    Every 'snapshot_interval' records the accounts are written to a compact snapshot file and the journal is started
+    afresh, so recovering after a crash loads the snapshot and replays at most the records of the last interval
+    instead of reloading every record from the database. Records hold the balance after the transaction rather than a
+    difference so replaying a record that the snapshot already reflects is harmless.
+
+    Files used, for a journal at 'path':
+    path.journal      -> records appended since the last snapshot started
+    path.journal.prev -> records of the interval being snapshotted, removed once the snapshot is durable
+    path.snapshot     -> latest complete snapshot
+
+    Journal record layout: crc32 (I), sequence (Q), time (d), type (B), amount (q), balance (q), account number length
+    (B) followed by the account number, all little endian. The crc covers the rest of the record, a torn or corrupted
+    record ends the journal.
+
+    Example of usage:
+    journal = TransactionJournal("accounts")
+    atm = ATM(journal=journal)
+    ...
+    atm.close()
+    """
+
+    RECORD_HEADER = struct.Struct("<IQdBqqB")
+    SNAPSHOT_MAGIC = b"ATMSNAP1"
+    SNAPSHOT_HEADER = struct.Struct("<8sQQ")
+    TRANSACTION_TYPES = (BankAccount.DEPOSIT, BankAccount.WITHDRAW, BankAccount.TRANSFER_OUT, BankAccount.TRANSFER_IN)
+
+    def __init__(self, path, group_size=256, sync_interval=0.002, durable=True, snapshot_interval=100000):
+        """Opens the journal at the specified path, creating it if needed.
+
+        The existing journal files are scanned to find the last sequence number and a torn record at the end of the
+        journal, left by a crash during a write, is truncated.
+
+        :param path: Path of the journal files without their extension
+        :param group_size: Number of buffered records that triggers a write without waiting for the sync interval
+        :param sync_interval: Maximum number of seconds records stay buffered when the journal isn't durable
+        :param durable: If True every transaction waits until its record has been fsynced, the records appended while
+                        a group is being fsynced form the next group
+        :param snapshot_interval: Number of records after which a snapshot is taken, 0 to never take one automatically
+        :return: An open journal
+        """
+        self.__journal_file__ = path + ".journal"
+        self.__previous_file__ = path + ".journal.prev"
+        self.__snapshot_file__ = path + ".snapshot"
+        self.__group_size__ = group_size
+        self.__sync_interval__ = sync_interval
+        self.__durable__ = durable
+        self.__snapshot_interval__ = snapshot_interval
+        self.__snapshot_source__ = None
+        self.__snapshot_thread__ = None
+
+        self.__tail__ = list(self.__read_journal__(self.__previous_file__, False))
+        self.__tail__.extend(self.__read_journal__(self.__journal_file__, True))
+        self.__tail__.sort()
+        self.__sequence__ = max(self.__tail__[-1][0] if self.__tail__ else 0, self.__snapshot_sequence__())
+        self.__synced_sequence__ = self.__sequence__
+        self.__since_snapshot__ = len(self.__tail__)
+
+        self.__file__ = open(self.__journal_file__, "ab")
+        self.__buffer__ = bytearray()
+        self.__condition__ = threading.Condition()
+        self.__file_lock__ = threading.Lock()
+        self.__closed__ = False
+        self.__writer__ = threading.Thread(target=self.__write_groups__, daemon=True)
+        self.__writer__.start()
+
+    def set_snapshot_source(self, source):
+        """Sets the callable used to take automatic snapshots.
+
+        :param source: Callable returning an iterable of (pin, account) pairs for every account
+        :return: None
+        """
+        self.__snapshot_source__ = source
+
+    def transaction_applied(self, account, transaction_type, amount):
+        """Appends a record of a deposit or withdrawal performed on an account.
+
+        :param account: Bank account the transaction was applied to
+        :param transaction_type: Type of the transaction that was applied
+        :param amount: Amount of the transaction
+        :return: None
+        """
+        self.append(account.get_account_number(), transaction_type, amount, account.get_balance())
+
+    def transfers_applied(self, transfers):
+        """Appends the records of both halves of transfers between accounts, in the same group of records.
+
+        :param transfers: List of (source, destination, amount) tuples of the transfers applied
+        :return: None
+        """
+        records = []
+        for source, destination, amount in transfers:
+            records.append((source.get_account_number(), BankAccount.TRANSFER_OUT, amount, source.get_balance()))
+            records.append((destination.get_account_number(), BankAccount.TRANSFER_IN, amount,
+                            destination.get_balance()))
+        self.append_many(records)
+
+    def append(self, account_number, transaction_type, amount, balance):
+        """Appends a transaction record to the journal.
+
+        If the journal is durable the call returns once the record has been fsynced.
+
+        :param account_number: Account number of the account
+        :param transaction_type: One of the 'BankAccount' transaction type class constants
+        :param amount: Amount of the transaction
+        :param balance: Balance of the account after the transaction
+        :return: Sequence number of the record
+        """
+        return self.append_many(((account_number, transaction_type, amount, balance),))
+
+    def append_many(self, records):
+        """Appends several transaction records to the journal with consecutive sequence numbers, they are written in
+        the same group of records.
+
+        If the journal is durable the call returns once the records have been fsynced.
+
+        :param records: Sequence of (account_number, transaction_type, amount, balance) tuples
+        :return: Sequence number of the last record
+        """
+        with self.__condition__:
+            if self.__closed__:
+                raise Exception("The transaction journal is closed")
+            now = time.time()
+            for account_number, transaction_type, amount, balance in records:
+                encoded = account_number.encode()
+                self.__sequence__ += 1
+                record = self.RECORD_HEADER.pack(0, self.__sequence__, now,
+                                                 self.TRANSACTION_TYPES.index(transaction_type), amount, balance,
+                                                 len(encoded))[4:] + encoded
+                self.__buffer__ += struct.pack("<I", zlib.crc32(record)) + record
+            sequence = self.__sequence__
+            if self.__durable__ or len(self.__buffer__) >= self.__group_size__ * self.RECORD_HEADER.size:
+                self.__condition__.notify_all()
+            self.__since_snapshot__ += len(records)
+            if self.__since_snapshot__ >= self.__snapshot_interval__ > 0 and self.__snapshot_source__ is not None \
+                    and (self.__snapshot_thread__ is None or not self.__snapshot_thread__.is_alive()):
+                self.__since_snapshot__ = 0
+                self.__snapshot_thread__ = threading.Thread(target=self.snapshot, daemon=True)
+                self.__snapshot_thread__.start()
+            if self.__durable__:
+                while self.__synced_sequence__ < sequence:
+                    self.__condition__.wait()
+        return sequence
+
+    def sync(self):
+        """Waits until every record appended so far has been fsynced."""
+        with self.__condition__:
+            target = self.__sequence__
+            self.__condition__.notify_all()
+            while self.__synced_sequence__ < target:
+                self.__condition__.wait()
+
+    def recover(self, load_records):
+        """Rebuilds the accounts as of the last durable record.
+
+        The accounts are loaded from the snapshot if there is one, else from 'load_records' after which an initial
+        snapshot is taken, and the journal records that followed are replayed on top of them.
+
+        :param load_records: Callable returning a pin keyed collection of the accounts, used when there is no snapshot
+        :return: Pin keyed dictionary of 'BankAccount' objects or the collection returned by 'load_records'
+        """
+        records = self.__read_snapshot__()
+        taken = records is not None
+        if not taken:
+            records = load_records()
+        by_account_number = {account.get_account_number(): account for _, account in records.items()}
+        snapshot_sequence = self.__snapshot_sequence__()
+        for sequence, account_number, balance in self.__tail__:
+            account = by_account_number.get(account_number)
+            if sequence > snapshot_sequence and account is not None:
+                account.set_balance(balance)
+        self.__tail__ = []
+        if not taken:
+            self.snapshot(records.items())
+        return records
+
+    def snapshot(self, accounts=None):
+        """Writes a snapshot of the accounts and discards the journal records it makes redundant.
+
+        The journal is rotated first so transactions continue while the snapshot is written, the records of the
+        rotated journal are only discarded once the snapshot has been fsynced and atomically renamed into place.
+
+        :param accounts: Iterable of (pin, account) pairs, the snapshot source is used if None
+        :return: Sequence number covered by the snapshot
+        """
+        if accounts is None:
+            accounts = self.__snapshot_source__()
+        sequence = self.__rotate__()
+        temporary_file = self.__snapshot_file__ + ".tmp"
+        checksum = 0
+        count = 0
+        with open(temporary_file, "wb") as destination:
+            destination.write(self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, sequence, 0))
+            chunk = bytearray()
+            for pin, account in accounts:
+                chunk += struct.pack("<q", account.get_balance())
+                for value in (pin, account.get_account_number(), account.get_first_name(), account.get_last_name()):
+                    encoded = value.encode()
+                    chunk.append(len(encoded))
+                    chunk += encoded
+                count += 1
+                if len(chunk) >= 1 << 20:
+                    checksum = zlib.crc32(chunk, checksum)
+                    destination.write(chunk)
+                    chunk = bytearray()
+            checksum = zlib.crc32(chunk, checksum)
+            destination.write(chunk)
+            destination.write(struct.pack("<I", checksum))
+            destination.seek(0)
+            destination.write(self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, sequence, count))
+            destination.flush()
+            os.fsync(destination.fileno())
+        os.replace(temporary_file, self.__snapshot_file__)
+        self.__sync_directory__()
+        if os.path.exists(self.__previous_file__):
+            os.remove(self.__previous_file__)
+        return sequence
+
+    def close(self):
+        """Writes the buffered records, waits for a snapshot in progress and closes the journal."""
+        with self.__condition__:
+            self.__closed__ = True
+            self.__condition__.notify_all()
+        self.__writer__.join()
+        if self.__snapshot_thread__ is not None:
+            self.__snapshot_thread__.join()
+        self.__file__.close()
+
+    def __write_groups__(self):
+        """Body of the background thread writing and fsyncing groups of records.
+
+        Transactions keep appending to the buffer while a group is being fsynced, they form the next group.
+        """
+        while True:
+            with self.__condition__:
+                if not self.__buffer__ and not self.__closed__:
+                    self.__condition__.wait(self.__sync_interval__)
+                if not self.__buffer__:
+                    if self.__closed__:
+                        return
+                    continue
+            with self.__file_lock__:  # a group is only taken from the buffer by the holder of the file lock
+                data, sequence = self.__take__()
+                if data:
+                    self.__write__(data)
+            self.__synced__(sequence)
+
+    def __take__(self):
+        """Takes the buffered records along with the sequence number of the last one, the caller must hold the file
+        lock so the groups are written in the order they are taken and every record up to the sequence number is
+        written once the group is."""
+        with self.__condition__:
+            data, self.__buffer__ = self.__buffer__, bytearray()
+            return data, self.__sequence__
+
+    def __write__(self, data):
+        """Writes and fsyncs records to the journal file, the caller must hold the file lock."""
+        self.__file__.write(data)
+        self.__file__.flush()
+        os.fsync(self.__file__.fileno())
+
+    def __synced__(self, sequence):
+        """Wakes up the transactions waiting for the records up to a sequence number to be durable."""
+        with self.__condition__:
+            self.__synced_sequence__ = max(self.__synced_sequence__, sequence)
+            self.__condition__.notify_all()
+
+    def __rotate__(self):
+        """Moves the journal aside for a snapshot and returns the last sequence number it holds."""
+        with self.__file_lock__:
+            data, sequence = self.__take__()
+            with self.__condition__:
+                self.__since_snapshot__ = 0
+            self.__write__(data)
+            self.__file__.close()
+            if os.path.exists(self.__previous_file__):  # a previous snapshot didn't complete, keep its records
+                with open(self.__previous_file__, "ab") as previous, open(self.__journal_file__, "rb") as current:
+                    previous.write(current.read())
+                    previous.flush()
+                    os.fsync(previous.fileno())
+                os.remove(self.__journal_file__)
+            else:
+                os.replace(self.__journal_file__, self.__previous_file__)
+            self.__file__ = open(self.__journal_file__, "ab")
+            self.__sync_directory__()
+        self.__synced__(sequence)
+        return sequence
+
+    def __read_journal__(self, journal_file, truncate):
+        """Generates (sequence, account_number, balance) for every intact record of a journal file."""
+        if not os.path.exists(journal_file):
+            return
+        with open(journal_file, "rb") as source:
+            data = source.read()
+        header = self.RECORD_HEADER
+        offset = 0
+        while offset + header.size <= len(data):
+            checksum, sequence, _, _, _, balance, length = header.unpack_from(data, offset)
+            end = offset + header.size + length
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != checksum:
+                break
+            yield sequence, data[offset + header.size:end].decode(), balance
+            offset = end
+        if truncate and offset < len(data):
+            with open(journal_file, "r+b") as torn:
+                torn.truncate(offset)
+
+    def __read_snapshot__(self):
+        """Loads the accounts of the snapshot into a pin keyed dictionary, None if there is no valid snapshot."""
+        if not os.path.exists(self.__snapshot_file__):
+            return None
+        with open(self.__snapshot_file__, "rb") as source:
+            data = source.read()
+        header = self.SNAPSHOT_HEADER
+        if len(data) < header.size + 4 or data[:8] != self.SNAPSHOT_MAGIC:
+            return None
+        if zlib.crc32(data[header.size:-4]) != struct.unpack("<I", data[-4:])[0]:
+            return None
+        _, _, count = header.unpack_from(data)
+        records = dict()
+        offset = header.size
+        for _ in range(count):
+            balance = struct.unpack_from("<q", data, offset)[0]
+            offset += 8
+            values = []
+            for _ in range(4):
+                length = data[offset]
+                values.append(data[offset + 1:offset + 1 + length].decode())
+                offset += 1 + length
+            records[values[0]] = BankAccount(values[1], values[2], values[3], balance)
+        return records
+
+    def __snapshot_sequence__(self):
+        """Get the sequence number covered by the snapshot, zero(0) if there is no snapshot."""
+        if not os.path.exists(self.__snapshot_file__):
+            return 0
+        with open(self.__snapshot_file__, "rb") as source:
+            data = source.read(self.SNAPSHOT_HEADER.size)
+        if len(data) < self.SNAPSHOT_HEADER.size or data[:8] != self.SNAPSHOT_MAGIC:
+            return 0
+        return self.SNAPSHOT_HEADER.unpack(data)[1]
+
+    def __sync_directory__(self):
+        """Fsyncs the directory of the journal so renames and new files survive a crash."""
+        directory = os.path.dirname(os.path.abspath(self.__journal_file__))
+        try:
+            descriptor = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
@@ -0,0 +1,25 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from DatabaseScript import DatabaseScript  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Name of a fresh database file with the sample records."""
+    database_file = str(tmp_path / "accounts.db")
+    DatabaseScript.load_database(database_file)
+    return database_file
+
+
+@pytest.fixture
+def foreign(database):
+    """Connection of another process to the database, committing every statement."""
+    connection = sqlite3.connect(database, isolation_level=None)
+    yield connection
+    connection.close()
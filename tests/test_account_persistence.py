@@ -0,0 +1,65 @@
+import sqlite3
+import time
+
+import pytest
+
+from ATM import ATM
+from AccountPersistence import AccountPersistence
+
+
+def balance_in_database(database, account_number):
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute("SELECT balance FROM accounts WHERE account_number = ?",
+                                  (account_number,)).fetchone()[0]
+    finally:
+        connection.close()
+
+
+def wait_for(condition, seconds=5.0):
+    deadline = time.time() + seconds
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_failed_flush_keeps_the_changes_dirty(database, monkeypatch):
+    atm = ATM(database)
+    persistence = AccountPersistence(database, AccountPersistence.WRITE_BEHIND, flush_interval=0.02)
+    atm.add_listener(persistence)
+    update = persistence.__update__
+
+    def locked(database, changes):
+        raise sqlite3.OperationalError("database is locked")
+    try:
+        monkeypatch.setattr(persistence, "__update__", locked)
+        atm.withdraw(atm.load_account("2050"), 100)
+        wait_for(lambda: persistence.get_metrics()["flush_errors"] >= 2)
+        atm.withdraw(atm.load_account("2050"), 50)
+        assert persistence.is_dirty("10001")
+        assert balance_in_database(database, "10001") == 10000
+        monkeypatch.setattr(persistence, "__update__", update)
+        wait_for(lambda: not persistence.is_dirty("10001"))
+        assert balance_in_database(database, "10001") == 9850
+    finally:
+        atm.close()
+
+
+def test_flush_waits_for_a_database_held_by_another_process(database):
+    atm = ATM(database)
+    persistence = AccountPersistence(database, AccountPersistence.WRITE_BEHIND, flush_interval=3600)
+    atm.add_listener(persistence)
+    other = sqlite3.connect(database, isolation_level=None, timeout=0)
+    try:
+        atm.deposit(atm.load_account("2050"), 500)
+        other.execute("BEGIN IMMEDIATE")
+        persistence.__database__.sql_statement(persistence.__database__.UPDATE, "PRAGMA busy_timeout = 0")
+        with pytest.raises(sqlite3.OperationalError):
+            persistence.flush()
+        assert persistence.is_dirty("10001")
+        other.execute("ROLLBACK")
+        persistence.flush()
+        assert balance_in_database(database, "10001") == 10500
+    finally:
+        other.close()
+        atm.close()
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+
+import pytest
+
+from ATM import ATM
+from AccountPersistence import AccountPersistence
+from AccountRefresher import AccountRefresher
+from RecordsLoader import RecordsLoader
+
+
+def balance_in_database(database, account_number):
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute("SELECT balance FROM accounts WHERE account_number = ?",
+                                  (account_number,)).fetchone()[0]
+    finally:
+        connection.close()
+
+
+def create_atm(database, mode=AccountPersistence.WRITE_THROUGH, loading_mode=RecordsLoader.EAGER):
+    refresher = AccountRefresher(database, refresh_interval=None)
+    atm = ATM(database, loading_mode, refresher=refresher)
+    persistence = AccountPersistence(database, mode, flush_interval=3600, origin=refresher.get_origin())
+    atm.add_listener(persistence)
+    return atm, refresher, persistence
+
+
+def test_foreign_changes_are_applied(database, foreign):
+    atm, refresher, _ = create_atm(database)
+    try:
+        foreign.execute("UPDATE accounts SET first_name = 'Dave', balance = 12000 WHERE pin = '2050'")
+        foreign.execute("INSERT INTO accounts VALUES ('10008', 'Anna', 'Novak', 700, '4321')")
+        assert refresher.refresh() == 2
+        assert atm.load_account("2050").get_first_name() == "Dave"
+        assert atm.load_account("2050").get_balance() == 12000
+        assert atm.load_account("4321").get_balance() == 700
+        assert refresher.get_metrics()["full_refreshes"] == 0
+    finally:
+        atm.close()
+
+
+def test_own_changes_are_skipped(database):
+    atm, refresher, _ = create_atm(database)
+    try:
+        atm.withdraw(atm.load_account("2050"), 500)
+        assert refresher.refresh() == 0
+        assert atm.load_account("2050").get_balance() == 9500
+    finally:
+        atm.close()
+
+
+def test_stale_row_does_not_undo_a_local_withdrawal(database, foreign):
+    atm, refresher, _ = create_atm(database)
+    try:
+        foreign.execute("UPDATE accounts SET first_name = 'Dave' WHERE pin = '2050'")
+        stale = ("10001", "Dave", "Chen", 10000)  # read by the refresher before the withdrawal below committed
+        atm.withdraw(atm.load_account("2050"), 500)
+        read = lambda pins: {"2050": ("10001", "Dave", "Chen", balance_in_database(database, "10001"))}
+        assert atm.refresh_accounts([("2050", stale)], read) == []
+        assert atm.load_account("2050").get_first_name() == "Dave"
+        assert atm.load_account("2050").get_balance() == 9500
+        assert balance_in_database(database, "10001") == 9500
+    finally:
+        atm.close()
+
+
+def test_unflushed_balance_is_kept_until_flushed(database, foreign):
+    atm, refresher, persistence = create_atm(database, AccountPersistence.WRITE_BEHIND)
+    try:
+        atm.withdraw(atm.load_account("2050"), 500)
+        foreign.execute("UPDATE accounts SET first_name = 'Dave' WHERE pin = '2050'")
+        refresher.refresh()
+        assert atm.load_account("2050").get_balance() == 9500
+        assert atm.load_account("2050").get_first_name() == "David"
+        persistence.flush()
+        refresher.refresh()
+        assert atm.load_account("2050").get_balance() == 9500
+        assert atm.load_account("2050").get_first_name() == "Dave"
+    finally:
+        atm.close()
+
+
+def test_falling_behind_the_log_refreshes_every_account(database, foreign):
+    atm, refresher, _ = create_atm(database)
+    try:
+        foreign.execute("UPDATE accounts SET balance = balance + 1")
+        foreign.execute("DELETE FROM account_changes")
+        refresher.refresh()
+        assert refresher.get_metrics()["full_refreshes"] == 1
+        assert atm.load_account("2050").get_balance() == 10001
+    finally:
+        atm.close()
+
+
+@pytest.mark.parametrize("mode", [AccountPersistence.WRITE_THROUGH, AccountPersistence.WRITE_BEHIND])
+def test_foreign_change_before_the_poll_is_kept(database, foreign, mode):
+    atm, refresher, persistence = create_atm(database, mode)
+    try:
+        foreign.execute("UPDATE accounts SET balance = balance + 1000 WHERE account_number = '10001'")
+        assert atm.withdraw(atm.load_account("2050"), 100) == 100
+        persistence.flush()
+        assert balance_in_database(database, "10001") == 10900
+        refresher.refresh()
+        assert atm.load_account("2050").get_balance() == 10900
+    finally:
+        atm.close()
+    assert balance_in_database(database, "10001") == 10900
+
+
+LOADING_MODES = [RecordsLoader.EAGER, RecordsLoader.LAZY, RecordsLoader.COMPACT]
+
+
+@pytest.mark.parametrize("loading_mode", LOADING_MODES)
+@pytest.mark.parametrize("full_refresh", [False, True])
+def test_deleted_account_is_unusable(database, foreign, loading_mode, full_refresh):
+    atm, refresher, _ = create_atm(database, loading_mode=loading_mode)
+    try:
+        held = atm.load_account("2050")
+        foreign.execute("DELETE FROM accounts WHERE account_number = '10001'")
+        if full_refresh:
+            foreign.execute("DELETE FROM account_changes")
+        refresher.refresh()
+        assert not atm.validate_pin("2050")
+        assert atm.load_account("2050") is None
+        assert atm.withdraw(held, 100) == 0
+        assert not atm.deposit(held, 100)
+        assert atm.transfer("10001", "10002", 100) is False
+        assert held.get_balance() == 10000
+    finally:
+        atm.close()
+
+
+@pytest.mark.parametrize("loading_mode", LOADING_MODES)
+def test_changed_pin_keeps_the_account_usable(database, foreign, loading_mode):
+    atm, refresher, _ = create_atm(database, loading_mode=loading_mode)
+    try:
+        atm.load_account("2050")
+        foreign.execute("UPDATE accounts SET pin = '1111' WHERE account_number = '10001'")
+        refresher.refresh()
+        assert atm.load_account("2050") is None
+        account = atm.load_account("1111")
+        assert atm.withdraw(account, 100) == 100
+        assert atm.transfer("10001", "10002", 100)
+        assert balance_in_database(database, "10001") == 9800
+    finally:
+        atm.close()
+
+
+def test_refresher_creates_the_database(tmp_path):
+    database = str(tmp_path / "accounts.db")
+    refresher = AccountRefresher(database, refresh_interval=None)
+    atm = ATM(database, refresher=refresher)
+    try:
+        assert os.path.exists(database)
+        assert atm.validate_pin("2050")
+    finally:
+        atm.close()
@@ -0,0 +1,42 @@
+import datetime
+
+from ATM import ATM
+from ATMSession import ATMSession
+from TransactionHistory import TransactionHistory
+
+
+def run_session(atm, answers):
+    session = ATMSession(atm)
+    lines = session.start()
+    for answer in answers:
+        lines += session.feed(answer)
+    assert session.is_finished()
+    return lines
+
+
+def test_statement_by_date_range(database):
+    atm = ATM(database, history=TransactionHistory(database))
+    today = datetime.date.today()
+    try:
+        lines = run_session(atm, ["2050", "2", "500", "y", "1", "200", "y",
+                                  "6", str(today - datetime.timedelta(days=1)), str(today), "y",
+                                  "6", str(today + datetime.timedelta(days=1)), str(today + datetime.timedelta(days=2)),
+                                  "n"])
+    finally:
+        atm.close()
+    assert "Press 6 for statement by date range" in lines
+    statements = [line for line in lines if line.startswith(today.isoformat())]
+    assert len(statements) == 2
+    assert "deposit" in statements[0] and "Balance: $10500" in statements[0]
+    assert "withdraw" in statements[1] and "Balance: $10300" in statements[1]
+    assert lines.count("No transactions") == 1
+
+
+def test_invalid_date_returns_to_the_continue_prompt(database):
+    atm = ATM(database, history=TransactionHistory(database))
+    try:
+        lines = run_session(atm, ["2050", "6", "2024-02-30", "y", "6", "2024-01-01", "soon", "n"])
+    finally:
+        atm.close()
+    assert lines.count("Invalid date\n") == 2
+    assert lines[-1] == ATMSession.GOODBYE
@@ -0,0 +1,93 @@
+import csv
+import sqlite3
+import struct
+
+import pytest
+
+from BatchProcessor import BatchProcessor
+
+
+def balance_in_database(database, account_number):
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute("SELECT balance FROM accounts WHERE account_number = ?",
+                                  (account_number,)).fetchone()[0]
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def processor(database):
+    processor = BatchProcessor(database, chunk_size=3)
+    yield processor
+    processor.close()
+
+
+def read_rejected(rejected_file):
+    with open(rejected_file, newline="") as source:
+        return [row[-1] for row in csv.reader(source)]
+
+
+def test_csv_records_are_applied_and_rejected(database, processor, tmp_path):
+    transactions_file = str(tmp_path / "settlement.csv")
+    with open(transactions_file, "w") as destination:
+        destination.write("account_number,type,amount\n10001,deposit,500\n\n10001,withdraw,20000\n"
+                          "10002,Withdraw,1000\n10002,refund,5\n10003,deposit,-5\n10003,deposit,ten\n"
+                          "99999,deposit,5\n10004,deposit\n   \n")
+    rejected_file = str(tmp_path / "rejected.csv")
+    report = processor.process(transactions_file, BatchProcessor.CSV, rejected_file)
+    assert report["applied"] == 2
+    assert report["rejected"] == 6
+    assert sorted(read_rejected(rejected_file)) == ["insufficient funds", "invalid amount", "malformed record",
+                                                    "malformed record", "unknown account", "unknown transaction type"]
+    assert balance_in_database(database, "10001") == 10500
+    assert balance_in_database(database, "10002") == 9000
+    assert balance_in_database(database, "10003") == 120000
+
+
+def test_binary_records_are_applied(database, processor, tmp_path):
+    transactions_file = str(tmp_path / "settlement.bin")
+    BatchProcessor.write_binary(transactions_file, [("10005", "deposit", 50), ("10005", "withdraw", 300),
+                                                    ("10006", "withdraw", 20)])
+    assert list(BatchProcessor.read_binary(transactions_file, buffer_records=2)) == [
+        ("10005", "deposit", 50), ("10005", "withdraw", 300), ("10006", "withdraw", 20)]
+    report = processor.process(transactions_file, BatchProcessor.BINARY)
+    assert (report["applied"], report["rejected"]) == (3, 0)
+    assert balance_in_database(database, "10005") == 0
+    assert balance_in_database(database, "10006") == 0
+
+
+def test_truncated_binary_record_is_rejected(database, processor, tmp_path):
+    transactions_file = str(tmp_path / "settlement.bin")
+    BatchProcessor.write_binary(transactions_file, [("10005", "deposit", 50), ("10006", "deposit", 50)])
+    with open(transactions_file, "r+b") as destination:
+        destination.truncate(struct.calcsize(BatchProcessor.RECORD_FORMAT) + 10)
+    rejected_file = str(tmp_path / "rejected.csv")
+    report = processor.process(transactions_file, BatchProcessor.BINARY, rejected_file)
+    assert (report["applied"], report["rejected"]) == (1, 1)
+    assert read_rejected(rejected_file) == ["malformed record"]
+    assert balance_in_database(database, "10006") == 20
+
+
+def test_accounts_are_read_under_the_write_lock(database, processor, tmp_path, monkeypatch):
+    transactions_file = str(tmp_path / "settlement.csv")
+    with open(transactions_file, "w") as destination:
+        destination.write("10001,withdraw,100\n")
+    load_accounts = processor.__load_accounts__
+    foreign = sqlite3.connect(database, isolation_level=None, timeout=0)
+    attempts = []
+
+    def load_then_write(account_numbers):
+        accounts = load_accounts(account_numbers)
+        try:
+            foreign.execute("UPDATE accounts SET balance = balance + 1000 WHERE account_number = '10001'")
+        except sqlite3.OperationalError as error:
+            attempts.append(str(error))
+        return accounts
+    monkeypatch.setattr(processor, "__load_accounts__", load_then_write)
+    try:
+        processor.process(transactions_file)
+    finally:
+        foreign.close()
+    assert attempts == ["database is locked"]
+    assert balance_in_database(database, "10001") == 9900
@@ -0,0 +1,46 @@
+import itertools
+import random
+
+from CashDispenser import CashDispenser
+
+
+def brute_force(cassettes, amount):
+    """Combination with as many large notes as possible, by trying every combination."""
+    denominations = sorted(cassettes, reverse=True)
+    for counts in itertools.product(*(range(cassettes[value], -1, -1) for value in denominations)):
+        if sum(count * value for count, value in zip(counts, denominations)) == amount:
+            return {value: count for value, count in zip(denominations, counts) if count}
+    return None
+
+
+def test_dispense_takes_the_notes():
+    dispenser = CashDispenser({100: 1, 50: 1, 20: 3})
+    assert dispenser.dispense(60) == {20: 3}
+    assert dispenser.get_cassettes() == {100: 1, 50: 1, 20: 0}
+    assert dispenser.dispense(70) is None
+    assert dispenser.get_total() == 150
+    dispenser.restore({20: 3})
+    assert dispenser.dispense(170) == {100: 1, 50: 1, 20: 1}
+
+
+def test_solver_matches_brute_force_as_the_counts_change():
+    generator = random.Random(0)
+    dispenser = CashDispenser({50: 3, 20: 4, 10: 2})
+    for _ in range(200):
+        if generator.random() < 0.3:
+            dispenser.load(generator.choice((100, 50, 20, 10)), generator.randrange(3))
+        else:
+            dispenser.dispense(generator.randrange(0, 400, 10))
+        cassettes = dispenser.get_cassettes()
+        for amount in range(0, 300, 10):
+            assert dispenser.solve(amount) == brute_force(cassettes, amount)
+
+
+def test_tables_are_hit_while_the_cassettes_are_stocked():
+    generator = random.Random(0)
+    dispenser = CashDispenser({100: 10000, 50: 10000, 20: 10000})
+    for _ in range(2000):
+        assert dispenser.dispense(generator.randrange(1, 50) * 20) is not None
+    statistics = dispenser.get_statistics()
+    assert statistics["hits"] > 10 * statistics["misses"]
+    assert statistics["discarded"] < statistics["misses"]
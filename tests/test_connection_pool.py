@@ -0,0 +1,49 @@
+import pytest
+
+from ConnectionPool import ConnectionPool
+
+
+def test_connections_are_reused(database):
+    pool = ConnectionPool(database, size=2)
+    try:
+        with pool.reader() as database_connection:
+            assert database_connection.fetch_value("SELECT balance FROM accounts WHERE account_number = ?",
+                                                   ("10001",)) == 10000
+        with pool.writer() as database_connection:
+            database_connection.execute("UPDATE accounts SET balance = 1 WHERE account_number = ?", ("10001",))
+            database_connection.commit()
+        statistics = pool.statistics()
+        assert statistics["checkouts"] == 2
+        assert statistics["readers_in_use"] == statistics["writers_in_use"] == 0
+    finally:
+        pool.close()
+
+
+def test_failed_replacement_gives_the_slot_back(database, monkeypatch):
+    pool = ConnectionPool(database, size=1, health_check_interval=0.0)
+    try:
+        connection = pool.checkout()
+        connection.close()  # broken while checked out
+        pool.checkin(connection)
+
+        def unavailable(write):
+            raise Exception("The database is unavailable")
+        connect = pool.__connect__
+        monkeypatch.setattr(pool, "__connect__", unavailable)
+        with pytest.raises(Exception, match="unavailable"):
+            pool.checkout(timeout=0.1)
+        assert pool.statistics()["readers_in_use"] == 0
+        monkeypatch.setattr(pool, "__connect__", connect)
+        with pool.reader(timeout=0.1) as database_connection:
+            assert database_connection.fetch_value("SELECT 1") == 1
+    finally:
+        pool.close()
+
+
+def test_connections_given_back_after_close_are_closed(database):
+    pool = ConnectionPool(database, size=1)
+    connection = pool.checkout()
+    pool.close()
+    pool.checkin(connection)
+    with pytest.raises(Exception):
+        connection.fetch_value("SELECT 1")
@@ -0,0 +1,60 @@
+from ATM import ATM
+from FraudRules import FraudRules
+
+DAY = 86400
+START = 1000000 * DAY
+
+
+def daily_cap(limit=100, **settings):
+    return FraudRules([{"name": "daily-cap", "type": "amount", "window": DAY, "limit": limit},
+                       {"name": "unusual", "type": "unusual", "factor": 10, "min_history": 2}], **settings)
+
+
+def test_limits_apply_within_the_window():
+    rules = daily_cap()
+    assert rules.evaluate("10001", 60, START) is None
+    rules.record("10001", 60, START)
+    assert rules.evaluate("10001", 50, START + 60) == "daily-cap"
+    assert rules.evaluate("10001", 40, START + 60) is None
+    assert rules.evaluate("10001", 100, START + DAY + DAY / 24) is None
+    assert rules.get_hits()["daily-cap"] == 1
+
+
+def test_evicted_accounts_keep_their_limits():
+    rules = daily_cap(max_accounts=2)
+    rules.record("10001", 100, START)
+    for account_number in ("10002", "10003", "10004"):
+        rules.record(account_number, 1, START + 10)
+    assert rules.evaluate("10001", 100, START + 20) == "daily-cap"
+    assert rules.evaluate("10001", 1, START + 20) == "daily-cap"
+    assert rules.evaluate("10001", 100, START + DAY + DAY / 24) is None
+
+
+def test_evicted_accounts_keep_their_average():
+    rules = daily_cap(limit=10 ** 9, max_accounts=1)
+    for day in range(3):
+        rules.record("10001", 10, START + day * DAY)
+    for account_number in ("10002", "10003"):
+        rules.record(account_number, 1, START + 10 * DAY)
+    assert rules.evaluate("10001", 150, START + 10 * DAY) == "unusual"
+    assert rules.evaluate("10001", 90, START + 10 * DAY) is None
+
+
+def test_averages_of_evicted_accounts_are_bounded():
+    rules = daily_cap(max_accounts=2)
+    for position in range(10):
+        rules.record(str(position), 10, START + position)
+    rules.record("new", 10, START + 3 * DAY)
+    assert len(rules.__states__) + len(rules.__summaries__) + len(rules.__averages__) <= 4
+    assert list(rules.__averages__) == ["7", "8"]
+
+
+def test_transfers_count_against_the_limits(database):
+    atm = ATM(database, rules=daily_cap(limit=1000))
+    try:
+        assert atm.transfer_batch((("10001", "10002", 600), ("10001", "10003", 600), ("10002", "10001", 600))) == \
+            [True, False, True]
+        assert atm.withdraw(atm.load_account("2050"), 500) == 0
+        assert atm.withdraw(atm.load_account("2050"), 400) == 400
+    finally:
+        atm.close()
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from DatabaseConnection import DatabaseConnection
+from Instrumentation import Instrumentation
+
+
+@pytest.fixture
+def instrumentation():
+    instrumentation = Instrumentation()
+    instrumentation.instrument()
+    yield instrumentation
+    instrumentation.close()
+
+
+def test_fetch_all_and_fetch_iter_are_measured(database, instrumentation):
+    connection = DatabaseConnection(database)
+    try:
+        assert len(connection.fetch_all("SELECT * FROM accounts")) == 7
+        rows = connection.fetch_iter("SELECT * FROM accounts", fetch_size=2)
+        next(rows)
+        time.sleep(0.05)  # spent by the caller, not by the query
+        rows.close()
+    finally:
+        connection.close()
+    operations = instrumentation.snapshot()["operations"]
+    assert operations["DatabaseConnection.fetch_all"]["calls"] == 1
+    assert operations["DatabaseConnection.fetch_iter"]["calls"] == 2
+    assert operations["DatabaseConnection.fetch_iter"]["errors"] == 0
+    assert operations["DatabaseConnection.fetch_iter"]["seconds_total"] < 0.05
+
+
+def test_failed_fetch_iter_is_counted_as_an_error(database, instrumentation):
+    connection = DatabaseConnection(database)
+    try:
+        with pytest.raises(Exception):
+            list(connection.fetch_iter("SELECT * FROM missing"))
+    finally:
+        connection.close()
+    assert instrumentation.snapshot()["operations"]["DatabaseConnection.fetch_iter"]["errors"] == 1
+
+
+def test_uninstrument_restores_fetch_iter(instrumentation):
+    instrumentation.uninstrument()
+    assert DatabaseConnection.__dict__["fetch_iter"].__name__ == "fetch_iter"
+    assert "__wrapped__" not in DatabaseConnection.__dict__["fetch_iter"].__dict__
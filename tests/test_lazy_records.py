@@ -0,0 +1,29 @@
+import gc
+
+from ATM import ATM
+from RecordsLoader import RecordsLoader
+
+
+def test_accounts_held_by_a_session_survive_eviction(database):
+    atm = ATM(database, RecordsLoader.LAZY, cache_size=1)
+    try:
+        held = atm.load_account("2050")
+        atm.load_account("9014")  # evicts the account held above from the cache
+        assert atm.load_account("2050") is held
+        assert atm.find_account("10001") is held
+        assert atm.withdraw(held, 6000) == 6000
+        assert atm.withdraw(atm.load_account("2050"), 6000) == 0
+    finally:
+        atm.close()
+
+
+def test_accounts_no_longer_held_are_read_again(database):
+    atm = ATM(database, RecordsLoader.LAZY, cache_size=1)
+    try:
+        atm.load_account("2050")
+        atm.load_account("9014")
+        gc.collect()
+        assert atm.__memory__.cached("2050") is None
+        assert atm.load_account("2050").get_balance() == 10000
+    finally:
+        atm.close()
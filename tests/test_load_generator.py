@@ -0,0 +1,48 @@
+import asyncio
+
+from ATM import ATM
+from ATMServer import ATMServer
+from LoadGenerator import LoadGenerator
+from PinAuthenticator import PinAuthenticator
+
+
+def test_sessions_leave_the_balances_unchanged(database, foreign, tmp_path):
+    foreign.execute("UPDATE accounts SET balance = 3 WHERE pin = '1022'")  # most withdrawals are declined
+    atm = ATM(database)
+    server = ATMServer(atm, workers=4)
+    path = str(tmp_path / "atm.sock")
+
+    async def run():
+        listener = await server.start(path=path)
+        async with listener:
+            return await LoadGenerator(["1022", "2050"], sessions=40, concurrency=8, transactions=4).run(path=path)
+    try:
+        report = asyncio.run(run())
+    finally:
+        server.close()
+    assert report["failures"] == 0
+    assert atm.load_account("1022").get_balance() == 3
+    assert atm.load_account("2050").get_balance() == 10000
+    atm.close()
+
+
+def test_sessions_log_in_with_cards(database, tmp_path):
+    enrollment = PinAuthenticator(database, iterations=1000)
+    enrollment.enroll()
+    enrollment.close()
+    atm = ATM(database, authenticator=PinAuthenticator(database))
+    server = ATMServer(atm, workers=4)
+    path = str(tmp_path / "atm.sock")
+
+    async def run():
+        listener = await server.start(path=path)
+        async with listener:
+            return await LoadGenerator(["2050", "9014"], sessions=10, concurrency=4, transactions=2,
+                                       cards=["10001", "10002"]).run(path=path)
+    try:
+        report = asyncio.run(run())
+    finally:
+        server.close()
+    assert report["failures"] == 0
+    assert atm.remaining_attempts("10001") == 3
+    atm.close()
@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+
+import pytest
+
+from ATM import ATM
+from DatabaseScript import DatabaseScript
+from PinAuthenticator import PinAuthenticator
+
+
+@pytest.fixture
+def authenticator(database):
+    authenticator = PinAuthenticator(database, iterations=1000)
+    authenticator.enroll()
+    yield authenticator
+    authenticator.close()
+
+
+def count_hashes(authenticator):
+    hashes = []
+    original = authenticator.__pin_hash__
+
+    def pin_hash(pin, salt, iterations):
+        hashes.append(pin)
+        return original(pin, salt, iterations)
+    authenticator.__pin_hash__ = pin_hash
+    return hashes
+
+
+def test_correct_pin_is_granted_and_resets_the_failures(authenticator):
+    assert authenticator.authenticate("10001", "0000") == PinAuthenticator.DENIED
+    assert authenticator.remaining_attempts("10001") == 2
+    assert authenticator.authenticate("10001", "2050") == PinAuthenticator.GRANTED
+    assert authenticator.remaining_attempts("10001") == 3
+
+
+def test_card_is_locked_after_max_attempts(authenticator):
+    assert authenticator.authenticate("10001", "0000") == PinAuthenticator.DENIED
+    assert authenticator.authenticate("10001", "0001") == PinAuthenticator.DENIED
+    assert authenticator.authenticate("10001", "0002") == PinAuthenticator.LOCKED
+    hashes = count_hashes(authenticator)
+    assert authenticator.authenticate("10001", "2050") == PinAuthenticator.LOCKED
+    assert hashes == []
+    assert authenticator.remaining_attempts("10001") == 0
+
+
+def test_unknown_cards_are_throttled(authenticator):
+    for _ in range(2):
+        assert authenticator.authenticate("99999", "2050") == PinAuthenticator.DENIED
+    assert authenticator.authenticate("99999", "2050") == PinAuthenticator.LOCKED
+
+
+def test_concurrent_guesses_cannot_exceed_max_attempts(authenticator):
+    hashes = count_hashes(authenticator)
+    barrier = threading.Barrier(10)
+
+    def guess(pin):
+        barrier.wait()
+        authenticator.authenticate("10002", pin)
+    threads = [threading.Thread(target=guess, args=("{:04}".format(pin),)) for pin in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(hashes) <= 3
+    assert authenticator.remaining_attempts("10002") == 0
+
+
+def test_correct_pin_in_flight_is_refused_once_the_card_locks(database, authenticator):
+    other = PinAuthenticator(database, iterations=1000)
+    original = authenticator.__pin_hash__
+
+    def pin_hash(pin, salt, iterations):  # another process makes the remaining guesses while the pin is hashed
+        assert other.authenticate("10001", "0000") == PinAuthenticator.DENIED
+        assert other.authenticate("10001", "0001") == PinAuthenticator.LOCKED
+        return original(pin, salt, iterations)
+    authenticator.__pin_hash__ = pin_hash
+    try:
+        assert authenticator.authenticate("10001", "2050") == PinAuthenticator.LOCKED
+    finally:
+        other.close()
+
+
+def test_enroll_clears_the_plaintext_pins(database, authenticator):
+    connection = sqlite3.connect(database)
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM accounts WHERE pin IS NOT NULL").fetchone()[0] == 0
+        assert connection.execute("SELECT COUNT(*) FROM credentials").fetchone()[0] == 7
+    finally:
+        connection.close()
+    assert authenticator.enroll() == 0
+
+
+def test_enrolled_accounts_are_only_reached_with_their_card(database, authenticator):
+    atm = ATM(database, authenticator=PinAuthenticator(database, iterations=1000))
+    try:
+        assert not atm.validate_pin("2050")
+        assert not atm.validate_pin(DatabaseScript.CARD_KEY_PREFIX + "10001")
+        assert atm.authenticate("10001", "2050") == PinAuthenticator.GRANTED
+        assert atm.find_account("10001").get_balance() == 10000
+    finally:
+        atm.close()
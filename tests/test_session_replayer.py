@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+from ATM import ATM
+from DatabaseScript import DatabaseScript
+from PinAuthenticator import PinAuthenticator
+from SessionReplayer import SessionReplayer
+
+SOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_sessions_are_replayed_with_cards(database):
+    enrollment = PinAuthenticator(database, iterations=1000)
+    enrollment.enroll()
+    enrollment.close()
+    atm = ATM(database, authenticator=PinAuthenticator(database))
+    try:
+        transcript = SessionReplayer(atm).replay(["10001", "2050", "1", "500", "n"])
+        assert transcript[-1] == "Goodbye..."
+        assert atm.find_account("10001").get_balance() == 9500
+    finally:
+        atm.close()
+
+
+def test_replayer_logs_in_to_the_database_of_the_interface(tmp_path):
+    subprocess.run([sys.executable, os.path.join(SOURCES, "Interface.py")], cwd=str(tmp_path),
+                   input="10001\n2050\n3\nn\n", text=True, capture_output=True, check=True)
+    script_file = str(tmp_path / "sessions.txt")
+    with open(script_file, "w") as destination:
+        destination.write("10002\n9014\n3\nn\n")
+    result = subprocess.run([sys.executable, os.path.join(SOURCES, "SessionReplayer.py"), script_file, "--cards",
+                             "--transcripts", str(tmp_path / "transcripts.txt")], cwd=str(tmp_path),
+                            capture_output=True, text=True, check=True)
+    assert "sessions: 1" in result.stdout
+    with open(str(tmp_path / "transcripts.txt")) as source:
+        transcripts = source.read()
+    assert "That pin is invalid" not in transcripts and "Rico" in transcripts
+
+
+def test_interface_enrolls_a_database_created_before_the_cards(tmp_path):
+    DatabaseScript.load_database(str(tmp_path / "accounts.db"))
+    result = subprocess.run([sys.executable, os.path.join(SOURCES, "Interface.py")], cwd=str(tmp_path),
+                            input="10001\n2050\n3\nn\n", text=True, capture_output=True, check=True)
+    assert "That pin is invalid" not in result.stdout
+    assert "David" in result.stdout
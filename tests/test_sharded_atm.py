@@ -0,0 +1,120 @@
+import sqlite3
+
+import pytest
+
+from ATMSession import ATMSession
+from ShardWorker import ShardWorker
+from ShardedATM import ShardedATM
+
+
+def balance_in_database(database, account_number):
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute("SELECT balance FROM accounts WHERE account_number = ?",
+                                  (account_number,)).fetchone()[0]
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def shard_files(database):
+    shard_files = ShardedATM.partition_database(database, 2)
+    assert ShardedATM.shard_of("10001", 2) == 1 and ShardedATM.shard_of("10004", 2) == 0
+    return shard_files
+
+
+def test_prepared_debit_is_held_until_committed(shard_files):
+    worker = ShardWorker(shard_files[1])
+    try:
+        assert not worker.prepare("t1", "10001", -20000)
+        assert worker.prepare("t1", "10001", -4000)
+        assert worker.load_account("2050")[3] == 6000
+        assert worker.withdraw("10001", 7000) == (0, 6000)
+    finally:
+        worker.close()
+    assert balance_in_database(shard_files[1], "10001") == 6000
+    worker = ShardWorker(shard_files[1])  # as restarted after a crash
+    try:
+        assert worker.prepared() == ["t1"]
+        worker.commit("t1")
+        assert worker.prepared() == []
+        assert worker.load_account("2050")[3] == 6000
+    finally:
+        worker.close()
+
+
+def test_aborted_debit_is_given_back_and_credit_only_added_on_commit(shard_files):
+    worker = ShardWorker(shard_files[1])
+    try:
+        worker.prepare("debit", "10001", -4000)
+        worker.prepare("credit", "10002", 500)
+        assert worker.load_account("9014")[3] == 10000
+        worker.abort("debit")
+        worker.commit("credit")
+        worker.commit("credit")  # resolving twice is ignored
+        assert worker.load_account("2050")[3] == 10000
+        assert worker.load_account("9014")[3] == 10500
+    finally:
+        worker.close()
+    assert balance_in_database(shard_files[1], "10002") == 10500
+
+
+def test_transfers_within_and_between_shards(shard_files, tmp_path):
+    atm = ShardedATM(shard_files, str(tmp_path / "coordinator.db"))
+    try:
+        assert atm.transfer("10001", "10002", 1000)
+        assert atm.transfer("10003", "10004", 20000)
+        assert not atm.transfer("10006", "10001", 21)
+        assert not atm.transfer("10004", "10001", 0)
+        assert atm.load_account("2050").get_balance() == 9000
+        assert atm.load_account("5572").get_balance() == 100000
+        assert atm.load_account("9393").get_balance() == 29000
+        assert atm.load_account("1022").get_balance() == 20
+    finally:
+        atm.close()
+    assert balance_in_database(shard_files[0], "10004") == 29000
+    assert balance_in_database(shard_files[1], "10003") == 100000
+
+
+@pytest.mark.parametrize("decided", [False, True])
+def test_transfer_in_doubt_is_resolved_from_the_coordinator_log(shard_files, tmp_path, decided):
+    coordinator_file = str(tmp_path / "coordinator.db")
+    for shard_file, account_number, amount in ((shard_files[1], "10003", -20000), (shard_files[0], "10004", 20000)):
+        worker = ShardWorker(shard_file)
+        try:
+            assert worker.prepare("in-doubt", account_number, amount)
+        finally:
+            worker.close()
+    if decided:  # the router crashed after logging the decision, before committing both halves
+        connection = sqlite3.connect(coordinator_file)
+        connection.execute("CREATE TABLE transfer_decisions (id TEXT PRIMARY KEY)")
+        connection.execute("INSERT INTO transfer_decisions (id) VALUES ('in-doubt')")
+        connection.commit()
+        connection.close()
+    atm = ShardedATM(shard_files, coordinator_file)
+    try:
+        assert atm.load_account("5572").get_balance() == (100000 if decided else 120000)
+        assert atm.load_account("9393").get_balance() == (29000 if decided else 9000)
+    finally:
+        atm.close()
+    for shard_file in shard_files:
+        connection = sqlite3.connect(shard_file)
+        assert connection.execute("SELECT COUNT(*) FROM prepared_transfers").fetchone()[0] == 0
+        connection.close()
+
+
+def test_transfers_with_unknown_accounts_fail_on_their_own(shard_files, tmp_path):
+    atm = ShardedATM(shard_files, str(tmp_path / "coordinator.db"))
+    try:
+        assert ShardedATM.shard_of("99999", 2) == 0 and ShardedATM.shard_of("10008", 2) == 1
+        assert atm.transfer_batch([("10001", "99999", 100), ("10001", "10008", 100), ("99999", "10001", 100),
+                                   ("10001", "10004", 100)]) == [False, False, False, True]
+        assert atm.load_account("2050").get_balance() == 9900
+        assert atm.load_account("9393").get_balance() == 9100
+        session = ATMSession(atm)
+        session.start()
+        for line in ("2050", "5", "1O004"):
+            session.feed(line)
+        assert "Transfer failed\n" in session.feed("100")
+    finally:
+        atm.close()
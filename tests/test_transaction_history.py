@@ -0,0 +1,30 @@
+import sqlite3
+import time
+
+from TransactionHistory import TransactionHistory
+
+
+def wait_for(condition, seconds=5.0):
+    deadline = time.time() + seconds
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_failed_flush_keeps_the_transactions_pending(database, monkeypatch):
+    history = TransactionHistory(database, flush_interval=0.02)
+    insert = history.__insert__
+
+    def locked(database, pending):
+        raise sqlite3.OperationalError("database is locked")
+    try:
+        monkeypatch.setattr(history, "__insert__", locked)
+        history.record("10001", "deposit", 500, 10500, timestamp=1.0)
+        wait_for(lambda: history.get_metrics()["flush_errors"] >= 2)
+        history.record("10001", "withdraw", 200, 10300, timestamp=2.0)
+        assert history.get_metrics()["pending_transactions"] == 2
+        monkeypatch.setattr(history, "__insert__", insert)
+        wait_for(lambda: history.get_metrics()["pending_transactions"] == 0)
+        assert history.between("10001", 0, 10) == [(1.0, "deposit", 500, 10500), (2.0, "withdraw", 200, 10300)]
+    finally:
+        history.close()
@@ -0,0 +1,76 @@
+import os
+
+from ATM import ATM
+from BankAccount import BankAccount
+from TransactionJournal import TransactionJournal
+
+
+def accounts():
+    return {"2050": BankAccount("10001", "David", "Chen", 10000), "9014": BankAccount("10002", "Rico", "Felix", 500)}
+
+
+def test_records_are_replayed_on_top_of_the_snapshot(tmp_path):
+    path = str(tmp_path / "accounts")
+    journal = TransactionJournal(path)
+    records = journal.recover(accounts)
+    assert os.path.exists(path + ".snapshot")
+    journal.append("10001", BankAccount.WITHDRAW, 100, 9900)
+    journal.append_many((("10001", BankAccount.TRANSFER_OUT, 400, 9500), ("10002", BankAccount.TRANSFER_IN, 400, 900)))
+    journal.close()
+
+    journal = TransactionJournal(path)
+    records = journal.recover(lambda: {})
+    journal.close()
+    assert records["2050"].get_balance() == 9500
+    assert records["9014"].get_balance() == 900
+    assert records["9014"].get_first_name() == "Rico"
+
+
+def test_snapshot_discards_the_records_it_covers(tmp_path):
+    path = str(tmp_path / "accounts")
+    journal = TransactionJournal(path, durable=False, sync_interval=60)
+    records = journal.recover(accounts)
+    sequence = journal.append("10001", BankAccount.DEPOSIT, 100, 10100)  # still buffered when the journal rotates
+    records["2050"].set_balance(10100)
+    assert journal.snapshot(records.items()) == sequence
+    assert not os.path.exists(path + ".journal.prev")
+    assert os.path.getsize(path + ".journal") == 0
+    journal.close()
+
+    journal = TransactionJournal(path)
+    records = journal.recover(lambda: {})
+    journal.close()
+    assert records["2050"].get_balance() == 10100
+
+
+def test_torn_record_ends_the_journal(tmp_path):
+    path = str(tmp_path / "accounts")
+    journal = TransactionJournal(path)
+    journal.recover(accounts)
+    journal.append("10001", BankAccount.WITHDRAW, 100, 9900)
+    journal.append("10001", BankAccount.WITHDRAW, 100, 9800)
+    journal.close()
+    size = os.path.getsize(path + ".journal")
+    with open(path + ".journal", "r+b") as torn:
+        torn.truncate(size - 3)
+
+    journal = TransactionJournal(path)
+    records = journal.recover(lambda: {})
+    assert records["2050"].get_balance() == 9900
+    assert journal.append("10002", BankAccount.DEPOSIT, 1, 501) == 2
+    journal.close()
+
+
+def test_atm_recovers_from_the_journal(database, tmp_path):
+    path = str(tmp_path / "accounts")
+    atm = ATM(database, journal=TransactionJournal(path))
+    atm.withdraw(atm.load_account("2050"), 700)
+    assert atm.transfer("10001", "10002", 300)
+    atm.close()
+
+    atm = ATM(database, journal=TransactionJournal(path))
+    try:
+        assert atm.load_account("2050").get_balance() == 9000
+        assert atm.load_account("9014").get_balance() == 10300
+    finally:
+        atm.close()